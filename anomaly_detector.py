@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+import json
+import math
+import sys
+from collections import Counter, deque, namedtuple
+from datetime import datetime, timezone
+
+from join_json_arrays import record_time
+from json_stream import iter_combined_records
+from latency_histogram import LatencyHistogram
+from loganalysis import common
+from loganalysis.common import loggy, provider_of, time_fields
+from loganalysis.stats import stage
+
+"""
+Find 5xx surges, 404 surges and latency spikes in a stream of records, e.g., the 06/11/25 5xx
+surge that we only saw on the CloudWatch dashboards after the fact (ngap-06.11.25/summary.md).
+
+Records are read in time order from the combined log from ngap-logs.py, from JSON lines on stdin
+(-i -, e.g., a live feed) or straight from a CloudWatch log group a page at a time (-g, the
+response log; see download_logs.iter_log_pages()). Each record is added to the current 'step'
+(10s by default) in O(1): counts of requests, 5xx and 404 responses, a LatencyHistogram of
+total_time and counts by provider and instance. When a step ends, the last 'window' (60s) of
+steps is checked against a rolling baseline (an exponentially weighted mean and variance of
+each metric over the last ~'baseline' windows); a window whose 5xx rate, 404 rate or p99
+latency is more than 'threshold' standard deviations above the baseline is reported with the
+providers and instances that contributed the most (the most 5xx or 404 responses, or the most
+responses slower than the baseline p99).
+"""
+
+metrics = ("5xx_rate", "404_rate", "p99_latency")
+
+# The smallest standard deviation used for each metric, so a flat baseline does not flag noise
+min_std = {"5xx_rate": 0.01, "404_rate": 0.01, "p99_latency": 50.0}
+
+Observation = namedtuple("Observation", "time code total_time provider instance")
+
+
+def time_name(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def record_instance(record: dict):
+    """
+    The Hyrax instance that handled a lifecycle record: the instance id of its BES records, if any.
+    """
+    bes = record.get("bes")
+    if isinstance(bes, list):
+        for bes_record in bes:
+            if isinstance(bes_record, dict):
+                for key in ("hyrax-instance-id", "instance-id"):
+                    if key in bes_record:
+                        return bes_record[key]
+    return record.get("instance-id")
+
+
+def observation(record: dict, default_time=None, instance=None):
+    """
+    The Observation for one record, or None if it has no time. default_time is used when the
+    record has no time of its own (e.g., the CloudWatch event timestamp).
+    """
+    seconds = next((t for t in (record_time(record.get(key)) for key in time_fields) if t is not None),
+                   record_time(default_time))
+    if seconds is None:
+        return None
+    code = record.get("http_response_code")
+    total_time = record.get("total_time")
+    return Observation(seconds,
+                       code if isinstance(code, int) else None,
+                       total_time if isinstance(total_time, (int, float)) and not isinstance(total_time, bool)
+                       else None,
+                       provider_of(record.get("collectionId")) if isinstance(record.get("collectionId"), str)
+                       else provider_of(None),
+                       instance or record_instance(record) or "-")
+
+
+def observations_from_records(records):
+    """
+    Yield the Observations for lifecycle (or response log) records.
+    """
+    for record in records:
+        if isinstance(record, dict):
+            obs = observation(record)
+            if obs is not None:
+                yield obs
+
+
+def observations_from_json_lines(fp):
+    """
+    Yield the Observations for one JSON record per line, as the lines arrive (e.g., tail -f).
+    """
+    for line in fp:
+        line = line.strip().rstrip(",")
+        if line.startswith("{"):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                loggy(f"Skipping a line that is not a JSON record: {line[:80]}")
+                continue
+            obs = observation(record)
+            if obs is not None:
+                yield obs
+
+
+def observations_from_pages(pages):
+    """
+    Yield the Observations for pages of CloudWatch events (see download_logs.iter_log_pages()).
+    The event's timestamp is used when the record has no time and its log stream is the instance.
+    """
+    for events in pages:
+        for event in events:
+            message = event.get("message", "")
+            if not message.startswith("{"):
+                continue
+            try:
+                record = json.loads(message)
+            except json.JSONDecodeError:
+                continue
+            obs = observation(record, event.get("timestamp"), event.get("logStreamName"))
+            if obs is not None:
+                yield obs
+
+
+class _Step:
+    """
+    The counts for one step of time.
+    """
+
+    def __init__(self, start: float):
+        self.start = start
+        self.requests = 0
+        self.errors_5xx = 0
+        self.errors_404 = 0
+        self.latency = LatencyHistogram()
+        # The provider and instance counts behind each metric
+        self.contributors = {metric: (Counter(), Counter()) for metric in metrics}
+
+    def add(self, obs: Observation, slow: float = None):
+        """
+        Count one observation; one with a total_time above 'slow' counts toward the latency contributors.
+        """
+        self.requests += 1
+        contributed = []
+        if obs.code is not None and 500 <= obs.code < 600:
+            self.errors_5xx += 1
+            contributed.append(("5xx_rate", 1))
+        elif obs.code == 404:
+            self.errors_404 += 1
+            contributed.append(("404_rate", 1))
+        if obs.total_time is not None:
+            self.latency.record(obs.total_time)
+            if slow is not None and obs.total_time > slow:
+                contributed.append(("p99_latency", 1))
+        for metric, weight in contributed:
+            providers, instances = self.contributors[metric]
+            providers[obs.provider] += weight
+            instances[obs.instance] += weight
+
+
+class _Baseline:
+    """
+    An exponentially weighted mean and variance, updated in O(1).
+    """
+
+    def __init__(self, span: int):
+        self.alpha = 2 / (span + 1)
+        self.mean = None
+        self.variance = 0.0
+        self.count = 0
+
+    def update(self, value: float):
+        self.count += 1
+        if self.mean is None:
+            self.mean = value
+            return
+        difference = value - self.mean
+        increment = self.alpha * difference
+        self.mean += increment
+        self.variance = (1 - self.alpha) * (self.variance + difference * increment)
+
+
+class AnomalyDetector:
+    """
+    Sliding-window 5xx, 404 and latency anomaly detection over Observations in time order.
+    add() returns the anomalies found in the windows that end before the observation;
+    flush() checks the last window.
+    """
+
+    def __init__(self, window: float = 60, step: float = 10, baseline: int = 30, threshold: float = 3.0,
+                 min_requests: int = 20, warmup: int = 10, top: int = 3):
+        """
+        Args:
+            window: The window length in seconds (a whole number of steps)
+            step: How often, in seconds, the window is checked
+            baseline: The number of windows the baseline (roughly) averages over
+            threshold: How many standard deviations above the baseline is an anomaly
+            min_requests: Windows with fewer requests are not checked
+            warmup: The number of windows needed before the baseline is used
+            top: The number of providers and instances reported with each anomaly
+        """
+        if step <= 0 or window < step:
+            raise ValueError("The step must be positive and no longer than the window")
+        self.step = step
+        self.steps = max(1, round(window / step))
+        self.threshold = threshold
+        self.min_requests = min_requests
+        self.warmup = warmup
+        self.top = top
+        self.window = deque()
+        self.current = None
+        self.baselines = {metric: _Baseline(baseline) for metric in metrics}
+        self.windows_checked = 0
+        self.records = 0
+        self.late = 0
+
+    def add(self, obs: Observation) -> list:
+        """
+        Add one observation. Late observations (before the current step) are counted in the current step.
+        """
+        anomalies = []
+        step_start = math.floor(obs.time / self.step) * self.step
+        if self.current is None:
+            self.current = _Step(step_start)
+        elif step_start > self.current.start:
+            # Close the steps up to this one; after a long gap only the last window's worth matter
+            gap = round((step_start - self.current.start) / self.step)
+            anomalies.extend(self._close_step())
+            for i in range(max(1, gap - self.steps), gap):
+                self.current = _Step(step_start - (gap - i) * self.step)
+                anomalies.extend(self._close_step())
+            self.current = _Step(step_start)
+        elif step_start < self.current.start:
+            self.late += 1
+        self.current.add(obs, self.baselines["p99_latency"].mean)
+        self.records += 1
+        return anomalies
+
+    def flush(self) -> list:
+        """
+        Check the window that ends with the current step.
+        """
+        if self.current is None:
+            return []
+        anomalies = self._close_step()
+        self.current = None
+        return anomalies
+
+    def _close_step(self) -> list:
+        self.window.append(self.current)
+        if len(self.window) > self.steps:
+            self.window.popleft()
+        return self._check_window()
+
+    def window_values(self):
+        """
+        The requests and each metric's value for the current window.
+        """
+        requests = sum(step.requests for step in self.window)
+        latency = LatencyHistogram()
+        for step in self.window:
+            latency.merge(step.latency)
+        values = {"5xx_rate": sum(step.errors_5xx for step in self.window) / requests if requests else 0.0,
+                  "404_rate": sum(step.errors_404 for step in self.window) / requests if requests else 0.0,
+                  "p99_latency": latency.percentile(99) or 0.0}
+        return requests, values
+
+    def _top(self, metric: str):
+        providers = Counter()
+        instances = Counter()
+        for step in self.window:
+            step_providers, step_instances = step.contributors[metric]
+            providers.update(step_providers)
+            instances.update(step_instances)
+        return providers.most_common(self.top), instances.most_common(self.top)
+
+    def _check_window(self) -> list:
+        requests, values = self.window_values()
+        if requests < self.min_requests:
+            return []
+        self.windows_checked += 1
+        anomalies = []
+        for metric in metrics:
+            baseline = self.baselines[metric]
+            value = values[metric]
+            if baseline.count >= self.warmup:
+                std = max(math.sqrt(baseline.variance), min_std[metric])
+                z = (value - baseline.mean) / std
+                if z > self.threshold:
+                    providers, instances = self._top(metric)
+                    anomalies.append({"start": time_name(self.window[0].start),
+                                      "end": time_name(self.window[-1].start + self.step),
+                                      "metric": metric, "value": round(value, 4),
+                                      "baseline": round(baseline.mean, 4), "z": round(z, 1),
+                                      "requests": requests, "top_providers": providers,
+                                      "top_instances": instances})
+                    continue    # keep the anomaly out of the baseline
+            baseline.update(value)
+        return anomalies
+
+
+def detect(observations, detector: AnomalyDetector):
+    """
+    Yield the anomalies in a stream of Observations as they are found.
+    """
+    for obs in observations:
+        yield from detector.add(obs)
+    yield from detector.flush()
+
+
+def format_anomaly(anomaly: dict) -> str:
+    providers = ", ".join(f"{name} ({count:g})" for name, count in anomaly["top_providers"])
+    instances = ", ".join(f"{name} ({count:g})" for name, count in anomaly["top_instances"])
+    return (f"{anomaly['start']} - {anomaly['end']} {anomaly['metric']} {anomaly['value']:g} "
+            f"(baseline {anomaly['baseline']:g}, z {anomaly['z']:g}, {anomaly['requests']} requests) "
+            f"providers: {providers or '-'} instances: {instances or '-'}")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Flag windows of time with 5xx or 404 surges or latency spikes "
+                                                 "compared to a rolling baseline, with the providers and "
+                                                 "instances that contributed the most.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", help="The combined log (or response log), or - for one JSON record per "
+                                              "line on stdin. default: hyrax_combined_logs.json",
+                        default="hyrax_combined_logs.json")
+    parser.add_argument("-g", "--log-group", help="Read this CloudWatch log group (e.g., the response log) a page "
+                                                  "at a time instead of --input.", default="")
+    parser.add_argument("-s", "--start-time", help="With -g, the start time (YYYY-MM-DDTHH:MM:SS)", default="")
+    parser.add_argument("-e", "--end-time", help="With -g, the end time; default: now", default="")
+    parser.add_argument("-w", "--window", help="The window in seconds. default: 60", type=float, default=60)
+    parser.add_argument("--step", help="How often the window is checked, in seconds. default: 10", type=float,
+                        default=10)
+    parser.add_argument("-b", "--baseline", help="The baseline span in windows. default: 30", type=int, default=30)
+    parser.add_argument("-t", "--threshold", help="Standard deviations above the baseline. default: 3", type=float,
+                        default=3.0)
+    parser.add_argument("-m", "--min-requests", help="Skip windows with fewer requests. default: 20", type=int,
+                        default=20)
+    parser.add_argument("-j", "--json", help="Print each anomaly as a JSON line.", action="store_true")
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    try:
+        detector = AnomalyDetector(args.window, args.step, args.baseline, args.threshold, args.min_requests)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.log_group:
+        from download_logs import iter_log_pages
+        observations = observations_from_pages(iter_log_pages(args.log_group, args.start_time, args.end_time))
+    elif args.input == "-":
+        observations = observations_from_json_lines(sys.stdin)
+    else:
+        observations = observations_from_records(iter_combined_records(args.input))
+
+    found = 0
+    # The records are read as they are checked, so this one stage is the whole run
+    with stage("detect") as detecting:
+        for anomaly in detect(observations, detector):
+            found += 1
+            print(json.dumps(anomaly) if args.json else format_anomaly(anomaly), flush=True)
+        detecting.records_in = detector.records
+        detecting.records_out = found
+
+    print(f"# {detector.records} records, {detector.windows_checked} windows checked, {found} anomalies"
+          + (f", {detector.late} late records" if detector.late else ""), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from json_stream import iter_json_records
+from loganalysis import common
+from loganalysis.common import loggy
+
+"""
+Time and memory-profile the tools on synthetic logs (synthetic_logs.py) and keep a history, so
+a change that makes the merge slower (or faster) shows up as a number instead of a feeling.
+This replaces the one hand-made cProfile note in the ngap-logs.py header (12145 requests,
+104658 BES records, 181 s).
+
+Each benchmark runs the same code as its 'loganalysis' command (merge, join, split, report)
+or, for download-write, download_logs.write_logs() on the request log as CloudWatch events.
+Each run is in a new process, so its peak RSS is its own. The setup (e.g., the merge that
+report needs) runs before, in another process, so it is neither timed nor in the peak RSS. The best of --repeat runs is kept: wall and
+CPU time, records per second and peak RSS (and, with --tracemalloc, the peak of the Python
+heap). The results are appended to a JSON history (a list of runs, each with the time, git
+commit, Python version, scale and results) and compared with the last run at the same scale.
+
+The logs are made once for each scale and seed and kept in --data.
+"""
+
+benchmark_names = ("merge", "merge-sort", "join", "split", "download-write", "report")
+
+
+def _tool_command(command: str, args: list):
+    """
+    A callable that runs a loganalysis command with its output thrown away.
+    """
+    from loganalysis.cli import main as loganalysis_main
+
+    def run():
+        argv = sys.argv
+        try:
+            loganalysis_main([command] + args)
+        finally:
+            sys.argv = argv
+    return run
+
+
+def merge_arguments(files: dict, work_dir: str) -> list:
+    paths = files["files"]
+    return ["-q", paths["request_log"], "-r", paths["response_log"], "-b", paths["bes_log"],
+            "-o", os.path.join(work_dir, "hyrax_combined_logs.json")]
+
+
+def prepare_benchmark(name: str, files: dict, work_dir: str):
+    """
+    Make the inputs a benchmark needs besides the synthetic logs in work_dir: the combined log for
+    report, the CloudWatch events for download-write and the bes.log link for split. run_benchmark()
+    does this in a process of its own, so none of it is in the benchmark's peak RSS.
+    """
+    paths = files["files"]
+    if name == "split":
+        # split writes next to its input and the per-pid files in the current directory
+        os.symlink(os.path.abspath(paths["bes_raw_log"]), os.path.join(work_dir, "bes.log"))
+    elif name == "download-write":
+        with open(os.path.join(work_dir, "events.json"), 'w') as f:
+            f.write("[")
+            for i, record in enumerate(iter_json_records(paths["request_log"])):
+                timestamp = record.pop("cloudwatch_timestamp", 0)
+                f.write(("," if i else "") + json.dumps({"logStreamName": "hyrax-request-log", "timestamp": timestamp,
+                                                        "eventId": str(i), "message": json.dumps(record),
+                                                        "ingestionTime": timestamp + 1000}))
+            f.write("]")
+    elif name == "report":
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null), contextlib.redirect_stderr(null):
+            _tool_command("merge", merge_arguments(files, work_dir))()
+    elif name not in benchmark_names:
+        raise ValueError(f"Unknown benchmark '{name}'; use one of {', '.join(benchmark_names)}")
+
+
+def setup_benchmark(name: str, files: dict, work_dir: str):
+    """
+    Get ready to run a benchmark whose inputs prepare_benchmark() made in work_dir.
+    Returns (a callable that runs it, the number of records it processes).
+    """
+    counts = files["counts"]
+    paths = files["files"]
+    merge_args = merge_arguments(files, work_dir)
+    if name == "merge":
+        return _tool_command("merge", merge_args), counts["request_log"]
+    if name == "merge-sort":
+        return _tool_command("merge", merge_args + ["-s"]), counts["request_log"]
+    if name == "join":
+        return _tool_command("join", ["-l", paths["request_log"], "-r", paths["response_log"],
+                                      "-o", os.path.join(work_dir, "joined.json")]), counts["request_log"]
+    if name == "split":
+        os.chdir(work_dir)
+        return _tool_command("split", ["-i", os.path.join(work_dir, "bes.log"), "-s"]), counts["bes_log"]
+    if name == "download-write":
+        from download_logs import write_logs
+        # The events are write_logs()'s input, held in memory as get_logs() returns them
+        events = list(iter_json_records(os.path.join(work_dir, "events.json")))
+        output = os.path.join(work_dir, "request_log.json")
+        return (lambda: write_logs(events, output, "cloudwatch_timestamp")), len(events)
+    if name == "report":
+        return _tool_command("report", ["-i", os.path.join(work_dir, "hyrax_combined_logs.json"), "-n"]), \
+            counts["request_log"]
+    raise ValueError(f"Unknown benchmark '{name}'; use one of {', '.join(benchmark_names)}")
+
+
+def peak_rss_mb() -> float:
+    """
+    The peak resident set size of this process in MB (ru_maxrss is KB on Linux, bytes on macOS).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure(name: str, files: dict, trace: bool = False, work_dir: str = None) -> dict:
+    """
+    Run one benchmark once, in this process (see run_benchmark() for a new process each time), on
+    the inputs prepare_benchmark() made in work_dir, or in a temporary directory it prepares here.
+    Returns: The wall and CPU seconds, the peak RSS before and after (MB) and, with trace, the
+    tracemalloc peak (MB)
+    """
+    if work_dir is None:
+        with tempfile.TemporaryDirectory() as work_dir:
+            prepare_benchmark(name, files, work_dir)
+            return measure(name, files, trace, work_dir)
+    cwd = os.getcwd()
+    try:
+        run, records = setup_benchmark(name, files, work_dir)
+        rss_before = peak_rss_mb()
+        if trace:
+            import tracemalloc
+            tracemalloc.start()
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null), contextlib.redirect_stderr(null):
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            run()
+            cpu = time.process_time() - cpu
+            wall = time.perf_counter() - wall
+        result = {"wall_s": wall, "cpu_s": cpu, "records": records, "setup_rss_mb": rss_before,
+                  "peak_rss_mb": peak_rss_mb()}
+        if trace:
+            result["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        return result
+    finally:
+        os.chdir(cwd)
+
+
+def run_benchmark(name: str, files: dict, repeat: int = 3, trace: bool = False) -> dict:
+    """
+    Run a benchmark 'repeat' times, each in a new process, and keep the fastest run.
+    Returns: The fastest run's measurements plus 'wall_s_median', 'records_per_s' and 'runs'
+    """
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        with context.Pool(1) as pool:
+            pool.apply(prepare_benchmark, (name, files, work_dir))
+        for _ in range(repeat):
+            with context.Pool(1) as pool:
+                runs.append(pool.apply(measure, (name, files, trace, work_dir)))
+    best = dict(min(runs, key=lambda run: run["wall_s"]))
+    best["wall_s_median"] = statistics.median(run["wall_s"] for run in runs)
+    best["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+    best["records_per_s"] = best["records"] / best["wall_s"] if best["wall_s"] else None
+    best["runs"] = len(runs)
+    return best
+
+
+def prepare_data(data_dir: str, scale: float, seed: int) -> dict:
+    """
+    Make the synthetic logs for a scale and seed, unless they are already in data_dir.
+    Returns: The counts and file names from synthetic_logs.generate_logs()
+    """
+    directory = os.path.abspath(os.path.join(data_dir, f"scale-{scale:g}-seed-{seed}"))
+    manifest = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            return json.load(f)
+    from synthetic_logs import generate_logs
+    loggy(f"Making the logs for scale {scale:g} in {directory}")
+    files = generate_logs(directory, scale, seed=seed, bes_format="both")
+    with open(manifest, 'w') as f:
+        json.dump(files, f, indent=2)
+    return files
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(history_file: str) -> list:
+    if not history_file or not os.path.exists(history_file):
+        return []
+    with open(history_file) as f:
+        return json.load(f)
+
+
+def previous_run(history: list, scale: float, seed: int, trace: bool = False):
+    """
+    The most recent run in the history with the same scale, seed and tracemalloc setting, or None.
+    """
+    return next((run for run in reversed(history) if run.get("scale") == scale and run.get("seed") == seed
+                 and run.get("tracemalloc", False) == trace), None)
+
+
+def print_results(results: dict, previous=None):
+    """
+    Print a table of the results, with the change in wall time and peak RSS since the previous run.
+    """
+    print(f"{'benchmark':15} {'records':>9} {'wall s':>8} {'cpu s':>8} {'rec/s':>10} {'peak MB':>8}  change")
+    for name, result in results.items():
+        change = ""
+        before = (previous or {}).get("results", {}).get(name)
+        if before and before.get("wall_s"):
+            change = f"wall {100 * (result['wall_s'] / before['wall_s'] - 1):+.1f}%, " \
+                     f"rss {100 * (result['peak_rss_mb'] / before['peak_rss_mb'] - 1):+.1f}%"
+        print(f"{name:15} {result['records']:9d} {result['wall_s']:8.2f} {result['cpu_s']:8.2f} "
+              f"{result['records_per_s'] or 0:10.0f} {result['peak_rss_mb']:8.1f}  {change}")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Time and memory-profile merge, join, split, download-write and "
+                                                 "report on synthetic logs and add the results to a JSON history.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-s", "--scale", help="Hours of synthetic traffic (12145 requests each). default: 1",
+                        type=float, default=1.0)
+    parser.add_argument("--seed", help="The random seed for the logs. default: 0", type=int, default=0)
+    parser.add_argument("-b", "--benchmarks", help=f"Comma separated benchmarks. default: {','.join(benchmark_names)}",
+                        default=",".join(benchmark_names))
+    parser.add_argument("-r", "--repeat", help="Runs of each benchmark; the fastest is kept. default: 3",
+                        type=int, default=3)
+    parser.add_argument("-t", "--tracemalloc", help="Also record the peak of the Python heap (slower).",
+                        action="store_true")
+    parser.add_argument("-d", "--data", help="Where to keep the synthetic logs. default: benchmark_data",
+                        default="benchmark_data")
+    parser.add_argument("-H", "--history", help="The JSON history file. default: benchmark_history.json",
+                        default="benchmark_history.json")
+    parser.add_argument("-n", "--no-history", help="Do not add this run to the history.", action="store_true")
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    names = [name for name in args.benchmarks.split(",") if name]
+    for name in names:
+        if name not in benchmark_names:
+            parser.error(f"Unknown benchmark '{name}'; use one of {', '.join(benchmark_names)}")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    files = prepare_data(args.data, args.scale, args.seed)
+    results = {}
+    for name in names:
+        loggy(f"Running {name}")
+        results[name] = run_benchmark(name, files, args.repeat, args.tracemalloc)
+
+    history = load_history(args.history)
+    print_results(results, previous_run(history, args.scale, args.seed, args.tracemalloc))
+    if not args.no_history:
+        history.append({"time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), "commit": git_commit(),
+                        "python": platform.python_version(), "platform": platform.platform(),
+                        "scale": args.scale, "seed": args.seed, "tracemalloc": args.tracemalloc,
+                        "counts": files["counts"], "results": results})
+        with open(args.history, 'w') as f:
+            json.dump(history, f, indent=2)
+        loggy(f"Added the results to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
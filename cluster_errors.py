@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import json
+import re
+from datetime import datetime, timezone
+
+from json_stream import iter_json_records, JsonArrayWriter
+from log_processing import is_raw_bes_log, read_bes_log_records
+from loganalysis import common
+from loganalysis.common import loggy
+from loganalysis.stats import stage
+
+"""
+Group the messages in a BES log into templates instead of splitting errors.json by hand with
+jq 'contains("BESUtil.cc:298")' and friends (see the README). Each 'hyrax-message' is split into
+tokens; paths, URLs, ids, IP addresses and numbers are masked (source locations like
+NgapApi.cc:304 are kept, since they are what tells errors apart); and the message is assigned,
+in one pass, to a template using a Drain-style fixed-depth parse tree:
+
+    token count -> the first few tokens -> the templates in that leaf
+
+A message joins the most similar template in its leaf (the fraction of the tokens that match)
+if that is at least 'similarity', and the tokens that differ become <*>; otherwise it starts a
+new template. Each template gets a count, the first and last times it was seen and a few
+example request ids. The BES log is written by one process per pid, so the request id of a
+message is the last one logged by its (instance, pid).
+
+The log can be a JSON array (e.g., errors.json), raw JSON records or a raw bes.log.
+"""
+
+wildcard = "<*>"
+default_types = ("error", "info")
+
+# Masks applied to each token, in order. A token that matches is replaced by the mask.
+masks = [
+    (re.compile(r"^[a-z][a-z0-9+.-]*://\S+$", re.IGNORECASE), "<URL>"),
+    (re.compile(r"^\S*/\S*$"), "<PATH>"),
+    (re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\S*$", re.IGNORECASE), "<ID>"),
+    (re.compile(r"^\S*_[0-9a-f]{8}-[0-9a-f]{4}-\S*$", re.IGNORECASE), "<ID>"),   # request ids
+    (re.compile(r"^(\d{1,3}\.){3}\d{1,3}(:\d+)?$"), "<IP>"),
+    (re.compile(r"^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}:\d{2}\S*)?$"), "<TIME>"),
+    (re.compile(r"^(0x)?[0-9a-f]*\d[0-9a-f]*$", re.IGNORECASE), "<NUM>"),
+    (re.compile(r"^[-+]?\d+([.,:]\d+)*[a-z%]{0,3}$", re.IGNORECASE), "<NUM>"),
+]
+# Punctuation stripped from a token before it is masked (and put back after)
+token_punctuation = "()[]{}'\",;"
+
+
+def mask_token(token: str) -> str:
+    core = token.strip(token_punctuation)
+    if not core:
+        return token
+    for pattern, mask in masks:
+        if pattern.match(core):
+            start = token.index(core)
+            return token[:start] + mask + token[start + len(core):]
+    return token
+
+
+def tokenize_message(message: str) -> list:
+    """
+    Split a message into masked tokens.
+    """
+    return [mask_token(token) for token in message.split()]
+
+
+def has_variable(token: str) -> bool:
+    return token.startswith("<") and token.endswith(">") or any(char.isdigit() for char in token)
+
+
+class Template:
+    """
+    A message template: the tokens with <*> where the messages differ.
+    """
+
+    def __init__(self, template_id: int, tokens: list):
+        self.id = template_id
+        self.tokens = tokens
+        self.count = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.types = {}
+        self.examples = []
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.tokens)
+
+    def similarity(self, tokens: list) -> float:
+        same = sum(1 for mine, theirs in zip(self.tokens, tokens) if mine == theirs and mine != wildcard)
+        return same / len(tokens) if tokens else 1.0
+
+    def merge(self, tokens: list):
+        self.tokens = [mine if mine == theirs else wildcard for mine, theirs in zip(self.tokens, tokens)]
+
+    def to_dict(self) -> dict:
+        return {"template_id": self.id, "template": self.text, "count": self.count, "types": self.types,
+                "first_seen": self.first_seen, "last_seen": self.last_seen, "examples": self.examples}
+
+
+class TemplateMiner:
+    """
+    A Drain-style template miner. add() assigns a message to a template in time that does not
+    depend on the number of messages seen so far.
+    """
+
+    def __init__(self, depth: int = 4, similarity: float = 0.5, max_children: int = 100, max_examples: int = 3):
+        """
+        Args:
+            depth: The depth of the parse tree; the first depth - 2 tokens select the leaf
+            similarity: The fraction of tokens that must match to join a template
+            max_children: The most children of a tree node; more tokens share a <*> child
+            max_examples: The number of example request ids kept for each template
+        """
+        self.prefix_tokens = max(depth - 2, 1)
+        self.similarity = similarity
+        self.max_children = max_children
+        self.max_examples = max_examples
+        self.root = {}
+        self.templates = []
+
+    def _leaf(self, tokens: list) -> list:
+        node = self.root.setdefault(len(tokens), {})
+        for token in tokens[:self.prefix_tokens]:
+            key = wildcard if has_variable(token) else token
+            if key not in node and len(node) >= self.max_children:
+                key = wildcard
+            node = node.setdefault(key, {})
+        return node.setdefault(None, [])    # the templates are under the key None
+
+    def add(self, message: str) -> Template:
+        tokens = tokenize_message(message)
+        leaf = self._leaf(tokens)
+        best = None
+        best_similarity = -1.0
+        for template in leaf:
+            similarity = template.similarity(tokens)
+            if similarity > best_similarity:
+                best, best_similarity = template, similarity
+        if best is not None and best_similarity >= self.similarity:
+            best.merge(tokens)
+            return best
+        template = Template(len(self.templates) + 1, tokens)
+        leaf.append(template)
+        self.templates.append(template)
+        return template
+
+
+def time_name(value):
+    """
+    A BES log time (seconds since the epoch) as an ISO 8601 string; other values are returned as they are.
+    """
+    try:
+        return datetime.fromtimestamp(float(value), tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    except (TypeError, ValueError, OverflowError):
+        return value
+
+
+def iter_bes_records(source_file: str, prefix: str = "hyrax-"):
+    """
+    The records of a BES log: a JSON array, raw JSON records or a raw bes.log.
+    """
+    if is_raw_bes_log(source_file):
+        return read_bes_log_records(source_file, prefix)
+    return iter_json_records(source_file)
+
+
+def cluster_messages(records, miner: TemplateMiner, types=default_types, prefix: str = "hyrax-",
+                     assignments=None):
+    """
+    Assign the messages of the given types to templates in one pass.
+    Args:
+        records: BES log records, in log order
+        miner: The TemplateMiner
+        types: The record types (hyrax-type) to cluster
+        prefix: The BES key prefix
+        assignments: If given, a callable that gets (record, template) for each clustered record
+
+    Returns: The number of records clustered
+    """
+    type_key, message_key, time_key = prefix + "type", prefix + "message", prefix + "time"
+    request_id_key, instance_key, pid_key = prefix + "request-id", prefix + "instance-id", prefix + "pid"
+    latest_request = {}     # (instance, pid) -> the last request id it logged
+    clustered = 0
+
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        process = (record.get(instance_key), record.get(pid_key))
+        if record.get(request_id_key):
+            latest_request[process] = record[request_id_key]
+        record_type = record.get(type_key)
+        message = record.get(message_key)
+        if record_type not in types or not isinstance(message, str):
+            continue
+
+        template = miner.add(message)
+        template.count += 1
+        template.types[record_type] = template.types.get(record_type, 0) + 1
+        time = record.get(time_key)
+        if time is not None:
+            if template.first_seen is None:
+                template.first_seen = time
+            template.last_seen = time
+        request_id = record.get(request_id_key) or latest_request.get(process)
+        if request_id and len(template.examples) < miner.max_examples and request_id not in template.examples:
+            template.examples.append(request_id)
+        if assignments is not None:
+            assignments(record, template)
+        clustered += 1
+
+    loggy(f"Clustered {clustered} messages into {len(miner.templates)} templates")
+    return clustered
+
+
+def print_templates(templates, limit: int = 0):
+    """
+    Print the templates, most common first: count, first and last seen, the template and examples.
+    """
+    templates = sorted(templates, key=lambda template: -template.count)
+    for template in templates[:limit] if limit else templates:
+        print(f"{template.count:8d}  {time_name(template.first_seen)} - {time_name(template.last_seen)}  "
+              f"#{template.id} {template.text}")
+        if template.examples:
+            print(f"{'':10}e.g., {', '.join(template.examples)}")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Group the error and info messages in a BES log into templates "
+                                                 "and report the count, first and last times and example request "
+                                                 "ids of each.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", help="The BES log: JSON (e.g., errors.json) or a raw bes.log. "
+                                              "default: bes_log.json", default="bes_log.json")
+    parser.add_argument("-p", "--bes_prefix", help="The prefix of the BES log keys. default: hyrax-",
+                        default="hyrax-")
+    parser.add_argument("-t", "--types", help=f"Comma separated record types. default: {','.join(default_types)}",
+                        default=",".join(default_types))
+    parser.add_argument("-s", "--similarity", help="How similar a message must be to join a template (0-1). "
+                                                   "default: 0.5", type=float, default=0.5)
+    parser.add_argument("-d", "--depth", help="The parse tree depth. default: 4", type=int, default=4)
+    parser.add_argument("-n", "--limit", help="Only print the most common N templates.", type=int, default=0)
+    parser.add_argument("-j", "--json", help="Write the templates as a JSON array to this file.", default=None)
+    parser.add_argument("-a", "--assignments", help="Write the clustered records, each with its 'template-id', "
+                                                    "as a JSON array to this file.", default=None)
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    miner = TemplateMiner(args.depth, args.similarity)
+    types = [record_type for record_type in args.types.split(",") if record_type]
+    records = iter_bes_records(args.input, args.bes_prefix)
+
+    with stage("cluster") as clustering:
+        if args.assignments:
+            with open(args.assignments, 'w') as f, JsonArrayWriter(f, indent=2) as writer:
+                clustering.records_in = cluster_messages(
+                    records, miner, types, args.bes_prefix,
+                    lambda record, template: writer.write({**record, "template-id": template.id}))
+        else:
+            clustering.records_in = cluster_messages(records, miner, types, args.bes_prefix)
+        clustering.records_out = len(miner.templates)
+
+    with stage("write") as writing:
+        print_templates(miner.templates, args.limit)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump([template.to_dict() for template in sorted(miner.templates, key=lambda t: -t.count)],
+                          f, indent=2)
+        writing.records_out = len(miner.templates)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from json_stream import iter_combined_records
+from join_json_arrays import record_time
+from loganalysis import common
+from loganalysis.common import loggy, time_fields
+from loganalysis.stats import stage
+
+"""
+A columnar sidecar for the combined log made by ngap-logs.py. The sidecar holds the flat scalar
+fields of each lifecycle record (http_response_code, total_time, collectionId, user_id, ...) as
+one array per field, plus:
+    bes_count: the number of BES records
+    bes_action: the hyrax-bes-action (get.dmr, get.dap, ...) of the BES request record
+    epoch_time: the cloudwatch_timestamp or time_completed in seconds since the epoch
+    record_offset, record_length: where the record is in the combined log
+so the report, query and analysis tools can load just the columns they need instead of parsing
+the JSON. It is written next to the log as <log>.npz (NumPy) or <log>.parquet (needs pyarrow),
+either by 'ngap-logs.py -c npz' while it merges or by this script for an existing log.
+
+Numeric columns load as int64 or float64 arrays (numpy masked arrays if some records lack the
+field). String columns load as a StringColumn of int32 codes (-1 for missing) and the list of
+distinct values, so a test on the values is done once per distinct value.
+"""
+
+sidecar_version = 1
+sidecar_formats = ("npz", "parquet")
+meta_key = "combined_columns"
+
+# The BES request record field for bes_action, with and without the usual CloudWatch prefix
+bes_action_keys = ("hyrax-bes-action", "bes-action")
+
+StringColumn = namedtuple("StringColumn", "codes values")
+
+
+def sidecar_path(combined_log_file: str, sidecar_format: str = "npz") -> str:
+    """
+    The name of the sidecar for a combined log: <log>.npz or <log>.parquet.
+    """
+    if sidecar_format not in sidecar_formats:
+        raise ValueError(f"The sidecar format must be one of {', '.join(sidecar_formats)}")
+    return f"{combined_log_file}.{sidecar_format}"
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float))
+
+
+def _column_array(values: list):
+    """
+    Make a column from a list of values: an int64 or float64 array (masked where a value is
+    None) if every value is a number, otherwise a StringColumn.
+    """
+    present = [value for value in values if value is not None]
+    if all(_is_number(value) for value in present):
+        is_float = any(isinstance(value, float) for value in present)
+        data = np.array([0 if value is None else value for value in values],
+                        dtype=np.float64 if is_float else np.int64)
+        if len(present) == len(values):
+            return data
+        return np.ma.MaskedArray(data, mask=np.array([value is None for value in values]))
+
+    codes = np.empty(len(values), dtype=np.int32)
+    index = {}
+    for i, value in enumerate(values):
+        codes[i] = -1 if value is None else index.setdefault(str(value), len(index))
+    return StringColumn(codes, list(index))
+
+
+def bes_action(record: dict):
+    """
+    The BES action (e.g., get.dmr) of a lifecycle record, from the first of its BES records that has one.
+    """
+    bes = record.get("bes")
+    if isinstance(bes, list):
+        for bes_record in bes:
+            if isinstance(bes_record, dict):
+                for key in bes_action_keys:
+                    if key in bes_record:
+                        return bes_record[key]
+    return None
+
+
+class ColumnBuilder:
+    """
+    Collects the sidecar columns one lifecycle record at a time; save() writes the sidecar.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.count = 0
+
+    def add(self, record: dict, offset: int = -1, length: int = -1):
+        row = {key: value for key, value in record.items()
+               if value is None or isinstance(value, (str, int, float))}
+        bes = record.get("bes")
+        row["bes_count"] = len(bes) if isinstance(bes, list) else 0
+        row["bes_action"] = bes_action(record)
+        row["epoch_time"] = next((seconds for seconds in (record_time(record.get(field)) for field in time_fields)
+                                  if seconds is not None), None)
+        row["record_offset"] = offset
+        row["record_length"] = length
+
+        for name, value in row.items():
+            if name not in self.columns:
+                self.columns[name] = [None] * self.count
+            self.columns[name].append(value)
+        self.count += 1
+        for column in self.columns.values():
+            if len(column) < self.count:
+                column.append(None)
+
+    def arrays(self) -> dict:
+        return {name: _column_array(values) for name, values in self.columns.items()}
+
+    def save(self, path: str, combined_log_file: str):
+        """
+        Write the sidecar for combined_log_file (which must be complete) to path; the format
+        comes from the extension of path.
+        """
+        meta = {"version": sidecar_version, "count": self.count,
+                "source_size": os.path.getsize(combined_log_file), "columns": list(self.columns)}
+        if path.endswith(".parquet"):
+            _save_parquet(path, self.arrays(), meta)
+        else:
+            _save_npz(path, self.arrays(), meta)
+        loggy(f"Wrote {len(self.columns)} columns for {self.count} records to {path}")
+
+
+def _save_npz(path: str, columns: dict, meta: dict):
+    arrays = {"__meta__": np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)}
+    for name, column in columns.items():
+        if isinstance(column, StringColumn):
+            # Store the distinct values as one UTF-8 blob and the offsets of each in it
+            encoded = [value.encode("utf-8") for value in column.values]
+            arrays[f"{name}.codes"] = column.codes
+            arrays[f"{name}.blob"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+            arrays[f"{name}.offsets"] = np.cumsum([0] + [len(value) for value in encoded], dtype=np.int64)
+        elif isinstance(column, np.ma.MaskedArray):
+            arrays[name] = column.data
+            arrays[f"{name}.mask"] = np.ma.getmaskarray(column)
+        else:
+            arrays[name] = column
+    # np.savez() would add .npz to a name that lacks it
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def _save_parquet(path: str, columns: dict, meta: dict):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrays = {}
+    for name, column in columns.items():
+        if isinstance(column, StringColumn):
+            indices = pa.array(column.codes, mask=column.codes < 0)
+            arrays[name] = pa.DictionaryArray.from_arrays(indices, pa.array(column.values, type=pa.string()))
+        elif isinstance(column, np.ma.MaskedArray):
+            arrays[name] = pa.array(column.data, mask=np.ma.getmaskarray(column))
+        else:
+            arrays[name] = pa.array(column)
+    table = pa.table(arrays).replace_schema_metadata({meta_key: json.dumps(meta)})
+    pq.write_table(table, path)
+
+
+def load_columns(path: str, names=None):
+    """
+    Load a sidecar.
+    Args:
+        path: The .npz or .parquet sidecar
+        names: The columns to load; None for all of them. Missing columns are left out.
+
+    Returns: A tuple of (dict of name -> column, the sidecar's metadata dict)
+    """
+    if path.endswith(".parquet"):
+        return _load_parquet(path, names)
+
+    columns = {}
+    with np.load(path) as npz:
+        meta = json.loads(npz["__meta__"].tobytes().decode("utf-8"))
+        for name in meta["columns"] if names is None else names:
+            if f"{name}.codes" in npz.files:
+                blob = npz[f"{name}.blob"].tobytes()
+                offsets = npz[f"{name}.offsets"].tolist()
+                values = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+                columns[name] = StringColumn(npz[f"{name}.codes"], values)
+            elif name in npz.files:
+                data = npz[name]
+                columns[name] = np.ma.MaskedArray(data, mask=npz[f"{name}.mask"]) \
+                    if f"{name}.mask" in npz.files else data
+    return columns, meta
+
+
+def _load_parquet(path: str, names=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(path)
+    meta = json.loads(schema.metadata[meta_key.encode()].decode("utf-8"))
+    names = [name for name in (meta["columns"] if names is None else names) if name in schema.names]
+    table = pq.read_table(path, columns=names)
+    columns = {}
+    for name in names:
+        column = table.column(name).combine_chunks()
+        if pa.types.is_dictionary(column.type):
+            codes = column.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int32)
+            columns[name] = StringColumn(codes, column.dictionary.to_pylist())
+        elif column.null_count:
+            data = column.fill_null(0).to_numpy(zero_copy_only=False)
+            columns[name] = np.ma.MaskedArray(data, mask=column.is_null().to_numpy(zero_copy_only=False))
+        else:
+            columns[name] = column.to_numpy(zero_copy_only=False)
+    return columns, meta
+
+
+def column_values(column) -> list:
+    """
+    The values of a column as a list of Python values, with None where a value is missing.
+    """
+    if isinstance(column, StringColumn):
+        values = column.values + [None]  # code -1 picks the None
+        return [values[code] for code in column.codes.tolist()]
+    return column.tolist()
+
+
+def iter_column_records(columns: dict):
+    """
+    Yield a dict for each record with the given columns, e.g., to reuse predicates written for
+    the JSON records. A missing value is None; bes_count also appears as 'bes'.
+    """
+    names = list(columns)
+    values = [column_values(columns[name]) for name in names]
+    if "bes_count" in columns:
+        names.append("bes")
+        values.append(values[names.index("bes_count")])
+    for row in zip(*values):
+        yield dict(zip(names, row))
+
+
+def find_sidecar(combined_log_file: str):
+    """
+    The sidecar for a combined log if there is one and it was made from the current log, else None.
+    """
+    for sidecar_format in sidecar_formats:
+        path = sidecar_path(combined_log_file, sidecar_format)
+        if not os.path.exists(path):
+            continue
+        if os.path.getmtime(path) < os.path.getmtime(combined_log_file):
+            loggy(f"{path} is older than {combined_log_file}")
+            continue
+        if sidecar_format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                continue
+        try:
+            _, meta = load_columns(path, names=[])
+        except (OSError, ValueError, KeyError):
+            continue
+        if meta.get("version") == sidecar_version and meta.get("source_size") == os.path.getsize(combined_log_file):
+            return path
+    return None
+
+
+def load_combined_columns(combined_log_file: str, names: list) -> dict:
+    """
+    Load some columns for a combined log: from its sidecar if it has a current one, otherwise by
+    reading the JSON a record at a time (the sidecar is not saved). Columns that no record has
+    are left out.
+    """
+    path = find_sidecar(combined_log_file)
+    if path is not None:
+        loggy(f"Reading the columnar sidecar {path}")
+        return load_columns(path, names)[0]
+
+    loggy(f"No current sidecar for {combined_log_file}; reading the JSON")
+    builder = ColumnBuilder()
+    for offset, length, record in iter_combined_records(combined_log_file, with_offsets=True):
+        builder.add(record, offset, length)
+    arrays = builder.arrays()
+    return {name: arrays[name] for name in names if name in arrays}
+
+
+def numeric_column(column, count: int, fill=0, dtype=np.float64):
+    """
+    A column as a plain numeric array with 'fill' where a value is missing (or, for a string
+    column, not a number). A missing column (None) is all 'fill'.
+    """
+    if column is None:
+        return np.full(count, fill, dtype=dtype)
+    if isinstance(column, StringColumn):
+        numbers = []
+        for value in column.values:
+            try:
+                numbers.append(float(value))
+            except ValueError:
+                numbers.append(fill)
+        return np.array(numbers + [fill], dtype=dtype)[column.codes]  # code -1 picks the fill
+    if isinstance(column, np.ma.MaskedArray):
+        return np.ma.filled(column.astype(dtype), fill)
+    return np.asarray(column, dtype=dtype)
+
+
+def build_sidecar(combined_log_file: str, sidecar_format: str = "npz") -> str:
+    """
+    Write the sidecar for an existing combined log in one streaming pass. Returns its name.
+    """
+    builder = ColumnBuilder()
+    with stage("load") as loading:
+        for offset, length, record in iter_combined_records(combined_log_file, with_offsets=True):
+            builder.add(record, offset, length)
+        loading.records_in = loading.records_out = builder.count
+    path = sidecar_path(combined_log_file, sidecar_format)
+    with stage("write") as writing:
+        builder.save(path, combined_log_file)
+        writing.records_out = builder.count
+    return path
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Write a columnar sidecar (<log>.npz or <log>.parquet) with the "
+                                                 "scalar fields of each record in a combined log from ngap-logs.py. "
+                                                 "combined_report.py and combined_query.py use it when it is "
+                                                 "current.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", help="The combined log. default: hyrax_combined_logs.json",
+                        default="hyrax_combined_logs.json")
+    parser.add_argument("-f", "--format", help="The sidecar format. default: npz", choices=sidecar_formats,
+                        default="npz")
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    print(f"Wrote {build_sidecar(args.input, args.format)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+
+import base64
+import bisect
+import gzip
+import json
+import os
+import re
+import sys
+from collections import defaultdict
+
+from json_stream import iter_combined_records, read_record_at, JsonArrayWriter
+from loganalysis import common
+from loganalysis.common import loggy
+from loganalysis.stats import stage
+
+"""
+Query the combined log made by ngap-logs.py (hyrax_combined_logs.json) without re-scanning it.
+The first query builds an index next to the log (<log>.qidx) that holds the byte offset of each
+record, a bitmap of the records for each HTTP status code, a bitmap of the records that have a
+BES component, a sorted (prefix) index of collectionId values and hash indexes of user_id and
+user_ip. A query is answered from the index and only the records that match are read.
+
+A query is a predicate like:
+    code=404 and collectionId^=/hyrax/ngap and not has(bes)
+    (code>=500 or code=4xx) and collectionId~=POCLOUD
+    user_id=someone or user_ip="10.0.0.1"
+
+Fields: code (or http_response_code), collectionId (or collection), user_id (or user), user_ip (or ip)
+Operators: = and != for all fields; <, <=, >, >= for code (and code=5xx style classes);
+    ^= (starts with) and ~= (contains) for collectionId
+has(bes) matches records with a BES component. Combine with and, or, not and parentheses.
+Values that have spaces or operator characters can be in single or double quotes.
+"""
+
+index_version = 1
+index_suffix = ".qidx"
+
+field_aliases = {"code": "code", "http_response_code": "code", "collectionId": "collectionId",
+                 "collection": "collectionId", "user_id": "user_id", "user": "user_id", "user_ip": "user_ip",
+                 "ip": "user_ip"}
+field_operators = {"code": ("=", "!=", "<", "<=", ">", ">="), "collectionId": ("=", "!=", "^=", "~="),
+                   "user_id": ("=", "!="), "user_ip": ("=", "!=")}
+
+token_pattern = re.compile(r"""\s*(?:(?P<string>"(?:[^"\\]|\\.)*"|'[^']*')|(?P<op>!=|\^=|~=|<=|>=|=|<|>)"""
+                           r"""|(?P<paren>[()])|(?P<word>[^\s()=!<>^~"']+))""")
+code_class_pattern = re.compile(r"([1-5])xx", re.IGNORECASE)
+
+# The columns read from a columnar sidecar to build the index
+sidecar_fields = ["record_offset", "record_length", "http_response_code", "bes_count", "collectionId", "user_id",
+                  "user_ip"]
+
+
+def bitmap_from_ordinals(ordinals, size: int) -> int:
+    """
+    Make a bitmap (a Python int with bit i set for record i) from a list of record ordinals.
+    """
+    bits = bytearray((size + 7) // 8)
+    for i in ordinals:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+
+def bitmap_ordinals(bitmap: int):
+    """
+    Yield the ordinals of the bits set in a bitmap, in order.
+    """
+    for i, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")):
+        if byte:
+            for bit in range(8):
+                if byte >> bit & 1:
+                    yield i * 8 + bit
+
+
+def _encode_bitmap(bitmap: int) -> str:
+    return base64.b64encode(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")).decode("ascii")
+
+
+def _decode_bitmap(text: str) -> int:
+    return int.from_bytes(base64.b64decode(text), "little")
+
+
+def tokenize(query: str):
+    """
+    Split a query into (kind, text) tokens, where kind is 'string', 'op', 'paren' or 'word'.
+    """
+    tokens = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        match = token_pattern.match(query, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Cannot parse the query at: {query[pos:]}")
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "string":
+            text = json.loads(text) if text.startswith('"') else text[1:-1]
+        tokens.append((kind, text))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    A recursive descent parser for the query language. parse() returns a tree of tuples:
+    ('or', a, b), ('and', a, b), ('not', a), ('has_bes',) and ('cmp', field, op, value).
+    """
+
+    def __init__(self, query: str):
+        self.tokens = tokenize(query)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise ValueError("Unexpected end of the query")
+        self.pos += 1
+        return token
+
+    def keyword(self, word: str) -> bool:
+        kind, text = self.peek()
+        if kind == "word" and text.lower() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        tree = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Unexpected '{self.peek()[1]}' in the query")
+        return tree
+
+    def parse_or(self):
+        tree = self.parse_and()
+        while self.keyword("or"):
+            tree = ("or", tree, self.parse_and())
+        return tree
+
+    def parse_and(self):
+        tree = self.parse_not()
+        while self.keyword("and"):
+            tree = ("and", tree, self.parse_not())
+        return tree
+
+    def parse_not(self):
+        if self.keyword("not"):
+            return "not", self.parse_not()
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, text = self.next()
+        if (kind, text) == ("paren", "("):
+            tree = self.parse_or()
+            if self.next() != ("paren", ")"):
+                raise ValueError("Expecting ')' in the query")
+            return tree
+        if kind == "word" and text.lower() == "has" and self.peek() == ("paren", "("):
+            self.next()
+            kind, text = self.next()
+            if text != "bes" or self.next() != ("paren", ")"):
+                raise ValueError("Only has(bes) is supported")
+            return ("has_bes",)
+        if kind != "word" or text not in field_aliases:
+            raise ValueError(f"Unknown field '{text}'; use one of {', '.join(field_aliases)}")
+        field = field_aliases[text]
+        kind, op = self.next()
+        if kind != "op" or op not in field_operators[field]:
+            raise ValueError(f"The operator for {field} must be one of {' '.join(field_operators[field])}")
+        kind, value = self.next()
+        if kind not in ("word", "string"):
+            raise ValueError(f"Expecting a value for {field}")
+        return "cmp", field, op, value
+
+
+def parse_query(query: str):
+    """
+    Parse a query into a tree of tuples (see _Parser).
+    """
+    return _Parser(query).parse()
+
+
+class CombinedIndex:
+    """
+    The secondary indexes over a combined log. Build one with build() or load one with load();
+    open_index() does whichever is needed.
+    """
+
+    def __init__(self, source_file: str):
+        self.source_file = source_file
+        self.size = 0
+        self.mtime_ns = 0
+        self.offsets = []
+        self.lengths = []
+        self.codes = {}             # str(http_response_code) -> bitmap
+        self.bes = 0                # bitmap of the records with a BES component
+        self.collection_ids = []    # sorted distinct collectionId values
+        self.collection_postings = []   # record ordinals for each of collection_ids
+        self.user_ids = {}          # user_id -> record ordinals
+        self.user_ips = {}          # user_ip -> record ordinals
+
+    @property
+    def count(self) -> int:
+        return len(self.offsets)
+
+    @property
+    def all(self) -> int:
+        return (1 << self.count) - 1
+
+    def build(self, sidecar: str = None):
+        """
+        Index the combined log in one streaming pass, or from its columnar sidecar (see
+        combined_columns.py) without parsing the JSON.
+        """
+        stat = os.stat(self.source_file)
+        if sidecar:
+            from combined_columns import load_columns, iter_column_records
+            columns, _ = load_columns(sidecar, sidecar_fields)
+            rows = ((record["record_offset"], record["record_length"], record)
+                    for record in iter_column_records(columns))
+        else:
+            rows = iter_combined_records(self.source_file, with_offsets=True)
+        codes = defaultdict(list)
+        bes = []
+        collections = defaultdict(list)
+        user_ids = defaultdict(list)
+        user_ips = defaultdict(list)
+        for i, (offset, length, record) in enumerate(rows):
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            codes[str(record.get("http_response_code"))].append(i)
+            if record.get("bes"):
+                bes.append(i)
+            if record.get("collectionId"):
+                collections[record["collectionId"]].append(i)
+            if record.get("user_id"):
+                user_ids[str(record["user_id"])].append(i)
+            if record.get("user_ip"):
+                user_ips[str(record["user_ip"])].append(i)
+
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.codes = {code: bitmap_from_ordinals(ordinals, self.count) for code, ordinals in codes.items()}
+        self.bes = bitmap_from_ordinals(bes, self.count)
+        self.collection_ids = sorted(collections)
+        self.collection_postings = [collections[ccid] for ccid in self.collection_ids]
+        self.user_ids = dict(user_ids)
+        self.user_ips = dict(user_ips)
+        loggy(f"Indexed {self.count} records in {self.source_file}")
+        return self
+
+    def save(self, index_file: str):
+        with gzip.open(index_file, "wt", encoding="utf-8") as f:
+            json.dump({"version": index_version, "size": self.size, "mtime_ns": self.mtime_ns,
+                       "offsets": self.offsets, "lengths": self.lengths,
+                       "codes": {code: _encode_bitmap(bitmap) for code, bitmap in self.codes.items()},
+                       "bes": _encode_bitmap(self.bes), "collection_ids": self.collection_ids,
+                       "collection_postings": self.collection_postings, "user_ids": self.user_ids,
+                       "user_ips": self.user_ips}, f)
+
+    def load(self, index_file: str):
+        with gzip.open(index_file, "rt", encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("version") != index_version:
+            raise ValueError(f"{index_file} is not a version {index_version} index")
+        self.size = saved["size"]
+        self.mtime_ns = saved["mtime_ns"]
+        self.offsets = saved["offsets"]
+        self.lengths = saved["lengths"]
+        self.codes = {code: _decode_bitmap(bitmap) for code, bitmap in saved["codes"].items()}
+        self.bes = _decode_bitmap(saved["bes"])
+        self.collection_ids = saved["collection_ids"]
+        self.collection_postings = saved["collection_postings"]
+        self.user_ids = saved["user_ids"]
+        self.user_ips = saved["user_ips"]
+        return self
+
+    def is_current(self) -> bool:
+        """
+        True if the combined log has not changed since it was indexed.
+        """
+        stat = os.stat(self.source_file)
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def _collections(self, selected) -> int:
+        ordinals = []
+        for ccid, postings in zip(self.collection_ids, self.collection_postings):
+            if selected(ccid):
+                ordinals.extend(postings)
+        return bitmap_from_ordinals(ordinals, self.count)
+
+    def _compare(self, field: str, op: str, value: str) -> int:
+        """
+        The bitmap of the records where field op value (for '!=', the complement of '=').
+        """
+        if op == "!=":
+            return self.all & ~self._compare(field, "=", value)
+
+        if field == "code":
+            code_class = code_class_pattern.fullmatch(value)
+            if code_class:
+                low = int(code_class.group(1)) * 100
+                return self._codes(lambda code: low <= code < low + 100) if op == "=" else \
+                    self._compare(field, op, str(low))
+            if op == "=":
+                return self.codes.get(value, 0)
+            number = float(value)
+            compare = {"<": lambda code: code < number, "<=": lambda code: code <= number,
+                       ">": lambda code: code > number, ">=": lambda code: code >= number}[op]
+            return self._codes(compare)
+
+        if field == "collectionId":
+            if op == "=":
+                i = bisect.bisect_left(self.collection_ids, value)
+                found = i < len(self.collection_ids) and self.collection_ids[i] == value
+                return bitmap_from_ordinals(self.collection_postings[i] if found else [], self.count)
+            if op == "^=":
+                # The values that start with the prefix are together in the sorted list
+                start = bisect.bisect_left(self.collection_ids, value)
+                ordinals = []
+                for i in range(start, len(self.collection_ids)):
+                    if not self.collection_ids[i].startswith(value):
+                        break
+                    ordinals.extend(self.collection_postings[i])
+                return bitmap_from_ordinals(ordinals, self.count)
+            return self._collections(lambda ccid: value in ccid)
+
+        postings = self.user_ids if field == "user_id" else self.user_ips
+        return bitmap_from_ordinals(postings.get(value, []), self.count)
+
+    def _codes(self, selected) -> int:
+        bitmap = 0
+        for code, code_bitmap in self.codes.items():
+            try:
+                if selected(int(code)):
+                    bitmap |= code_bitmap
+            except ValueError:
+                pass  # e.g., 'None' for the records without a status code
+        return bitmap
+
+    def evaluate(self, tree) -> int:
+        """
+        The bitmap of the records that match a parsed query.
+        """
+        if tree[0] == "or":
+            return self.evaluate(tree[1]) | self.evaluate(tree[2])
+        if tree[0] == "and":
+            return self.evaluate(tree[1]) & self.evaluate(tree[2])
+        if tree[0] == "not":
+            return self.all & ~self.evaluate(tree[1])
+        if tree[0] == "has_bes":
+            return self.bes
+        return self._compare(*tree[1:])
+
+    def query(self, query: str) -> list:
+        """
+        The ordinals of the records that match a query, answered from the index alone.
+        """
+        return list(bitmap_ordinals(self.evaluate(parse_query(query))))
+
+    def records(self, ordinals):
+        """
+        Read and decode just the given records from the combined log.
+        """
+        with open(self.source_file, "rb") as fp:
+            for i in ordinals:
+                yield read_record_at(fp, self.offsets[i], self.lengths[i])
+
+
+def find_sidecar(combined_log_file: str):
+    """
+    The current columnar sidecar of the combined log, or None (also if numpy is not installed).
+    """
+    try:
+        from combined_columns import find_sidecar as find_columns
+    except ImportError:
+        return None
+    return find_columns(combined_log_file)
+
+
+def open_index(combined_log_file: str, index_file: str = None, rebuild: bool = False) -> CombinedIndex:
+    """
+    Load the index of a combined log, building (and saving) it first if it is missing, out of
+    date or rebuild is True.
+    """
+    index_file = index_file or combined_log_file + index_suffix
+    index = CombinedIndex(combined_log_file)
+    if not rebuild and os.path.exists(index_file):
+        try:
+            if index.load(index_file).is_current():
+                loggy(f"Loaded the index {index_file}")
+                return index
+            loggy(f"{combined_log_file} has changed since it was indexed")
+        except (OSError, ValueError, KeyError) as e:
+            loggy(f"Could not load {index_file}: {e}")
+        index = CombinedIndex(combined_log_file)
+    index.build(find_sidecar(combined_log_file)).save(index_file)
+    loggy(f"Saved the index {index_file}")
+    return index
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Select records from the combined log from ngap-logs.py using "
+                                                 "indexes on status code, collectionId, user_id, user_ip and BES "
+                                                 "presence. Example: "
+                                                 "\"code=404 and collectionId^=/hyrax/ngap and not has(bes)\"")
+    parser.add_argument("query", help="The query (see the top of combined_query.py for the language).")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", help="The combined log. default: hyrax_combined_logs.json",
+                        default="hyrax_combined_logs.json")
+    parser.add_argument("-x", "--index", help="The index file. default: <input>.qidx", default=None)
+    parser.add_argument("-r", "--rebuild", help="Rebuild the index even if it is current.", action="store_true")
+    parser.add_argument("-c", "--count", help="Only print the number of matching records.", action="store_true")
+    parser.add_argument("-o", "--output", help="Write the matching records to this file as a JSON array "
+                                               "instead of printing them.", default=None)
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    with stage("index") as indexing:
+        index = open_index(args.input, args.index, args.rebuild)
+        indexing.records_out = index.count
+    try:
+        with stage("query") as querying:
+            querying.records_in = index.count
+            ordinals = index.query(args.query)
+            querying.records_out = len(ordinals)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.count:
+        print(len(ordinals))
+    else:
+        with stage("write") as writing:
+            if args.output:
+                with open(args.output, "w") as f, JsonArrayWriter(f, indent=2) as writer:
+                    for record in index.records(ordinals):
+                        writer.write(record)
+                print(f"Wrote {len(ordinals)} records to {args.output}")
+            else:
+                for record in index.records(ordinals):
+                    print(json.dumps(record, indent=2, ensure_ascii=False))
+            writing.records_out = len(ordinals)
+    loggy(f"{len(ordinals)} of {index.count} records matched")
+
+
+if __name__ == "__main__":
+    main()
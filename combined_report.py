@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from collections import Counter
+
+from json_stream import iter_combined_records
+from loganalysis import common
+from loganalysis.common import loggy
+from loganalysis.stats import stage
+
+"""
+Report on the combined log made by ngap-logs.py (hyrax_combined_logs.json) in one streaming
+pass. This computes all the counts that combined_analysis.sh, logs_overview.sh,
+all_200_responses.sh and all_401_responses.sh get from ~50 separate jq passes, and writes
+the same per-category record files those scripts write.
+"""
+
+# The HTTP status codes reported for everything and for each provider
+report_codes = {200: "200 OK", 400: "400 User Error", 401: "401 Unauthorized", 404: "404 Not Found",
+                500: "500 Server Error", 502: "502 Bad Gateway"}
+provider_codes = (200, 400, 404, 500, 502)
+providers = ("NSIDC_CPRD", "POCLOUD")
+
+
+def is_unmatched(record: dict) -> bool:
+    """
+    True if the record has no BES component. ngap-logs.py writes an empty 'bes' list for these
+    and join_metrics_log_with_application_log.py leaves 'bes' out.
+    """
+    return not record.get("bes")
+
+
+def collection_id(record: dict) -> str:
+    """
+    The collectionId of the record, or '' if it has none.
+    """
+    return record.get("collectionId") or ""
+
+
+# The record files written by the shell scripts, and which records go in each
+record_files = {
+    "unmatched_records": is_unmatched,
+    "cmr_records": lambda r: "/hyrax/CMR" in collection_id(r),
+    "all_404_records": lambda r: r.get("http_response_code") == 404,
+    "all_ngap_404_records": lambda r: collection_id(r).startswith("/hyrax/ngap") and r.get("http_response_code") == 404,
+    "other_404_records": lambda r: collection_id(r) != "" and not collection_id(r).startswith("/hyrax/ngap")
+                                   and not collection_id(r).startswith("/hyrax/CMR")
+                                   and r.get("http_response_code") == 404,
+    "unmatched_ngap_404_records": lambda r: is_unmatched(r) and collection_id(r).startswith("/hyrax/ngap")
+                                            and r.get("http_response_code") == 404,
+    "nsidc_404_records": lambda r: "-NSIDC_CPRD" in collection_id(r) and r.get("http_response_code") == 404,
+    "nsidc_cprd_records": lambda r: "NSIDC_CPRD" in collection_id(r),
+    "pocloud_records": lambda r: "POCLOUD" in collection_id(r),
+    "all_400_records": lambda r: r.get("http_response_code") == 400,
+    "all_401_records": lambda r: r.get("http_response_code") == 401,
+    "all_200_records": lambda r: r.get("http_response_code") == 200,
+}
+
+
+# The fields the report needs, which is all it reads from a columnar sidecar
+report_fields = ["http_response_code", "collectionId", "user_id", "bes_count"]
+
+
+def sidecar_records(combined_log_file: str):
+    """
+    The records (with just the report_fields) from the columnar sidecar of the combined log, or None if
+    there is no current sidecar (or numpy is not installed). See combined_columns.py.
+    """
+    try:
+        from combined_columns import find_sidecar, load_columns, iter_column_records
+    except ImportError:
+        return None
+    path = find_sidecar(combined_log_file)
+    if path is None:
+        return None
+    loggy(f"Reading the columnar sidecar {path}")
+    columns, _ = load_columns(path, report_fields)
+    return iter_column_records(columns)
+
+
+def report_combined_logs(combined_log_file: str, output_dir: str = ".", write_files: bool = True,
+                         use_sidecar: bool = True, distinct=None) -> dict:
+    """
+    Count everything in one pass over the combined log and, optionally, write the record files.
+    Args:
+        combined_log_file: The combined log from ngap-logs.py (a JSON object or array of lifecycle records)
+        output_dir: Where to write the record files
+        write_files: Write the record files (e.g., all_404_records) like the shell scripts do
+        use_sidecar: When not writing the record files, count from the columnar sidecar of the log if it
+            has a current one, instead of parsing the JSON
+        distinct: A DistinctCounts (see distinct_counts.py) to add the records to in the same pass. The
+            sidecar does not have the fields it needs, so this reads the JSON
+
+    Returns: A dict with 'records' (the total), a Counter for each record file name, the 'codes'
+    Counter of all status codes, the '<PROVIDER>_codes' Counters, 'cmr_404', 'cmr_unmatched',
+    'login_400', 'login_401' and the set of '401_user_ids'.
+    """
+    counts = Counter()
+    codes = Counter()
+    provider_counts = {provider: Counter() for provider in providers}
+    user_ids_401 = set()
+
+    files = {}
+    records = None
+    if write_files:
+        os.makedirs(output_dir, exist_ok=True)
+        files = {name: open(os.path.join(output_dir, name), 'w') for name in record_files}
+    elif use_sidecar and distinct is None:
+        records = sidecar_records(combined_log_file)
+    if records is None:
+        records = iter_combined_records(combined_log_file)
+    try:
+        with stage("report") as reporting:
+            for record in records:
+                counts["records"] += 1
+                code = record.get("http_response_code")
+                codes[code] += 1
+                ccid = collection_id(record)
+
+                for name, selected in record_files.items():
+                    if selected(record):
+                        counts[name] += 1
+                        if write_files:
+                            files[name].write(json.dumps(record, indent=2, ensure_ascii=False) + "\n")
+
+                if "/hyrax/CMR" in ccid:
+                    counts["cmr_404"] += code == 404
+                    counts["cmr_unmatched"] += is_unmatched(record)
+                for provider in providers:
+                    if provider in ccid:
+                        provider_counts[provider][code] += 1
+                if "login" in ccid:
+                    counts["login_400"] += code == 400
+                    counts["login_401"] += code == 401
+                if code == 401:
+                    user_ids_401.add(record.get("user_id"))
+                if distinct is not None:
+                    distinct.add(record)
+            reporting.records_in = counts["records"]
+    finally:
+        for f in files.values():
+            f.close()
+
+    loggy(f"Read {counts['records']} records from {combined_log_file}")
+    return {**counts, "codes": codes, "401_user_ids": user_ids_401,
+            **{f"{provider}_codes": provider_counts[provider] for provider in providers}}
+
+
+def print_report(report: dict):
+    """
+    Print the report with the same lines as combined_analysis.sh and logs_overview.sh.
+    """
+    print(f"Located {report.get('unmatched_records', 0)} requests that lacked a BES component (aka unmatched requests)")
+    print(f"Located {report.get('cmr_records', 0)} CMR catalog service requests")
+    print(f"Located {report.get('cmr_404', 0)} CMR catalog service requests that returned 404")
+    print(f"Located {report.get('cmr_unmatched', 0)} CMR catalog service requests that lack a matching BES request "
+          f"expression.")
+    print(f"Located a total of {report.get('all_404_records', 0)} requests that returned 404")
+    print(f"Located {report.get('all_ngap_404_records', 0)} ngap service requests that returned 404")
+    print(f"Located {report.get('other_404_records', 0)} requests that returned 404 not for the ngap or CMR services. "
+          f"These are interesting...")
+    print(f"Located {report.get('unmatched_ngap_404_records', 0)} unmatched ngap service requests that returned 404")
+    print(f"Located {report.get('nsidc_404_records', 0)} NSIDC_CPRD requests that returned 404")
+
+    for provider, records in (("NSIDC_CPRD", "nsidc_cprd_records"), ("POCLOUD", "pocloud_records")):
+        print(f"Located {report.get(records, 0)} records for {provider}")
+        for code in provider_codes:
+            print(f"Located {report[f'{provider}_codes'][code]} ({report_codes[code]}) response records for {provider}")
+
+    print(f"Located {report.get('all_400_records', 0)} (400 User Error) response records.")
+    print(f"Located {report.get('login_400', 0)} (400 User Error) response records from the login endpoint.")
+
+    print("Response codes:")
+    for code in sorted(report["codes"], key=str):
+        print(json.dumps(code))
+
+    print(f"Located {report.get('records', 0)} records")
+    for code, label in report_codes.items():
+        print(f"Located {report['codes'][code]} ({label}) response records")
+
+    print(f"Located {report.get('all_401_records', 0)} (401 Unauthenticated) response records.")
+    print(f"Located {report.get('login_401', 0)} (401 Unauthorized) response records from the login endpoint.")
+    print("User ids with 401 responses:")
+    for user_id in sorted(report["401_user_ids"], key=str):
+        print(json.dumps(user_id))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Report on the combined log from ngap-logs.py in one pass: unmatched "
+                                                 "records, CMR and ngap 404s, per-provider status codes, login "
+                                                 "400/401s and the spread of status codes. Also writes the record "
+                                                 "files (all_404_records, ...) that combined_analysis.sh writes.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", help="The combined log. default: hyrax_combined_logs.json",
+                        default="hyrax_combined_logs.json")
+    parser.add_argument("-d", "--output-dir", help="Where to write the record files. default: .", default=".")
+    parser.add_argument("-n", "--no-files", help="Only print the counts; do not write the record files.",
+                        action="store_true")
+    parser.add_argument("-H", "--distinct", help="Also add the records to this store of distinct user, IP, "
+                                                 "collection and granule counts (see distinct_counts.py).",
+                        default=None)
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    distinct = None
+    if args.distinct:
+        from distinct_counts import DistinctCounts, load_counts, save_counts
+        distinct = load_counts(args.distinct) if os.path.exists(args.distinct) else DistinctCounts()
+    print_report(report_combined_logs(args.input, args.output_dir, not args.no_files, distinct=distinct))
+    if distinct is not None:
+        save_counts(distinct, args.distinct)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import base64
+import hashlib
+import heapq
+import math
+import zlib
+from array import array
+
+"""
+A Count-Min sketch and a top-k list of heavy hitters on top of it, for counting users, IPs,
+collections, ... over weeks of traffic in fixed memory. The sketch is 'depth' rows of 'width'
+counters; an item adds to one counter in each row and its estimate is the smallest of them.
+An estimate is never below the true count and, with probability 1 - delta, no more than
+epsilon * N above it (N is the total of all the counts), for width = e / epsilon and
+depth = ln(1 / delta). Sketches with the same width and depth merge by adding their counters,
+so per-shard sketches can be combined without the logs.
+"""
+
+
+def item_hash(item: str) -> int:
+    return int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class CountMinSketch:
+    """
+    Approximate counts of strings in depth * width counters.
+    """
+
+    def __init__(self, epsilon: float = 0.0001, delta: float = 0.01):
+        """
+        Args:
+            epsilon: The error bound, as a fraction of the total count
+            delta: The probability that an estimate is outside the bound
+        """
+        if not 0 < epsilon < 1 or not 0 < delta < 1:
+            raise ValueError("epsilon and delta must be between 0 and 1")
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = int(math.ceil(math.e / epsilon))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.rows = [array('Q', bytes(8 * self.width)) for _ in range(self.depth)]
+        self.total = 0
+
+    def _positions(self, item: str):
+        # Double hashing with the two halves of a 64-bit hash: row i uses h1 + i * h2
+        key = item_hash(item)
+        h1, h2 = key >> 32, (key & 0xffffffff) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item: str, count: int = 1) -> int:
+        """
+        Add 'count' to an item.
+        Returns: The item's new estimate
+        """
+        estimate = None
+        for row, position in zip(self.rows, self._positions(item)):
+            row[position] += count
+            if estimate is None or row[position] < estimate:
+                estimate = row[position]
+        self.total += count
+        return estimate
+
+    def estimate(self, item: str) -> int:
+        """
+        The estimated count of an item: at least its true count, and at most error() more.
+        """
+        return min(row[position] for row, position in zip(self.rows, self._positions(item)))
+
+    def error(self) -> float:
+        """
+        The most an estimate is over its true count, with probability 1 - delta.
+        """
+        return self.epsilon * self.total
+
+    def merge(self, other: "CountMinSketch"):
+        """
+        Add the counts from 'other' to this sketch. Both must have the same epsilon and delta.
+        Returns: This sketch.
+        """
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge sketches with a different epsilon or delta")
+        for row, other_row in zip(self.rows, other.rows):
+            for position, count in enumerate(other_row):
+                if count:
+                    row[position] += count
+        self.total += other.total
+        return self
+
+    def to_dict(self) -> dict:
+        """
+        A JSON-friendly form of the sketch (the counters compressed, as base64); see from_dict().
+        """
+        return {"epsilon": self.epsilon, "delta": self.delta, "total": self.total,
+                "rows": [base64.b64encode(zlib.compress(row.tobytes())).decode("ascii") for row in self.rows]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CountMinSketch":
+        """
+        Rebuild a sketch saved with to_dict().
+        """
+        sketch = cls(data["epsilon"], data["delta"])
+        sketch.total = data["total"]
+        for row, encoded in zip(sketch.rows, data["rows"]):
+            row[:] = array('Q', zlib.decompress(base64.b64decode(encoded)))
+        return sketch
+
+
+class HeavyHitters:
+    """
+    The k items with the largest estimated counts in a CountMinSketch. The candidates are held in
+    a dict and a min-heap (with stale entries dropped as they reach the top), so an add() costs
+    the sketch update and O(log k).
+    """
+
+    def __init__(self, k: int = 20, epsilon: float = 0.0001, delta: float = 0.01):
+        self.k = k
+        self.sketch = CountMinSketch(epsilon, delta)
+        self.candidates = {}    # item -> estimate
+        self.heap = []          # (estimate, item), some of them stale
+
+    def _push(self, item: str, estimate: int):
+        self.candidates[item] = estimate
+        heapq.heappush(self.heap, (estimate, item))
+        if len(self.heap) > 4 * self.k + 16:
+            self.heap = [(estimate, item) for item, estimate in self.candidates.items()]
+            heapq.heapify(self.heap)
+
+    def _lowest(self):
+        while self.heap[0][1] not in self.candidates or self.candidates[self.heap[0][1]] != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0]
+
+    def add(self, item: str, count: int = 1):
+        estimate = self.sketch.add(item, count)
+        if item in self.candidates or len(self.candidates) < self.k:
+            self._push(item, estimate)
+            return
+        lowest_estimate, lowest_item = self._lowest()
+        if estimate > lowest_estimate:
+            heapq.heappop(self.heap)
+            del self.candidates[lowest_item]
+            self._push(item, estimate)
+
+    def top(self, n: int = None) -> list:
+        """
+        The heavy hitters, largest first.
+        Returns: A list of (item, estimate) tuples
+        """
+        ranked = sorted(self.candidates.items(), key=lambda candidate: (-candidate[1], candidate[0]))
+        return ranked[:n] if n else ranked
+
+    def merge(self, other: "HeavyHitters"):
+        """
+        Add the counts from 'other' (e.g., another shard) and keep the top k of both candidate lists.
+        Returns: This object.
+        """
+        self.sketch.merge(other.sketch)
+        items = set(self.candidates) | set(other.candidates)
+        ranked = sorted(((self.sketch.estimate(item), item) for item in items), reverse=True)[:max(self.k, other.k)]
+        self.k = max(self.k, other.k)
+        self.candidates = {item: estimate for estimate, item in ranked}
+        self.heap = [(estimate, item) for estimate, item in ranked]
+        heapq.heapify(self.heap)
+        return self
+
+    def to_dict(self) -> dict:
+        return {"k": self.k, "sketch": self.sketch.to_dict(), "candidates": self.candidates}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HeavyHitters":
+        sketch = CountMinSketch.from_dict(data["sketch"])
+        hitters = cls(data["k"], sketch.epsilon, sketch.delta)
+        hitters.sketch = sketch
+        hitters.candidates = dict(data["candidates"])
+        hitters.heap = [(estimate, item) for item, estimate in hitters.candidates.items()]
+        heapq.heapify(hitters.heap)
+        return hitters
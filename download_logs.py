@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
-import boto3
 import json
 from datetime import datetime
 
+from loganalysis.stats import stage
+
 """
 The response from boto3.client.filter_log_events has the form:
 {
@@ -23,19 +24,53 @@ The response from boto3.client.filter_log_events has the form:
     ],
     'nextToken': 'eyJ2IjoiMSJ9...'  # A token for fetching the next page of results
 }
+
+boto3 is imported when the logs are fetched, not when this module is loaded, so write_logs()
+and the other tools that import this module do not pay for it (or need it installed).
 """
 
 
-def get_logs(log_group_name: str, start_time: str, end_time: str) -> list:
+def __getattr__(name: str):
+    """
+    Make download_logs.boto3 import boto3 on first use (e.g., for mock.patch('download_logs.boto3.client')).
+    """
+    if name == "boto3":
+        import boto3
+        return boto3
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_logs(log_group_name: str, start_time: str, end_time: str, exclusive_end: bool = False) -> list:
     """
     Get a list of log entries from the named AWS log group between start_time and end_time
     Args:
         log_group_name: Name of the log group
         start_time: Get entries starting at this time
         end_time: Only get entries until this time, or the current time if this is ""
+        exclusive_end: Leave out the entries stamped exactly at end_time; see iter_log_pages()
 
     Returns: A list of log entries between start_time and end_time
     """
+    all_events = []
+    for events in iter_log_pages(log_group_name, start_time, end_time, exclusive_end):
+        all_events.extend(events)
+
+    return all_events
+
+
+def iter_log_pages(log_group_name: str, start_time: str, end_time: str, exclusive_end: bool = False):
+    """
+    Yield the log entries from the named AWS log group a page (one filter_log_events response)
+    at a time, so they can be processed as they arrive. See get_logs().
+    Args:
+        log_group_name: Name of the log group
+        start_time: Get entries starting at this time
+        end_time: Only get entries until this time, or the current time if this is ""
+        exclusive_end: Leave out the entries stamped exactly at end_time. CloudWatch's endTime is
+            inclusive, so back-to-back windows (e.g., hours) would otherwise both get those entries.
+
+    Returns: A generator of lists of log entries
+    """
 
     if start_time == "" or start_time is None:
         raise ValueError("start_time is empty")
@@ -46,11 +81,11 @@ def get_logs(log_group_name: str, start_time: str, end_time: str) -> list:
     start_timestamp = int(datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%S").timestamp() * 1000)
 
     # Initialize boto3 client
+    import boto3
     client = boto3.client('logs')
 
     # Paginate through log events
     next_token = None
-    all_events = []
 
     while True:
         params = {
@@ -62,28 +97,57 @@ def get_logs(log_group_name: str, start_time: str, end_time: str) -> list:
         if end_time:
             # Convert start_time to milliseconds since epoch
             end_timestamp = int(datetime.strptime(end_time, "%Y-%m-%dT%H:%M:%S").timestamp() * 1000)
-            params['endTime'] = end_timestamp
+            params['endTime'] = end_timestamp - 1 if exclusive_end else end_timestamp
 
         response = client.filter_log_events(**params)
 
-        # Collect events
-        events = response.get('events', [])
-        all_events.extend(events)
+        # Pass on this page's events
+        yield response.get('events', [])
 
         # Check if more results are available
         next_token = response.get('nextToken')
         if not next_token:
             break
 
-    return all_events
+
+def add_timestamp(message: str, event: dict, timestamp_key: str) -> str:
+    """
+    Add the CloudWatch event timestamp (ms since the epoch) to a JSON message.
+    Args:
+        message: A JSON object, as text
+        event: The CloudWatch event holding the message
+        timestamp_key: The key to use for the timestamp
+
+    Returns: The message with the timestamp as its first member
+    """
+    return add_event_fields(message, event, {timestamp_key: 'timestamp'})
 
 
-def write_logs(all_events: list, output_file: str) -> None:
+def add_event_fields(message: str, event: dict, fields: dict) -> str:
     """
-    Write log events to a JSON file
+    Add fields of the CloudWatch event (e.g., its timestamp or eventId) to a JSON message.
+    Args:
+        message: A JSON object, as text
+        event: The CloudWatch event holding the message
+        fields: The key to use in the message for each event field, e.g., {'cloudwatch_timestamp': 'timestamp'}
+
+    Returns: The message with the fields as its first members
+    """
+    members = ", ".join(json.dumps(key) + ": " + json.dumps(event.get(field)) for key, field in fields.items())
+    body = message.strip()[1:]
+    return "{" + members + ("" if body.lstrip().startswith("}") else ", ") + body
+
+
+def write_logs(all_events: list, output_file: str, timestamp_key: str = None, event_id_key: str = None) -> None:
+    """
+    Write log events to a JSON file. An event whose eventId was already written (the pages of
+    a retried download can overlap) is written once.
     Args:
         all_events: The log events
         output_file: The name of the output file
+        timestamp_key: If given, add each event's CloudWatch timestamp to its record using this key.
+        event_id_key: If given, add each event's CloudWatch eventId to its record using this key, so
+            the merge can drop the events that are in more than one download (see event_dedup.py).
 
     Returns: None
     """
@@ -93,10 +157,30 @@ def write_logs(all_events: list, output_file: str) -> None:
     if output_file == "" or output_file is None:
         raise ValueError("output_file is empty")
 
+    event_ids = set()
+    events = []
+    for event in all_events:
+        event_id = event.get('eventId')
+        if event_id is not None:
+            if event_id in event_ids:
+                continue
+            event_ids.add(event_id)
+        events.append(event)
+
+    fields = {}
+    if timestamp_key:
+        fields[timestamp_key] = 'timestamp'
+    if event_id_key:
+        fields[event_id_key] = 'eventId'
+
     # Write events to JSON file
     with open(output_file, 'w') as f:
         print("[", file=f)
-        all_messages = [event['message'] for event in all_events]
+        if fields:
+            all_messages = [add_event_fields(event['message'], event, fields)
+                            if event['message'].startswith("{") else event['message'] for event in events]
+        else:
+            all_messages = [event['message'] for event in events]
 
         for message in all_messages[:-1]:
             if message.startswith("{"):
@@ -110,7 +194,8 @@ def write_logs(all_events: list, output_file: str) -> None:
         print("]", file=f)
 
 
-def download_logs(log_group_name: str, start_time: str, end_time="", output_file="output.txt"):
+def download_logs(log_group_name: str, start_time: str, end_time="", output_file="output.txt", timestamp_key=None,
+                  event_id_key=None):
     """
     Download logs from an AWS CloudWatch Log Group.
 
@@ -119,11 +204,17 @@ def download_logs(log_group_name: str, start_time: str, end_time="", output_file
     - start_time: Start time for log filtering in ISO 8601 format
     - end_time: End time for log filtering in ISO 8601 format
     - output_file: Filepath to save the logs in JSON format
+    - timestamp_key: If given, add the CloudWatch event timestamp to each record using this key
+    - event_id_key: If given, add the CloudWatch eventId to each record using this key
     """
     print(f"Fetching logs from '{log_group_name}' starting at {start_time}...")
 
-    logs = get_logs(log_group_name, start_time, end_time)
-    write_logs(logs, output_file)
+    with stage("load") as loading:
+        logs = get_logs(log_group_name, start_time, end_time)
+        loading.records_out = len(logs)
+    with stage("write") as writing:
+        write_logs(logs, output_file, timestamp_key, event_id_key)
+        writing.records_in = len(logs)
 
 
 def main():
@@ -137,10 +228,18 @@ def main():
                         required=True)
     parser.add_argument("-e", "--stop", help="ISO 8601 timestamp", default="")
     parser.add_argument("-o", "--output", help="Output file name.", default="output.txt")
+    parser.add_argument("-t", "--timestamps", help="Add each event's CloudWatch timestamp (ms) to its record as "
+                                                   "'cloudwatch_timestamp'. The request log has no time of its own "
+                                                   "so the sort-merge joins need this.", action="store_true")
+    parser.add_argument("-i", "--event-ids", help="Add each event's CloudWatch eventId to its record as "
+                                                  "'cloudwatch_event_id', so 'ngap-logs.py -D' can drop the events "
+                                                  "that are in more than one download.", action="store_true")
 
     args = parser.parse_args()
 
-    download_logs(args.log_group, args.start, args.stop, args.output)
+    download_logs(args.log_group, args.start, args.stop, args.output,
+                  "cloudwatch_timestamp" if args.timestamps else None,
+                  "cloudwatch_event_id" if args.event_ids else None)
 
     print(f"Data extracted and saved to {args.output}")
 
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import math
+
+"""
+Drop the records that were logged (or downloaded) more than once. When CloudWatch windows
+overlap, or a download is retried, the same events are in more than one file, and the merge
+would count them twice (and get_match() would quietly keep just one of two records with the
+same request id).
+
+A record is known by a 64-bit hash of its CloudWatch eventId (download_logs.py -i keeps it
+as 'cloudwatch_event_id') or, when it has none, of its content. Identical records can be
+real (two identical BES lines from one process in the same second), so a Deduplicator can be
+told to only trust eventIds (content=False); the merge only trusts them for the logs with many
+records per request, like the BES log, and never deduplicates raw bes.log lines. One Deduplicator can be shared by all the logs of a run. The keys
+of the most recent records are held in exact sets, a window of them at a time; when a window
+fills up it is added to a Bloom filter and a new window is started, so memory stays bounded
+on multi-day runs. Duplicates close together (overlapping windows, retries) are found
+by the exact sets; older ones by the Bloom filter, which can mistake a new record for one it
+has seen at its error rate (one in a million by default).
+"""
+
+event_id_key = "cloudwatch_event_id"
+
+
+def record_key(record: dict, id_key: str = event_id_key) -> int:
+    """
+    The key of a record: a 64-bit hash of its event id or, if it has none, of its content.
+    """
+    event_id = record.get(id_key) if isinstance(record, dict) else None
+    if event_id is not None:
+        text = "id:" + str(event_id)
+    else:
+        text = json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class BloomFilter:
+    """
+    A Bloom filter of 64-bit keys (see record_key()), sized for 'capacity' keys at 'error_rate'
+    false positives.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 1e-6):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("The capacity must be positive and the error rate between 0 and 1")
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: int):
+        # Double hashing with the two halves of the key: position i is h1 + i * h2
+        h1 = key >> 32
+        h2 = (key & 0xffffffff) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: int):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class Deduplicator:
+    """
+    Remembers the keys of the records it has seen: the last two windows of 'window' keys exactly
+    and the ones before them in a Bloom filter of 'capacity' keys (made when it is first needed).
+    With content=False, records without an event id are never duplicates.
+    """
+
+    def __init__(self, window: int = 250000, capacity: int = 10000000, error_rate: float = 1e-6,
+                 id_key: str = event_id_key, content: bool = True):
+        self.window = window
+        self.content = content
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.id_key = id_key
+        self.current = set()
+        self.previous = set()
+        self.bloom = None
+        self.seen = 0
+        self.duplicates = 0
+
+    def _rotate(self):
+        if self.previous:
+            if self.bloom is None:
+                self.bloom = BloomFilter(self.capacity, self.error_rate)
+            for key in self.previous:
+                self.bloom.add(key)
+        self.previous, self.current = self.current, set()
+
+    def is_duplicate(self, record: dict, content: bool = None) -> bool:
+        """
+        True if a record with the same key was seen before; otherwise remember its key. 'content'
+        overrides the Deduplicator's setting for this record.
+        """
+        self.seen += 1
+        content = self.content if content is None else content
+        if not content and (not isinstance(record, dict) or record.get(self.id_key) is None):
+            return False
+        key = record_key(record, self.id_key)
+        if key in self.current or key in self.previous or (self.bloom is not None and key in self.bloom):
+            self.duplicates += 1
+            return True
+        if len(self.current) >= self.window:
+            self._rotate()
+        self.current.add(key)
+        return False
+
+    def filter(self, records):
+        """
+        Yield the records that are not duplicates.
+        """
+        for record in records:
+            if not self.is_duplicate(record):
+                yield record
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+import math
+import sys
+
+from cluster_errors import tokenize_message
+from count_min import HeavyHitters
+from json_stream import iter_combined_records
+from log_processing import is_raw_bes_log, read_bes_log_records
+from loganalysis import common
+from loganalysis.common import loggy, stderr, collection_of
+from loganalysis.stats import stage
+
+"""
+The top users, client IPs, collections, status codes and BES error templates over any amount
+of traffic, in fixed memory, instead of 'jq ... | sort | uniq -c | sort -n' over the whole log.
+Each dimension is counted in a Count-Min sketch with a top-k list (see count_min.py), so the
+counts are estimates: never low, and at most epsilon * N high (N is the dimension's total) with
+probability 1 - delta. Both bounds are printed with the counts.
+
+The input can be the request log, the response log, the combined log from ngap-logs.py or a BES
+log (JSON or raw). A collection is its concept id (C1234-POCLOUD), not the whole request path,
+so the requests for all of its granules count together. The error template of a BES error record is its message with the paths, ids
+and numbers masked (cluster_errors.py), so it is the same in every file. The sketches can be
+saved (-s) and merged (-m), e.g., one per hourly shard (hourly_pipeline.py) merged for the week.
+"""
+
+# dimension -> the field it counts; 'error' is the BES error templates
+dimensions = {"user": "user_id", "ip": "user_ip", "collection": "collectionId", "status": "http_response_code",
+              "error": None}
+# dimension -> what is counted of its field, when that is not the whole value; the
+# collectionId is the request path, so a collection is its concept id
+dimension_values = {"collection": collection_of}
+
+
+def error_templates(record: dict, prefix: str = "hyrax-"):
+    """
+    Yield the error template of a BES error record, or of each in a lifecycle record's 'bes' list.
+    """
+    bes = record.get("bes")
+    for entry in bes if isinstance(bes, list) else [record]:
+        if isinstance(entry, dict) and entry.get(prefix + "type") == "error":
+            message = entry.get(prefix + "message")
+            if isinstance(message, str):
+                yield " ".join(tokenize_message(message))
+
+
+def iter_log_records(source_file: str, prefix: str = "hyrax-"):
+    """
+    The records of a request, response, combined or BES log (JSON or a raw bes.log).
+    """
+    if is_raw_bes_log(source_file):
+        return read_bes_log_records(source_file, prefix)
+    return iter_combined_records(source_file)
+
+
+def count_records(records, hitters: dict, prefix: str = "hyrax-") -> int:
+    """
+    Add the records to the HeavyHitters of each dimension in 'hitters'.
+    Returns: The number of records
+    """
+    count = 0
+    fields = [(hitters[name], field, dimension_values.get(name)) for name, field in dimensions.items()
+              if name in hitters and field]
+    errors = hitters.get("error")
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        count += 1
+        for dimension, field, value_of in fields:
+            value = record.get(field)
+            if value is not None and value_of is not None:
+                value = value_of(value)
+            if value is not None and value != "":
+                dimension.add(str(value))
+        if errors is not None:
+            for template in error_templates(record, prefix):
+                errors.add(template)
+    return count
+
+
+def save_hitters(hitters: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump({name: dimension.to_dict() for name, dimension in hitters.items()}, f)
+
+
+def load_hitters(path: str) -> dict:
+    with open(path) as f:
+        return {name: HeavyHitters.from_dict(data) for name, data in json.load(f).items()}
+
+
+def merge_hitters(hitters: dict, other: dict) -> dict:
+    for name, dimension in other.items():
+        if name in hitters:
+            hitters[name].merge(dimension)
+        else:
+            hitters[name] = dimension
+    return hitters
+
+
+def report_rows(hitters: dict, n: int = None):
+    """
+    Yield a row for each heavy hitter: dimension, rank, item, estimate, the lowest its true count can
+    be (with probability 1 - delta), the error bound and its share of the dimension's total.
+    """
+    for name, dimension in hitters.items():
+        sketch = dimension.sketch
+        # The true counts are whole numbers, so estimate - floor(error) is still a lower bound
+        error = math.floor(sketch.error())
+        for rank, (item, estimate) in enumerate(dimension.top(n), 1):
+            yield [name, rank, item, estimate, max(estimate - error, 0), error,
+                   f"{100 * estimate / sketch.total:.2f}" if sketch.total else "0.00"]
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="The approximate top users, client IPs, collections, status codes "
+                                                 "and BES error templates in fixed memory, with error bounds, from "
+                                                 "request, response, combined or BES logs.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", nargs="*", default=[], help="The logs to count.")
+    parser.add_argument("-m", "--merge", nargs="*", default=[], help="Sketches saved with -s to merge in.")
+    parser.add_argument("-s", "--save", help="Save the sketches to this file (to merge later).", default=None)
+    parser.add_argument("-d", "--dimensions", help=f"Comma separated dimensions. default: {','.join(dimensions)}",
+                        default=",".join(dimensions))
+    parser.add_argument("-k", "--top", help="The number of heavy hitters kept for each dimension. default: 20",
+                        type=int, default=20)
+    parser.add_argument("-e", "--epsilon", help="The error bound as a fraction of the total. default: 0.0001",
+                        type=float, default=0.0001)
+    parser.add_argument("--delta", help="The chance a count is outside the bound. default: 0.01", type=float,
+                        default=0.01)
+    parser.add_argument("-p", "--bes_prefix", help="The prefix of the BES log keys. default: hyrax-",
+                        default="hyrax-")
+    parser.add_argument("-o", "--output", help="Write the csv to this file instead of stdout.", default=None)
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    names = [name for name in args.dimensions.split(",") if name]
+    for name in names:
+        if name not in dimensions:
+            parser.error(f"Unknown dimension '{name}'; use some of {', '.join(dimensions)}")
+    if not args.input and not args.merge:
+        parser.error("Give some logs (-i) or saved sketches (-m)")
+
+    try:
+        hitters = {name: HeavyHitters(args.top, args.epsilon, args.delta) for name in names}
+    except ValueError as e:
+        parser.error(str(e))
+    with stage("load") as loading:
+        loading.records_in = 0
+        for source_file in args.input:
+            count = count_records(iter_log_records(source_file, args.bes_prefix), hitters, args.bes_prefix)
+            loggy(f"Counted {count} records from {source_file}")
+            loading.records_in += count
+    for path in args.merge:
+        try:
+            merge_hitters(hitters, {name: dimension for name, dimension in load_hitters(path).items()
+                                    if name in names})
+        except ValueError as e:
+            parser.error(f"{path}: {e}")
+
+    if args.save:
+        save_hitters(hitters, args.save)
+        stderr(f"Sketches saved to {args.save}")
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(["dimension", "rank", "item", "estimate", "at_least", "error", "percent"])
+        writer.writerows(report_rows(hitters, args.top))
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+
+import csv
+import multiprocessing
+import os
+from datetime import timedelta
+
+from event_dedup import Deduplicator, event_id_key
+from json_stream import iter_combined_records, iter_json_records, JsonArrayWriter, JsonObjectWriter
+from loganalysis import common
+from loganalysis.common import loggy, stderr, parse_time, shard_format, time_format
+from loganalysis.stats import stage
+
+"""
+Download, merge and roll up a date range of logs an hour at a time, with the hours (shards)
+processed in parallel, instead of looping over hourly windows by hand. Each shard has its own
+directory under --dir (e.g., 2025-03-27T09/) with the three logs, hyrax_combined_logs.json
+and rollups.csv, so a week-long run can be stopped and started again: logs that are already
+there are not downloaded again.
+
+A request that starts just before the end of an hour has its response (and often some of its
+BES records) in the next hour. Merged on their own, the request is unmatched in the first hour
+and its response is dropped from the second. The merge of each shard returns the records it
+could not match (see get_merged_sources() in ngap-logs.py); a last pass gives the ones from
+shard N+1 to the requests in shard N and rewrites just those shards' combined logs, before
+the rollups are made. Records that are still not matched (their request is outside the range
+or was never logged) are counted and left out.
+
+The logs are downloaded with each event's CloudWatch eventId. With -D, the records that are
+in more than one shard (or twice in one, e.g., logs downloaded again for a different range)
+are dropped before the merges, by a single pass over all the shards in time order with one
+Deduplicator (event_dedup.py), so the Bloom filter covers the whole run.
+"""
+
+combined_log_name = "hyrax_combined_logs.json"
+rollups_name = "rollups.csv"
+log_names = ("request_log", "response_log", "bes_log")
+
+
+def hour_shards(start: str, end: str) -> list:
+    """
+    The hours from start up to end. The first shard starts at the top of the hour that holds start.
+    Returns: A list of (start, end) times in the format download_logs.py takes
+    """
+    begin = parse_time(start).replace(minute=0, second=0, microsecond=0)
+    finish = parse_time(end)
+    shards = []
+    while begin < finish:
+        shards.append((begin.strftime(time_format), (begin + timedelta(hours=1)).strftime(time_format)))
+        begin += timedelta(hours=1)
+    return shards
+
+
+def shard_dir(work_dir: str, shard: tuple) -> str:
+    return os.path.join(work_dir, parse_time(shard[0]).strftime(shard_format))
+
+
+def shard_files(directory: str) -> dict:
+    return {"request_log": os.path.join(directory, "request_log.json"),
+            "response_log": os.path.join(directory, "response_log.json"),
+            "bes_log": os.path.join(directory, "bes_log.json"),
+            "combined": os.path.join(directory, combined_log_name),
+            "rollups": os.path.join(directory, rollups_name)}
+
+
+def download_shard(shard: tuple, files: dict, log_groups: dict):
+    """
+    Download the three logs for a shard, unless they are already there, with each event's eventId.
+    An hour with no events gets an empty array. The shard ends a millisecond before the next one
+    starts, so an event stamped at the top of the hour is only in one of them.
+    """
+    from download_logs import get_logs, write_logs
+    for name, group in log_groups.items():
+        if os.path.exists(files[name]):
+            continue
+        partial = files[name] + ".part"
+        events = get_logs(group, shard[0], shard[1], exclusive_end=True)
+        if events:
+            write_logs(events, partial, "cloudwatch_timestamp" if name == "request_log" else None, event_id_key)
+        else:
+            with open(partial, 'w') as f:
+                f.write("[]\n")
+        os.replace(partial, files[name])
+
+
+def merge_module(prefix: str):
+    """
+    ngap-logs.py, set up for a BES key prefix the way its main() does it.
+    """
+    from loganalysis.cli import load_tool
+    merge = load_tool("ngap-logs.py")
+    merge.bes_log_prefix = prefix
+    merge.bes_log_type_key = prefix + "type"
+    merge.bes_log_request_id_key = prefix + "request-id"
+    return merge
+
+
+def fetch_shard(shard: tuple, options: dict) -> str:
+    """
+    Make a shard's directory and download its logs. This runs in a worker process.
+    Returns: The directory
+    """
+    common.verbose = options["verbose"]
+    directory = shard_dir(options["dir"], shard)
+    os.makedirs(directory, exist_ok=True)
+    download_shard(shard, shard_files(directory), options["log_groups"])
+    return directory
+
+
+def dedup_shards(directories: list, deduplicator: Deduplicator) -> int:
+    """
+    Drop the records that were already seen in an earlier shard (or earlier in the same log), with one
+    Deduplicator for all the shards and logs. A log is only rewritten if it has duplicates.
+    Args:
+        directories: The shard directories, in time order
+        deduplicator: The run's Deduplicator
+
+    Returns: The number of records dropped
+    """
+    dropped = 0
+    for directory in directories:
+        files = shard_files(directory)
+        for name in log_names:
+            duplicates = {number for number, record in enumerate(iter_json_records(files[name]))
+                          if deduplicator.is_duplicate(record)}
+            if not duplicates:
+                continue
+            partial = files[name] + ".part"
+            with open(partial, 'w') as f, JsonArrayWriter(f) as writer:
+                for number, record in enumerate(iter_json_records(files[name])):
+                    if number not in duplicates:
+                        writer.write(record)
+            os.replace(partial, files[name])
+            loggy(f"Dropped {len(duplicates)} duplicate records from {files[name]}")
+            dropped += len(duplicates)
+    return dropped
+
+
+def process_shard(shard: tuple, options: dict) -> dict:
+    """
+    Download (unless options['download'] is false) and merge one shard. This runs in a worker process.
+    Returns: The shard's 'dir', its 'requests' (the set of request ids in its combined log) and the
+    'orphans' (source name -> {request id: records}) that the merge could not match
+    """
+    common.verbose = options["verbose"]
+    directory = shard_dir(options["dir"], shard)
+    files = shard_files(directory)
+    if options["download"]:
+        fetch_shard(shard, options)
+
+    merge = merge_module(options["prefix"])
+    sources = merge.default_sources(files["request_log"], files["response_log"], files["bes_log"])
+    orphans, requests = merge.get_merged_sources(sources, files["combined"], spans=options["spans"])
+    loggy(f"{shard[0]}: {len(requests)} requests, {sum(map(len, orphans.values()))} unmatched keys")
+    return {"shard": shard, "dir": directory, "requests": requests, "orphans": orphans}
+
+
+def reconcile_record(record: dict, sources: list, matches: list, prefix: str, spans: bool = False) -> dict:
+    """
+    Add the records from the next shard to a lifecycle record, the way merge_lifecycle_record()
+    would have if they had been in the same logs.
+    Args:
+        record: The lifecycle record
+        sources: The LogSources after the request log
+        matches: The records from the next shard for each source, in the order of 'sources'
+        prefix: The BES key prefix, for spans
+        spans: Work out the record's 'spans' again
+
+    Returns: The record
+    """
+    from loganalysis.cli import load_tool
+    missing_error = load_tool("ngap-logs.py").missing_error
+    for source, records in zip(sources, matches):
+        if not records:
+            continue
+        if source.many:
+            record[source.name] = record.get(source.name, []) + records
+        else:
+            error_key, error = missing_error(source.name)
+            if record.get(error_key) == error:
+                del record[error_key]
+            record.update(records[-1])
+    if spans:
+        from service_chain_spans import add_spans
+        record.pop("spans", None)
+        add_spans(record, prefix)
+    return record
+
+
+def patch_shard(combined_log_file: str, patches: dict, options: dict) -> int:
+    """
+    Rewrite a shard's combined log with the records from the next shard added to its requests.
+    This runs in a worker process.
+    Args:
+        combined_log_file: The shard's combined log
+        patches: request id -> the records from the next shard for each source (after the request log)
+
+    Returns: The number of records changed
+    """
+    merge = merge_module(options["prefix"])
+    sources = merge.default_sources("", "", "")[1:]
+    changed = 0
+    partial = combined_log_file + ".part"
+    with open(partial, 'w') as fio, JsonObjectWriter(fio, indent=2) as writer:
+        for record in iter_combined_records(combined_log_file):
+            request_id = record.get(merge.request_id_key)
+            if request_id in patches:
+                reconcile_record(record, sources, patches[request_id], options["prefix"], options["spans"])
+                changed += 1
+            writer.write(request_id, record)
+    os.replace(partial, combined_log_file)
+    return changed
+
+
+def boundary_patches(results: list, source_names: list) -> tuple:
+    """
+    Match the unmatched records of each shard with the requests of the shard before it.
+    Args:
+        results: The process_shard() results, in time order
+        source_names: The names of the sources after the request log
+
+    Returns: (a dict of combined log file -> the patches for patch_shard(), the number of records
+    matched, the number still unmatched)
+    """
+    patches = {}
+    matched = unmatched = 0
+    for before, after in zip([None] + results[:-1], results):
+        previous = set(before["requests"]) if before is not None else set()
+        for index, name in enumerate(source_names):
+            for request_id, records in after["orphans"].get(name, {}).items():
+                if request_id not in previous:
+                    unmatched += len(records)
+                    continue
+                shard_patches = patches.setdefault(shard_files(before["dir"])["combined"], {})
+                matches = shard_patches.setdefault(request_id, [[] for _ in source_names])
+                matches[index].extend(records)
+                matched += len(records)
+    return patches, matched, unmatched
+
+
+def rollup_shard(combined_log_file: str, rollups_file: str, width: int) -> list:
+    """
+    Roll up a shard's combined log (see rollups.py) and write its csv. This runs in a worker process.
+    Returns: The rows
+    """
+    from combined_columns import load_combined_columns
+    from rollups import rollup, rollup_rows, rollup_header, rollup_fields
+    rows = list(rollup_rows(rollup(load_combined_columns(combined_log_file, rollup_fields), width)))
+    with open(rollups_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(rollup_header())
+        writer.writerows(rows)
+    return rows
+
+
+def combine_rollups(shard_rows: list) -> list:
+    """
+    Add up the rollup rows of the shards; a bucket wider than an hour has rows in several shards.
+    Returns: The rows, in time and provider order
+    """
+    totals = {}
+    for rows in shard_rows:
+        for row in rows:
+            total = totals.get((row[0], row[1]))
+            totals[(row[0], row[1])] = row[2:] if total is None else [a + b for a, b in zip(total, row[2:])]
+    return [[time, provider] + values for (time, provider), values in sorted(totals.items())]
+
+
+def run_pipeline(start: str, end: str, work_dir: str, processes: int = None, download: bool = True,
+                 log_groups: dict = None, prefix: str = "hyrax-", spans: bool = False, bucket: int = 60,
+                 dedup: bool = False) -> dict:
+    """
+    Download, merge, reconcile and roll up the hours from start to end.
+    Args:
+        start: The start of the range (ISO 8601)
+        end: The end of the range (ISO 8601)
+        work_dir: Where the shard directories go
+        processes: The number of worker processes (default: the number of CPUs)
+        download: Download the logs; if false, they must already be in the shard directories
+        log_groups: The CloudWatch log group for each of request_log, response_log and bes_log
+        prefix: The BES key prefix
+        spans: Add 'spans' to the records; see ngap-logs.py -P
+        bucket: The rollup bucket width in seconds
+        dedup: Drop the records that are in the logs more than once, across all the shards (see dedup_shards()).
+            Only records with an eventId are dropped; identical records without one can be real.
+
+    Returns: A summary: 'shards', 'requests', 'reconciled' (records moved to the shard before),
+    'unmatched' (records that were left out), 'duplicates' (records dropped) and the combined rollup 'rows'
+    """
+    shards = hour_shards(start, end)
+    if not shards:
+        raise ValueError(f"No hours from {start} to {end}")
+    options = {"dir": work_dir, "download": download, "prefix": prefix, "spans": spans, "verbose": common.verbose,
+               "log_groups": log_groups or {"request_log": "hyrax_request_log", "response_log": "hyrax_response_log",
+                                            "bes_log": "hyrax-prod"}}
+    source_names = ["response_log", "bes"]
+
+    duplicates = 0
+    with multiprocessing.Pool(processes) as pool:
+        if dedup:
+            # All the logs must be there before the one pass over them, so download them first
+            if download:
+                with stage("download"):
+                    pool.starmap(fetch_shard, [(shard, options) for shard in shards])
+                options["download"] = False
+            with stage("dedup") as deduping:
+                deduplicator = Deduplicator(content=False)
+                duplicates = dedup_shards([shard_dir(work_dir, shard) for shard in shards], deduplicator)
+                deduping.records_in, deduping.records_out = deduplicator.seen, deduplicator.seen - duplicates
+            loggy(f"Dropped {duplicates} duplicate records (of {deduplicator.seen})")
+
+        with stage("join") as joining:
+            results = pool.starmap(process_shard, [(shard, options) for shard in shards])
+            joining.records_out = sum(len(result["requests"]) for result in results)
+
+        with stage("reconcile") as reconciling:
+            patches, matched, unmatched = boundary_patches(results, source_names)
+            for result in results:
+                result.pop("orphans")
+            changed = pool.starmap(patch_shard, [(path, shard_patches, options)
+                                                 for path, shard_patches in patches.items()])
+            reconciling.records_in, reconciling.records_out = matched + unmatched, sum(changed)
+        loggy(f"Reconciled {sum(changed)} requests across hour boundaries ({matched} records; {unmatched} unmatched)")
+
+        with stage("rollup"):
+            shard_rows = pool.starmap(rollup_shard, [(shard_files(result["dir"])["combined"],
+                                                      shard_files(result["dir"])["rollups"], bucket)
+                                                     for result in results])
+
+    return {"shards": len(shards), "requests": sum(len(result["requests"]) for result in results),
+            "reconciled": matched, "unmatched": unmatched, "duplicates": duplicates,
+            "rows": combine_rollups(shard_rows)}
+
+
+def main():
+    import argparse
+    from rollups import bucket_seconds, rollup_header
+    parser = argparse.ArgumentParser(description="Download, merge and roll up the logs for a range of hours, an "
+                                                 "hour at a time in parallel, and reconcile the requests that span "
+                                                 "hour boundaries.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-s", "--start", help="ISO 8601 time or date, e.g., 2025-03-27T09:00:00", required=True)
+    parser.add_argument("-e", "--stop", help="ISO 8601 time or date (the end of the range)", required=True)
+    parser.add_argument("-d", "--dir", help="Where to put the hourly shards. default: shards", default="shards")
+    parser.add_argument("-j", "--processes", help="Worker processes. default: the number of CPUs", type=int,
+                        default=None)
+    parser.add_argument("-n", "--no-download", help="Use the logs already in the shard directories.",
+                        action="store_true")
+    parser.add_argument("-l", "--log-group", help="The BES log group. default: hyrax-prod", default="hyrax-prod")
+    parser.add_argument("--request-log-group", help="default: hyrax_request_log", default="hyrax_request_log")
+    parser.add_argument("--response-log-group", help="default: hyrax_response_log", default="hyrax_response_log")
+    parser.add_argument("-p", "--bes_prefix", help="The prefix of the BES log keys. default: hyrax-",
+                        default="hyrax-")
+    parser.add_argument("-P", "--spans", help="Add 'spans' to each record; see ngap-logs.py -P.",
+                        action="store_true")
+    parser.add_argument("-b", "--bucket", help="The rollup bucket: minute, hour, day or seconds. default: minute",
+                        default="minute")
+    parser.add_argument("-o", "--output", help="Write the combined rollup csv to this file. default: "
+                                               "<dir>/rollups.csv", default=None)
+    parser.add_argument("-D", "--dedup", help="Drop the records (by CloudWatch eventId) that are in more than one "
+                                              "shard or twice in one, before the merges.", action="store_true")
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    try:
+        width = bucket_seconds(args.bucket)
+        summary = run_pipeline(args.start, args.stop, args.dir, args.processes, not args.no_download,
+                               {"request_log": args.request_log_group, "response_log": args.response_log_group,
+                                "bes_log": args.log_group}, args.bes_prefix, args.spans, width, args.dedup)
+    except (ValueError, FileNotFoundError) as e:
+        parser.error(str(e))
+
+    output = args.output or os.path.join(args.dir, rollups_name)
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(rollup_header())
+        writer.writerows(summary["rows"])
+    stderr(f"{summary['shards']} shards, {summary['requests']} requests, {summary['reconciled']} records reconciled "
+           f"across hour boundaries, {summary['unmatched']} unmatched, {summary['duplicates']} duplicates dropped; "
+           f"rollups saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import base64
+import math
+import zlib
+
+from count_min import item_hash
+
+"""
+A HyperLogLog sketch: the approximate number of distinct strings (users, IPs, granules, ...)
+in 2^precision one-byte registers, however many strings there are. Each string's 64-bit hash
+picks a register with its top 'precision' bits and the register keeps the most leading zeros
+(plus one) seen in the rest. The estimate has a relative standard error of about
+1.04 / sqrt(2^precision), 1.6% for the default precision of 12 (4 KB). Small counts use
+linear counting (from the number of empty registers), which is close to exact.
+
+Sketches with the same precision merge by taking the larger of each register, which gives
+the sketch of the union, so hourly sketches can be combined into any range of hours.
+"""
+
+
+class HyperLogLog:
+    """
+    The approximate count of distinct strings.
+    """
+
+    def __init__(self, precision: int = 12):
+        """
+        Args:
+            precision: log2 of the number of registers, 4 to 18
+        """
+        if not 4 <= precision <= 18:
+            raise ValueError("The precision must be between 4 and 18")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add_hash(self, key: int):
+        """
+        Add a string by its item_hash(), for adding the same string to several sketches.
+        """
+        bits = 64 - self.precision
+        rest = key & ((1 << bits) - 1)
+        rank = bits - rest.bit_length() + 1
+        index = key >> bits
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add(self, item: str):
+        self.add_hash(item_hash(item))
+
+    def count(self) -> int:
+        """
+        The estimated number of distinct strings added.
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / math.fsum(2.0 ** -register for register in self.registers)
+        if estimate <= 2.5 * m:
+            empty = self.registers.count(0)
+            if empty:
+                estimate = m * math.log(m / empty)
+        return int(round(estimate))
+
+    def error(self) -> float:
+        """
+        The relative standard error of count().
+        """
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def merge(self, other: "HyperLogLog"):
+        """
+        Make this the sketch of the union of both. Both must have the same precision.
+        Returns: This sketch.
+        """
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with a different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def to_dict(self) -> dict:
+        """
+        A JSON-friendly form of the sketch (the registers compressed, as base64); see from_dict().
+        """
+        return {"precision": self.precision,
+                "registers": base64.b64encode(zlib.compress(bytes(self.registers))).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HyperLogLog":
+        """
+        Rebuild a sketch saved with to_dict().
+        """
+        sketch = cls(data["precision"])
+        registers = zlib.decompress(base64.b64decode(data["registers"]))
+        if len(registers) != len(sketch.registers):
+            raise ValueError("The registers do not match the precision")
+        sketch.registers[:] = registers
+        return sketch
@@ -1,6 +1,16 @@
 #!/usr/bin/env python3
 
+import heapq
 import json
+import math
+import os
+import tempfile
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from json_stream import iter_json_array, iter_json_records, JsonArrayWriter
+from loganalysis.common import loggy
+from loganalysis.stats import stage
 
 
 """
@@ -25,33 +35,360 @@ def join_json_arrays(left_array: str, right_array: str, key: str, result: str, v
     :param verbose: Print verbose output.
     :return: nothing
     """
-    # Load the left JSON array (e.g., job details)
-    with open(left_array, 'r') as f:
-        left_records = json.load(f)
+    with stage("load") as loading:
+        # Load the left JSON array (e.g., job details)
+        with open(left_array, 'r') as f:
+            left_records = json.load(f)
 
-    # Load the right JSON array (e.g., user details)
-    with open(right_array, 'r') as f:
-        right_records = json.load(f)
+        # Load the right JSON array (e.g., user details)
+        with open(right_array, 'r') as f:
+            right_records = json.load(f)
+        loading.records_out = len(left_records) + len(right_records)
 
     # Build an index (a dictionary) from the right records using request_id as the key
-    right_index = {record[key]: record for record in right_records}
+    with stage("index") as indexing:
+        right_index = {record[key]: record for record in right_records}
+        indexing.records_in, indexing.records_out = len(right_records), len(right_index)
 
     # For each record in the left array, merge it with the corresponding right record (if available)
-    joined_records = []
-    for left_rec in left_records:
-        # Lookup the matching record; if none, use an empty dict
-        right_rec = right_index.get(left_rec[key], {})
-        # Merge the two dictionaries (right_rec values will override left_rec on key collisions)
-        joined = {**left_rec, **right_rec}
-        joined_records.append(joined)
+    with stage("join") as joining:
+        joined_records = []
+        for left_rec in left_records:
+            # Lookup the matching record; if none, use an empty dict
+            right_rec = right_index.get(left_rec[key], {})
+            # Merge the two dictionaries (right_rec values will override left_rec on key collisions)
+            joined = {**left_rec, **right_rec}
+            joined_records.append(joined)
+        joining.records_in, joining.records_out = len(left_records), len(joined_records)
 
     # Write the result to a new file or print it
-    with open(result, 'w') as f:
+    with stage("write") as writing, open(result, 'w') as f:
         json.dump(joined_records, f, indent=2)
+        writing.records_out = len(joined_records)
 
     print(f"Joined {len(joined_records)} records.") if verbose else None
 
 
+# A record parsed into Python objects takes roughly this many times the size of its JSON text.
+memory_per_json_byte = 6
+
+# The most spill files a partitioned join makes at once (the merge opens them all), well under
+# the usual limit of 1024 open files, and how many times a partition that is still too big is
+# partitioned again before it is joined in memory anyway.
+max_partitions = 256
+max_partition_levels = 3
+
+
+def parse_memory_size(size: str) -> int:
+    """
+    Parse a memory size like '512M', '2G' or '1000000' into bytes.
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+class SpillFiles:
+    """
+    Lines for a set of spill files, kept in memory and appended to the files a batch at a time,
+    so only one file is open at once however many files there are.
+    """
+
+    def __init__(self, names: list, batch_bytes: int):
+        self.names = names
+        self.batch_bytes = batch_bytes
+        self.buffers = [[] for _ in names]
+        self.size = 0
+
+    def write(self, index: int, line: str):
+        self.buffers[index].append(line)
+        self.size += len(line)
+        if self.size >= self.batch_bytes:
+            self.flush()
+
+    def flush(self, final: bool = False):
+        """
+        Append the buffered lines to their files. With final, make the files that got no lines too.
+        """
+        for name, buffer in zip(self.names, self.buffers):
+            if buffer or final:
+                with open(name, 'a') as f:
+                    f.writelines(buffer)
+                buffer.clear()
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush(final=True)
+
+
+def partition_count(json_size: int, memory_limit: int) -> int:
+    """
+    The partitions needed for the index of each to fit in memory_limit, at most max_partitions.
+    """
+    return min(max_partitions, max(1, math.ceil(json_size * memory_per_json_byte / memory_limit)))
+
+
+def join_partition(right_file: str, left_file: str, joined_file: str, key: str, memory_limit: int,
+                   level: int = 1):
+    """
+    Join one partition: right_file has a right record on each line and left_file an [ordinal, left
+    record] on each line, in ordinal order. Writes [ordinal, joined record] lines, in the same order,
+    to joined_file. A partition whose index would not fit in memory_limit (there are at most
+    max_partitions of them) is partitioned again with another hash and joined a piece at a time.
+    Returns: The number of records joined
+    """
+    partitions = partition_count(os.path.getsize(right_file), memory_limit)
+    if partitions == 1 or level > max_partition_levels:
+        with open(right_file, 'r') as f:
+            right_index = {}
+            for line in f:
+                record = json.loads(line)
+                right_index[record[key]] = record
+        count = 0
+        with open(left_file, 'r') as f, open(joined_file, 'w') as out:
+            for line in f:
+                ordinal, left_rec = json.loads(line)
+                out.write(json.dumps([ordinal, {**left_rec, **right_index.get(left_rec[key], {})}]) + "\n")
+                count += 1
+        return count
+
+    loggy(f"Partitioning {right_file} into {partitions} at level {level}")
+    names = {side: [f"{joined_file}.{side}-{p}" for p in range(partitions)] for side in ("right", "left", "joined")}
+    batch_bytes = max(memory_limit // memory_per_json_byte, 1 << 16)
+    for side, source in (("right", right_file), ("left", left_file)):
+        with open(source, 'r') as f, SpillFiles(names[side], batch_bytes) as spills:
+            for line in f:
+                record = json.loads(line)
+                value = record[key] if side == "right" else record[1][key]
+                spills.write(hash((level, value)) % partitions, line)
+    count = 0
+    for p in range(partitions):
+        count += join_partition(names["right"][p], names["left"][p], names["joined"][p], key, memory_limit,
+                                level + 1)
+        os.remove(names["right"][p])
+        os.remove(names["left"][p])
+    merge_partitions(names["joined"], joined_file)
+    return count
+
+
+def merge_partitions(joined_files: list, result: str):
+    """
+    Merge joined partitions ([ordinal, record] lines) into one in ordinal order, removing them.
+    """
+    files = [open(name, 'r') for name in joined_files]
+    try:
+        with open(result, 'w') as out:
+            out.writelines(heapq.merge(*files, key=lambda line: json.loads(line)[0]))
+    finally:
+        for f in files:
+            f.close()
+    for name in joined_files:
+        os.remove(name)
+
+
+def join_json_arrays_partitioned(left_array: str, right_array: str, key: str, result: str, memory_limit: int,
+                                 tmp_dir: str = None):
+    """
+    The same join as join_json_arrays(), with the same output, for arrays that do not fit
+    in memory. Both arrays are streamed and hash-partitioned on 'key' into spill files on
+    disk, with enough partitions (up to max_partitions) that the index of one partition of
+    'right' fits in memory_limit; a partition that is still too big is partitioned again.
+    Then each partition is joined on its own, and the joined partitions are merged back into
+    the order of 'left'. The spill files are written in batches, so only one is open at a
+    time; the merge opens one file per partition.
+
+    :param left_array: JSON array to merge
+    :param right_array: JSON array used to make the index on 'key'
+    :param key: The JSON key on which to form the index
+    :param result: Filename where the JSON should be written.
+    :param memory_limit: Bytes of memory to use for the index of each partition
+    :param tmp_dir: Directory for the spill files (default: the system temp directory)
+    :return: nothing
+    """
+    partitions = partition_count(os.path.getsize(right_array), memory_limit)
+    batch_bytes = max(memory_limit // memory_per_json_byte, 1 << 16)
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as spill_dir:
+        names = {side: [os.path.join(spill_dir, f"{side}-{p}.jsonl") for p in range(partitions)]
+                 for side in ("right", "left", "joined")}
+
+        # Partition the right array on the hash of the key, and the left array the same way,
+        # keeping each left record's position in the array. Each line is one record.
+        with stage("load") as loading:
+            loading.records_in = 0
+            with open(right_array, 'r') as f, SpillFiles(names["right"], batch_bytes) as spills:
+                for record in iter_json_array(f):
+                    loading.records_in += 1
+                    spills.write(hash(record[key]) % partitions, json.dumps(record) + "\n")
+            with open(left_array, 'r') as f, SpillFiles(names["left"], batch_bytes) as spills:
+                for ordinal, record in enumerate(iter_json_array(f)):
+                    loading.records_in += 1
+                    spills.write(hash(record[key]) % partitions, json.dumps([ordinal, record]) + "\n")
+
+        # Join each partition; the output lines are in the order of 'left' within the partition.
+        with stage("join") as joining:
+            joining.records_out = 0
+            for p in range(partitions):
+                joining.records_out += join_partition(names["right"][p], names["left"][p], names["joined"][p], key,
+                                                      memory_limit)
+                os.remove(names["right"][p])
+                os.remove(names["left"][p])
+
+        # Merge the joined partitions back into the order of 'left'
+        joined_files = [open(name, 'r') for name in names["joined"]]
+        try:
+            with stage("write") as writing, open(result, 'w') as f, JsonArrayWriter(f, indent=2) as writer:
+                for ordinal, joined in heapq.merge(*[map(json.loads, jf) for jf in joined_files],
+                                                   key=lambda item: item[0]):
+                    writer.write(joined)
+                writing.records_out = writer.count
+        finally:
+            for jf in joined_files:
+                jf.close()
+
+    loggy(f"Joined {writer.count} records using {partitions} partitions.")
+
+
+def record_time(value):
+    """
+    Convert a record's time value to seconds since the epoch. Numbers (or numeric strings)
+    above 1e11 are taken to be milliseconds (CloudWatch timestamps, olfs-start-time) and
+    smaller ones seconds (hyrax-time); other strings are parsed as ISO 8601 times like
+    '2025-02-14T07:00:12+0000' (time_completed).
+    :return: The time in seconds, or None if there is no usable time.
+    """
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            try:
+                return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").timestamp()
+            except ValueError:
+                return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value / 1000 if value > 1e11 else float(value)
+    return None
+
+
+def sort_merge_join(streams, window: float, spine: int = 0):
+    """
+    Join several record streams that are (roughly) in time order on a common key, holding
+    only the records that are still within 'window' seconds of the newest record seen.
+
+    Each stream is a tuple of (records, key function, time key). The streams are merged in
+    time order; a record without a usable time gets the time of the previous record in its
+    stream. Records with a false key (None, '') are ignored. Every record in the 'spine'
+    stream yields one result, in the order of the spine stream, once no more records can
+    match it: that is, when the newest time seen is more than 'window' seconds after the
+    last record with its key. Records in the other streams that never meet a spine record
+    with the same key within the window are dropped.
+
+    :param streams: A list of (records, key function, time key) tuples
+    :param window: The lateness window in seconds
+    :param spine: The index of the stream whose records are joined to the others
+    :return: A generator of (spine record, [records from each stream with the same key]) tuples
+    """
+    def timed(index, records, key_of, time_key):
+        last_time = float("-inf")
+        for record in records:
+            key = key_of(record)
+            if not key:
+                continue
+            record_seconds = record_time(record.get(time_key))
+            if record_seconds is not None:
+                last_time = record_seconds
+            yield last_time, index, key, record
+
+    class Group:
+        """The records for one key that have been seen within the window."""
+        __slots__ = ("records", "last_time", "spine_count")
+
+        def __init__(self):
+            self.records = [[] for _ in streams]
+            self.last_time = float("-inf")
+            self.spine_count = 0
+
+    groups = {}
+    pending = OrderedDict()     # spine sequence number -> (spine record, group), in spine order
+    expiring = deque()          # (time, key) for each update, to find expired groups
+    spine_sequence = 0
+    watermark = float("-inf")
+
+    def flush(final=False):
+        while pending:
+            sequence, (record, group) = next(iter(pending.items()))
+            if not final and watermark <= group.last_time + window:
+                break
+            del pending[sequence]
+            group.spine_count -= 1
+            yield record, group.records
+        while expiring and (final or watermark > expiring[0][0] + window):
+            _, key = expiring.popleft()
+            group = groups.get(key)
+            if group is not None and group.spine_count == 0 and \
+                    (final or watermark > group.last_time + window):
+                del groups[key]
+
+    merged = heapq.merge(*[timed(index, records, key_of, time_key)
+                           for index, (records, key_of, time_key) in enumerate(streams)],
+                         key=lambda item: item[0])
+    for record_seconds, index, key, record in merged:
+        # Release what the new time makes final before this record can join it.
+        if record_seconds > watermark:
+            watermark = record_seconds
+            yield from flush()
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = Group()
+        group.records[index].append(record)
+        group.last_time = max(group.last_time, record_seconds)
+        expiring.append((record_seconds, key))
+        if index == spine:
+            group.spine_count += 1
+            pending[spine_sequence] = (record, group)
+            spine_sequence += 1
+
+    yield from flush(final=True)
+
+
+def sort_merge_join_json_arrays(left_array: str, right_array: str, key: str, result: str, left_time_key: str,
+                                right_time_key: str, window: float = 300, verbose: bool = False):
+    """
+    The join of join_json_arrays() for inputs that are in (rough) time order, like CloudWatch
+    exports, using sort_merge_join(). Only the records within 'window' seconds of the newest
+    record are held in memory, so inputs of any length can be joined. A right record only
+    joins a left record if they are within the window of each other. When all the records
+    are in time order the output is the same as join_json_arrays().
+
+    :param left_array: JSON array to merge (or raw JSON records)
+    :param right_array: JSON array joined to 'left' (or raw JSON records)
+    :param key: The JSON key on which to join
+    :param result: Filename where the JSON should be written.
+    :param left_time_key: The key of the time in the left records
+    :param right_time_key: The key of the time in the right records
+    :param window: The lateness window in seconds
+    :param verbose: Print verbose output.
+    :return: nothing
+    """
+    streams = [(iter_json_records(left_array), lambda record: record[key], left_time_key),
+               (iter_json_records(right_array), lambda record: record.get(key), right_time_key)]
+
+    with stage("join") as joining, open(result, 'w') as f, JsonArrayWriter(f, indent=2) as writer:
+        for left_rec, matches in sort_merge_join(streams, window):
+            right_matches = matches[1]
+            # The last right record wins, as in the index made by join_json_arrays()
+            writer.write({**left_rec, **(right_matches[-1] if right_matches else {})})
+        joining.records_out = writer.count
+
+    print(f"Joined {writer.count} records.") if verbose else None
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="Given two json arrays, join them using a common key and store them "
@@ -63,10 +400,31 @@ def main():
                         default="hyrax_response_log.json")
     parser.add_argument("-k", "--key", help="Common key for merge", default="request_id")
     parser.add_argument("-o", "--output", help="Output file name.", default="merged.json")
+    parser.add_argument("-m", "--memory-limit", help="Join arrays too big for memory by partitioning them on disk "
+                                                     "so each partition's index fits in this much memory "
+                                                     "(e.g., 512M, 2G)", default="")
+    parser.add_argument("-t", "--tmp-dir", help="Directory for the partition files made with --memory-limit.",
+                        default=None)
+    parser.add_argument("-s", "--sort-merge", help="Stream both arrays in time order and join records within "
+                                                   "--window seconds; memory is bounded by the window.",
+                        action="store_true")
+    parser.add_argument("-w", "--window", help="Lateness window in seconds for --sort-merge. default: 300",
+                        type=float, default=300)
+    parser.add_argument("--left-time-key", help="Time key in the left records. default: cloudwatch_timestamp "
+                                                "(see download_logs.py -t)", default="cloudwatch_timestamp")
+    parser.add_argument("--right-time-key", help="Time key in the right records. default: time_completed",
+                        default="time_completed")
 
     args = parser.parse_args()
 
-    join_json_arrays(args.left, args.right, args.key, args.output)
+    if args.sort_merge:
+        sort_merge_join_json_arrays(args.left, args.right, args.key, args.output, args.left_time_key,
+                                    args.right_time_key, args.window)
+    elif args.memory_limit:
+        join_json_arrays_partitioned(args.left, args.right, args.key, args.output,
+                                     parse_memory_size(args.memory_limit), tmp_dir=args.tmp_dir)
+    else:
+        join_json_arrays(args.left, args.right, args.key, args.output)
 
     print(f"Data extracted and saved to {args.output}")
 
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import json
+
+"""
+Read and write big JSON documents a record at a time. The readers take the JSON arrays
+written by download_logs.py and join_json_arrays.py, the raw (concatenated, no commas or
+brackets) records that ngap-logs.py also reads, and the JSON object of records that
+ngap-logs.py writes, and yield one record at a time so memory stays flat no matter how
+big the file is. JsonArrayWriter writes an array one record at a time with exactly the
+same text as json.dump() of the whole list.
+"""
+
+default_chunk_size = 1 << 20
+_whitespace = " \t\n\r"
+_delimiters = _whitespace + ",]}:"
+
+
+class _Reader:
+    """
+    A buffer over a text file that decodes one JSON value at a time.
+    """
+
+    def __init__(self, fp, chunk_size: int = default_chunk_size, with_offsets: bool = False):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.with_offsets = with_offsets
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        # The UTF-8 byte offset in the file of buf[mark], for byte_offset(); kept only with_offsets
+        self.mark = 0
+        self.mark_bytes = 0
+
+    def byte_offset(self, pos: int) -> int:
+        """
+        The byte offset in the (UTF-8) file of self.buf[pos]. Calls must not go backwards.
+        """
+        self.mark_bytes += len(self.buf[self.mark:pos].encode("utf-8"))
+        self.mark = pos
+        return self.mark_bytes
+
+    def fill(self):
+        """
+        Drop the consumed text and read another chunk. Returns False at the end of the file.
+        """
+        data = self.fp.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        if self.with_offsets:
+            self.byte_offset(self.pos)
+            self.mark = 0
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character without consuming it ('' at the end).
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof or not self.fill():
+                return ""
+
+    def expect(self, chars: str):
+        """
+        Consume the next non-whitespace character, which must be one of chars. Returns it.
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise json.JSONDecodeError(f"Expecting one of '{chars}'", self.buf, self.pos)
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """
+        Decode the next JSON value, reading more of the file as needed.
+        Returns: A tuple of (value, start, end) where start and end are offsets in self.buf.
+        """
+        self.peek()
+        while True:
+            try:
+                start = self.pos
+                value, end = self.decoder.raw_decode(self.buf, start)
+                # A number (or true/false/null) must be followed by a delimiter; if it is
+                # at the end of the buffer it might continue in the next chunk.
+                if not self.eof and not isinstance(value, (dict, list, str)) and \
+                        (end == len(self.buf) or self.buf[end] not in _delimiters):
+                    raise json.JSONDecodeError("Value may be truncated", self.buf, end)
+                self.pos = end
+                return value, start, end
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+
+
+def iter_json_array(fp, chunk_size: int = default_chunk_size, with_offsets: bool = False):
+    """
+    Yield the elements of a JSON array, one at a time.
+    Args:
+        fp: A text file positioned at the array.
+        chunk_size: Characters to read at a time.
+        with_offsets: Yield (byte offset, byte length, element) tuples; fp must be a UTF-8 file opened
+            at its start with newline='' so the offsets are those of the bytes in the file.
+    """
+    reader = _Reader(fp, chunk_size, with_offsets)
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+    while True:
+        value, start, end = reader.decode()
+        if with_offsets:
+            offset = reader.byte_offset(start)
+            yield offset, reader.byte_offset(end) - offset, value
+        else:
+            yield value
+        if reader.expect(",]") == "]":
+            return
+
+
+def iter_json_values(fp, chunk_size: int = default_chunk_size, with_offsets: bool = False):
+    """
+    Yield each of a sequence of JSON values that are not in an array (e.g., one record per line).
+    With with_offsets, yield (byte offset, byte length, value) tuples (see iter_json_array()).
+    """
+    reader = _Reader(fp, chunk_size, with_offsets)
+    while reader.peek():
+        value, start, end = reader.decode()
+        if with_offsets:
+            offset = reader.byte_offset(start)
+            yield offset, reader.byte_offset(end) - offset, value
+        else:
+            yield value
+
+
+def iter_json_object_items(fp, chunk_size: int = default_chunk_size, with_offsets: bool = False):
+    """
+    Yield the (key, value) pairs of a JSON object, one at a time. This is the form of the
+    combined log written by ngap-logs.py (request_id -> lifecycle record). With with_offsets,
+    yield (key, byte offset, byte length, value) tuples (see iter_json_array()).
+    """
+    reader = _Reader(fp, chunk_size, with_offsets)
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+        return
+    while True:
+        key, _, _ = reader.decode()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name", reader.buf, reader.pos)
+        reader.expect(":")
+        value, start, end = reader.decode()
+        if with_offsets:
+            offset = reader.byte_offset(start)
+            yield key, offset, reader.byte_offset(end) - offset, value
+        else:
+            yield key, value
+        if reader.expect(",}") == "}":
+            return
+
+
+def iter_json_records(source_file: str, chunk_size: int = default_chunk_size, with_offsets: bool = False):
+    """
+    Yield the records in a file that is either a JSON array of records or a sequence of
+    raw JSON records (no enclosing square brackets and no commas between records). With
+    with_offsets, yield (byte offset, byte length, record) tuples; see read_record_at().
+    """
+    with open(source_file, 'r', encoding="utf-8", newline="") as fp:
+        first = fp.read(1)
+        while first and first in _whitespace:
+            first = fp.read(1)
+        fp.seek(0)
+        if first == "[":
+            yield from iter_json_array(fp, chunk_size, with_offsets)
+        else:
+            yield from iter_json_values(fp, chunk_size, with_offsets)
+
+
+def iter_combined_records(source_file: str, chunk_size: int = default_chunk_size, with_offsets: bool = False):
+    """
+    Yield the lifecycle records from a combined log, either the JSON object written by
+    ngap-logs.py (the values are yielded) or a JSON array of records. With with_offsets,
+    yield (byte offset, byte length, record) tuples; see read_record_at().
+    """
+    with open(source_file, 'r', encoding="utf-8", newline="") as fp:
+        first = fp.read(1)
+        while first and first in _whitespace:
+            first = fp.read(1)
+        fp.seek(0)
+        if first == "{":
+            for item in iter_json_object_items(fp, chunk_size, with_offsets):
+                yield item[1:] if with_offsets else item[1]
+        else:
+            yield from iter_json_array(fp, chunk_size, with_offsets)
+
+
+def read_record_at(fp, offset: int, length: int):
+    """
+    Decode the record at a byte offset found by iter_combined_records() or iter_json_records()
+    with with_offsets=True.
+    Args:
+        fp: The file, opened in binary mode
+        offset: The byte offset of the record
+        length: The byte length of the record
+    """
+    fp.seek(offset)
+    return json.loads(fp.read(length))
+
+
+class JsonArrayWriter:
+    """
+    Write a JSON array one element at a time. The text is the same as json.dump(elements, fp, indent=indent).
+    Use as a context manager or call close() to write the closing bracket.
+    """
+
+    def __init__(self, fp, indent=None):
+        self.fp = fp
+        self.indent = indent
+        self.count = 0
+        self.position = 0   # characters written so far
+
+    def write(self, value):
+        """
+        Write one element. Returns the (offset, length) of its text in the file; json.dumps()
+        escapes non-ASCII characters, so these are byte offsets when fp was opened at its start.
+        """
+        if self.indent is None:
+            prefix = "[" if self.count == 0 else ", "
+            text = json.dumps(value)
+        else:
+            pad = " " * self.indent
+            prefix = ("[\n" if self.count == 0 else ",\n") + pad
+            text = json.dumps(value, indent=self.indent).replace("\n", "\n" + pad)
+        self.fp.write(prefix + text)
+        self.count += 1
+        offset = self.position + len(prefix)
+        self.position = offset + len(text)
+        return offset, len(text)
+
+    def close(self):
+        if self.count == 0:
+            self.fp.write("[]")
+        elif self.indent is None:
+            self.fp.write("]")
+        else:
+            self.fp.write("\n]")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class JsonObjectWriter:
+    """
+    Write a JSON object one member at a time. The text is the same as json.dump(members, fp, indent=indent),
+    e.g., the combined log that ngap-logs.py writes. Use as a context manager or call close().
+    """
+
+    def __init__(self, fp, indent=None):
+        self.fp = fp
+        self.indent = indent
+        self.count = 0
+        self.position = 0   # characters written so far
+
+    def write(self, key: str, value):
+        """
+        Write one member. Returns the (offset, length) of the value's text (see JsonArrayWriter.write()).
+        """
+        member = json.dumps(key) + ": "
+        if self.indent is None:
+            prefix = ("{" if self.count == 0 else ", ") + member
+            text = json.dumps(value)
+        else:
+            pad = " " * self.indent
+            prefix = ("{\n" if self.count == 0 else ",\n") + pad + member
+            text = json.dumps(value, indent=self.indent).replace("\n", "\n" + pad)
+        self.fp.write(prefix + text)
+        self.count += 1
+        offset = self.position + len(prefix)
+        self.position = offset + len(text)
+        return offset, len(text)
+
+    def close(self):
+        if self.count == 0:
+            self.fp.write("{}")
+        elif self.indent is None:
+            self.fp.write("}")
+        else:
+            self.fp.write("\n}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
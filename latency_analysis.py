@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+import csv
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+
+from combined_columns import load_combined_columns, numeric_column, StringColumn, bes_action, time_fields
+from join_json_arrays import record_time
+from json_stream import iter_combined_records
+from latency_histogram import LatencyHistogram
+from rollups import provider_codes
+from loganalysis import common
+from loganalysis.common import loggy, provider_of, bucket_seconds, no_provider
+from loganalysis.stats import stage
+
+"""
+Latency percentiles for the combined log from ngap-logs.py: the count, p50, p90, p99 and max of
+total_time (ms) for each HTTP status code, provider, BES action (hyrax-bes-action) and time bucket.
+With --bes-timers, also the BES 'timing' records' elapsed time (hyrax-elapsed-us, as ms) for each
+timer name.
+
+The exact mode loads the columns it needs (from the columnar sidecar if there is a current one;
+see combined_columns.py) and computes all the percentiles for a dimension with one sort. The
+approximate mode (-a) streams the records into LatencyHistograms (within 1%), so its memory
+does not depend on the size of the log. Percentiles use the nearest-rank method in both.
+"""
+
+dimensions = ("status", "provider", "bes_action", "bucket")
+latency_fields = ["total_time", "http_response_code", "collectionId", "bes_action", "epoch_time"]
+default_percentiles = (50, 90, 99)
+no_value = "-"
+
+# BES timing record fields
+bes_elapsed_keys = ("hyrax-elapsed-us", "elapsed-us")
+bes_timer_name_keys = ("hyrax-timer-name", "timer-name")
+bes_type_keys = ("hyrax-type", "type")
+
+
+def bucket_name(start: float) -> str:
+    return datetime.fromtimestamp(start, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def status_key(code) -> str:
+    """
+    The status code as a group name; '-' if the record has none.
+    """
+    try:
+        return str(int(float(code)))
+    except (TypeError, ValueError):
+        return no_value
+
+
+def percentile_table(values, groups, group_count: int, percentiles=default_percentiles):
+    """
+    The count, nearest-rank percentiles and max of values in each group, from one sort.
+    Args:
+        values: The values (a float array)
+        groups: The group of each value (an int array, 0 .. group_count - 1)
+        group_count: The number of groups
+        percentiles: The percentiles to compute
+
+    Returns: A dict of 'count', 'p<N>' and 'max' arrays of length group_count (NaN for empty groups)
+    """
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.cumsum(counts) - counts
+    empty = counts == 0
+    table = {"count": counts}
+    for p in list(percentiles) + [100]:
+        ranks = np.maximum(np.ceil(p / 100 * counts).astype(np.int64) - 1, 0)
+        picked = sorted_values[np.minimum(starts + ranks, max(len(values) - 1, 0))] if len(values) else \
+            np.zeros(group_count)
+        table["max" if p == 100 else f"p{p:g}"] = np.where(empty, np.nan, picked)
+    return table
+
+
+def dimension_groups(columns: dict, dimension: str, count: int, width: int):
+    """
+    The group names for a dimension and each record's group (-1 for records that have none, e.g.,
+    no time for 'bucket').
+    """
+    if dimension == "provider":
+        return provider_codes(columns.get("collectionId"), count)
+    if dimension == "bes_action":
+        column = columns.get("bes_action")
+        if not isinstance(column, StringColumn):
+            return [no_value], np.zeros(count, dtype=np.int64)
+        names = column.values + [no_value]
+        groups = column.codes.astype(np.int64)
+        return names, np.where(groups < 0, len(names) - 1, groups)
+    if dimension == "status":
+        codes = numeric_column(columns.get("http_response_code"), count, fill=np.nan)
+        keys = np.where(np.isnan(codes), -1, np.nan_to_num(codes, nan=-1)).astype(np.int64)
+        unique, groups = np.unique(keys, return_inverse=True)
+        return [no_value if key < 0 else str(key) for key in unique.tolist()], groups.reshape(-1)
+    if dimension == "bucket":
+        times = numeric_column(columns.get("epoch_time"), count, fill=np.nan)
+        timed = ~np.isnan(times)
+        numbers = np.floor(np.where(timed, times, 0) / width).astype(np.int64)
+        unique, groups = np.unique(numbers[timed], return_inverse=True)
+        result = np.full(count, -1, dtype=np.int64)
+        result[timed] = groups.reshape(-1)
+        return [bucket_name(number * width) for number in unique.tolist()], result
+    raise ValueError(f"Unknown dimension '{dimension}'; use one of {', '.join(dimensions)}")
+
+
+def exact_latency(columns: dict, selected=dimensions, width: int = 3600, percentiles=default_percentiles):
+    """
+    Exact total_time percentiles for the selected dimensions from the columns of a combined log.
+    Returns: A list of [dimension, group, count, p.., max] rows; the first is for 'all' records (if
+    any have a total_time).
+    """
+    count = len(next(iter(columns.values()))) if columns else 0
+    total_time = columns.get("total_time")
+    timed = np.zeros(count, dtype=bool) if total_time is None or isinstance(total_time, StringColumn) else \
+        ~np.ma.getmaskarray(total_time)
+    values = numeric_column(total_time, count)[timed]
+
+    rows = []
+    table = percentile_table(values, np.zeros(len(values), dtype=np.int64), 1, percentiles)
+    if len(values):
+        rows.append(["all", "all"] + [table[name][0] for name in table])
+    for dimension in selected:
+        names, groups = dimension_groups(columns, dimension, count, width)
+        groups = groups[timed]
+        keep = groups >= 0
+        table = percentile_table(values[keep], groups[keep], len(names), percentiles)
+        for i in sorted(range(len(names)), key=names.__getitem__):
+            name = names[i]
+            if table["count"][i]:
+                rows.append([dimension, name] + [table[column][i] for column in table])
+    loggy(f"Computed percentiles for {len(values)} of {count} records with a total_time")
+    return rows
+
+
+def record_groups(record: dict, selected, width: int):
+    """
+    The (dimension, group) pairs of one lifecycle record, the same as dimension_groups().
+    """
+    for dimension in selected:
+        if dimension == "status":
+            yield dimension, status_key(record.get("http_response_code"))
+        elif dimension == "provider":
+            yield dimension, provider_of(record.get("collectionId")) if isinstance(record.get("collectionId"), str) \
+                else no_provider
+        elif dimension == "bes_action":
+            action = bes_action(record)
+            yield dimension, no_value if action is None else str(action)
+        elif dimension == "bucket":
+            seconds = next((t for t in (record_time(record.get(key)) for key in time_fields) if t is not None), None)
+            if seconds is not None:
+                yield dimension, bucket_name(np.floor(seconds / width) * width)
+        else:
+            raise ValueError(f"Unknown dimension '{dimension}'; use one of {', '.join(dimensions)}")
+
+
+def streaming_latency(combined_log_file: str, selected=dimensions, width: int = 3600,
+                      percentiles=default_percentiles, relative_accuracy: float = 0.01):
+    """
+    Approximate total_time percentiles, like exact_latency(), in one streaming pass over the JSON.
+    """
+    histograms = {("all", "all"): LatencyHistogram(relative_accuracy)}
+    for record in iter_combined_records(combined_log_file):
+        total_time = record.get("total_time")
+        if not isinstance(total_time, (int, float)) or isinstance(total_time, bool):
+            continue
+        histograms[("all", "all")].record(total_time)
+        for key in record_groups(record, selected, width):
+            if key not in histograms:
+                histograms[key] = LatencyHistogram(relative_accuracy)
+            histograms[key].record(total_time)
+    return histogram_rows(histograms, ["all"] + list(selected), percentiles)
+
+
+def histogram_rows(histograms: dict, order, percentiles=default_percentiles):
+    """
+    Rows like exact_latency() from a dict of (dimension, group) -> LatencyHistogram, in the given
+    order of dimensions and sorted by group.
+    """
+    rows = []
+    for dimension in order:
+        for key in sorted(key for key in histograms if key[0] == dimension):
+            summary = histograms[key].summary(percentiles)
+            if summary["count"]:
+                rows.append(list(key) + list(summary.values()))
+    return rows
+
+
+def _first(record: dict, keys):
+    return next((record[key] for key in keys if key in record), None)
+
+
+def bes_timer_latency(combined_log_file: str, approximate: bool = False, percentiles=default_percentiles,
+                      relative_accuracy: float = 0.01):
+    """
+    Percentiles of the BES timing records' elapsed time (ms) for each timer name.
+    Returns: Rows like exact_latency(), with 'bes_timer' as the dimension.
+    """
+    histograms = {}
+    elapsed = {}
+    for record in iter_combined_records(combined_log_file):
+        bes = record.get("bes")
+        if not isinstance(bes, list):
+            continue
+        for bes_record in bes:
+            if not isinstance(bes_record, dict) or _first(bes_record, bes_type_keys) != "timing":
+                continue
+            value = _first(bes_record, bes_elapsed_keys)
+            try:
+                ms = float(value) / 1000
+            except (TypeError, ValueError):
+                continue
+            name = str(_first(bes_record, bes_timer_name_keys) or no_value)
+            if approximate:
+                if name not in histograms:
+                    histograms[name] = LatencyHistogram(relative_accuracy)
+                histograms[name].record(ms)
+            else:
+                elapsed.setdefault(name, []).append(ms)
+
+    if approximate:
+        return histogram_rows({("bes_timer", name): h for name, h in histograms.items()}, ["bes_timer"],
+                              percentiles)
+    names = sorted(elapsed)
+    if not names:
+        return []
+    values = np.concatenate([np.array(elapsed[name], dtype=np.float64) for name in names])
+    groups = np.repeat(np.arange(len(names)), [len(elapsed[name]) for name in names])
+    table = percentile_table(values, groups, len(names), percentiles)
+    return [["bes_timer", name] + [table[column][i] for column in table] for i, name in enumerate(names)]
+
+
+def latency_header(percentiles=default_percentiles):
+    return ["dimension", "group", "count"] + [f"p{p:g}" for p in percentiles] + ["max"]
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="p50/p90/p99/max of total_time (ms) by status code, provider, "
+                                                 "BES action and time bucket from the combined log from "
+                                                 "ngap-logs.py; optionally the BES timers too.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", help="The combined log. default: hyrax_combined_logs.json",
+                        default="hyrax_combined_logs.json")
+    parser.add_argument("-d", "--dimensions", help=f"Comma separated dimensions. default: {','.join(dimensions)}",
+                        default=",".join(dimensions))
+    parser.add_argument("-b", "--bucket", help="The time bucket size: minute, hour, day or seconds. default: hour",
+                        default="hour")
+    parser.add_argument("-p", "--percentiles", help="Comma separated percentiles. default: 50,90,99",
+                        default="50,90,99")
+    parser.add_argument("-a", "--approximate", help="Stream the records into histograms (1%% accuracy) instead "
+                                                    "of loading the columns; for logs bigger than memory.",
+                        action="store_true")
+    parser.add_argument("-t", "--bes-timers", help="Also report the BES timing records by timer name.",
+                        action="store_true")
+    parser.add_argument("-o", "--output", help="Write the csv to this file instead of stdout.", default=None)
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    selected = [dimension for dimension in args.dimensions.split(",") if dimension]
+    for dimension in selected:
+        if dimension not in dimensions:
+            parser.error(f"Unknown dimension '{dimension}'; use one of {', '.join(dimensions)}")
+    try:
+        width = bucket_seconds(args.bucket)
+        percentiles = [float(p) for p in args.percentiles.split(",") if p]
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.approximate:
+        with stage("latency") as computing:
+            rows = streaming_latency(args.input, selected, width, percentiles)
+            computing.records_out = len(rows)
+    else:
+        with stage("load") as loading:
+            columns = load_combined_columns(args.input, latency_fields)
+            loading.records_out = len(next(iter(columns.values()))) if columns else 0
+        with stage("latency") as computing:
+            computing.records_in = loading.records_out
+            rows = exact_latency(columns, selected, width, percentiles)
+            computing.records_out = len(rows)
+    if args.bes_timers:
+        with stage("timers") as timing:
+            timer_rows = bes_timer_latency(args.input, args.approximate, percentiles)
+            timing.records_out = len(timer_rows)
+        rows += timer_rows
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        with stage("write") as writing:
+            writer = csv.writer(out)
+            writer.writerow(latency_header(percentiles))
+            for row in rows:
+                writer.writerow([f"{value:.1f}" if isinstance(value, float) else value for value in row])
+            writing.records_out = len(rows)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import math
+
+"""
+A small, mergeable latency histogram for streaming percentiles. Values are counted in
+logarithmic buckets (like an HDR histogram) so each bucket's width is a fixed fraction of
+its value; any percentile is then within 'relative_accuracy' of the true value. Memory
+depends on the range of the values, not the number of values, and two histograms with the
+same accuracy merge by adding their bucket counts, so per-file or per-shard histograms can
+be combined without the raw values.
+"""
+
+
+class LatencyHistogram:
+    """
+    Streaming histogram of non-negative values (e.g., times in ms).
+    Records are O(1); percentiles are computed from the bucket counts.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        """
+        Args:
+            relative_accuracy: The largest relative error in a reported percentile.
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zero_count = 0     # values too small to have a bucket (<= 0)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value: float, count: int = 1):
+        """
+        Add 'count' instances of 'value' to the histogram.
+        """
+        if value > 0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        else:
+            self.zero_count += count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram"):
+        """
+        Add the counts from 'other' to this histogram. Both must use the same accuracy.
+        Returns: This histogram.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge histograms with different relative accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def percentile(self, p: float):
+        """
+        The approximate p-th percentile (0-100) of the recorded values, or None if empty.
+        This is the nearest-rank percentile; the 0th and 100th are the exact min and max.
+        """
+        if self.count == 0:
+            return None
+        if p <= 0:
+            return self.min
+        if p >= 100:
+            return self.max
+
+        rank = math.ceil(p / 100 * self.count) - 1
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # The middle of the bucket (in relative terms), clamped to the observed range
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        """
+        The exact mean of the recorded values, or None if empty.
+        """
+        return self.total / self.count if self.count else None
+
+    def summary(self, percentiles=(50, 90, 99)) -> dict:
+        """
+        Returns: A dict with 'count', 'p<N>' for each of the percentiles, and 'max'.
+        """
+        result = {"count": self.count}
+        for p in percentiles:
+            result[f"p{p:g}"] = self.percentile(p)
+        result["max"] = self.max
+        return result
+
+    def to_dict(self) -> dict:
+        """
+        A JSON-friendly form of the histogram; see from_dict().
+        """
+        return {"relative_accuracy": self.relative_accuracy,
+                "buckets": {str(index): count for index, count in self.buckets.items()},
+                "zero_count": self.zero_count, "count": self.count, "total": self.total,
+                "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        """
+        Rebuild a histogram saved with to_dict().
+        """
+        histogram = cls(data["relative_accuracy"])
+        histogram.buckets = {int(index): count for index, count in data["buckets"].items()}
+        histogram.zero_count = data["zero_count"]
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
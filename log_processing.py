@@ -5,10 +5,20 @@
 import csv
 import argparse
 import os
+import time
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, Counter
 
-verbose = False
+from loganalysis import common
+from loganalysis.stats import stage
+
+# The record types written to the bes.log
+log_record_types = ("info", "timing", "request", "error", "verbose", "start-up")
+
+
+def convert_to_iso(timestamp):
+    """Converts Unix time in seconds to ISO 8601 format."""
+    return datetime.utcfromtimestamp(int(timestamp)).isoformat() + "Z"
 
 
 def split_csv_by_pid(input_file, field=2):
@@ -24,21 +34,24 @@ def split_csv_by_pid(input_file, field=2):
     pid_groups = defaultdict(list)
 
     # Read the input CSV file and group lines by PID
-    with open(input_file, mode='r') as infile:
+    with stage("load") as loading, open(input_file, mode='r') as infile:
         reader = csv.reader(infile)
         for line in reader:
             if line:  # Skip empty lines
                 pid = line[field]  # Assuming the PID is in the second column (index 2)
                 pid_groups[pid].append(line)
+        loading.records_out = sum(map(len, pid_groups.values()))
 
     # Write output files for each unique PID
     base_filename = os.path.splitext(os.path.basename(input_file))[0]
-    for pid, lines in pid_groups.items():
-        output_filename = f"{base_filename}_pid_{pid}.csv"
-        with open(output_filename, mode='w', newline='') as outfile:
-            writer = csv.writer(outfile)
-            writer.writerows(lines)
-        print(f"Written {output_filename}")
+    with stage("write") as writing:
+        writing.records_out = loading.records_out
+        for pid, lines in pid_groups.items():
+            output_filename = f"{base_filename}_pid_{pid}.csv"
+            with open(output_filename, mode='w', newline='') as outfile:
+                writer = csv.writer(outfile)
+                writer.writerows(lines)
+            print(f"Written {output_filename}")
 
 
 def transform_logs_to_csv(input_file, output_file):
@@ -50,10 +63,6 @@ def transform_logs_to_csv(input_file, output_file):
     - input_file: Path to the input file containing log lines.
     - output_file: Path to the output CSV file.
     """
-    def convert_to_iso(timestamp):
-        """Converts Unix time in seconds to ISO 8601 format."""
-        return datetime.utcfromtimestamp(int(timestamp)).isoformat() + "Z"
-
     line_count = 0
     info_count = 0
     timing_count = 0
@@ -61,7 +70,8 @@ def transform_logs_to_csv(input_file, output_file):
     request_count = 0
     unknown_count = 0
 
-    with open(input_file, 'r') as infile, open(output_file, 'w', newline='') as outfile:
+    with stage("normalize") as normalizing, open(input_file, 'r') as infile, \
+            open(output_file, 'w', newline='') as outfile:
         reader = infile.readlines()
         writer = csv.writer(outfile)
 
@@ -89,12 +99,13 @@ def transform_logs_to_csv(input_file, output_file):
 
             # Write the transformed line to the CSV file
             writer.writerow(fields)
+        normalizing.records_in = normalizing.records_out = line_count
 
     # sanity check; all lines accounted for?
     if line_count != info_count + timing_count + request_count + error_count:
         print(f"Error in the log file - some lines were not classified.")
 
-    if verbose:
+    if common.verbose:
         print(f"Total line: {line_count}")
         print(f"Info: {info_count}")
         print(f"Timing: {timing_count}")
@@ -103,6 +114,297 @@ def transform_logs_to_csv(input_file, output_file):
         print(f"Unknown: {unknown_count}")
 
 
+def split_log_line(line):
+    """
+    Split a raw bes.log line into the fields common to every record type.
+    The bes.log has two layouts: time|&|pid|&|type|&|... and, after instance IDs
+    were added, time|&|instance-id|&|pid|&|type|&|...
+    :param line: One line from a raw bes.log
+    :return: A tuple of (time, instance_id, pid, type, message) where message is
+    the rest of the line, or None if the line cannot be split. The instance_id is
+    None for the older layout and time/pid are None if they are not integers.
+    """
+    fields = line.rstrip("\n").split('|&|')
+    if len(fields) >= 4 and fields[3] in log_record_types:
+        instance_id = fields[1]
+        pid, record_type, rest = fields[2], fields[3], fields[4:]
+    elif len(fields) >= 3 and fields[2] in log_record_types:
+        instance_id = None
+        pid, record_type, rest = fields[1], fields[2], fields[3:]
+    else:
+        return None
+
+    try:
+        time = int(fields[0])
+    except ValueError:
+        time = None
+    try:
+        pid = int(pid)
+    except ValueError:
+        pid = None
+
+    return time, instance_id, pid, record_type, '|&|'.join(rest)
+
+
+# The fields that follow 'type' in a 'request' line. The first is always 'OLFS'.
+request_fields = ("client-ip", "user-agent", "session-id", "user-id", "olfs-start-time", "request-id",
+                  "http-verb", "url-path", "query-string", "bes-action", "return-as", "local-path", "ce")
+
+
+def log_line_to_record(line, prefix="hyrax-"):
+    """
+    Turn one raw bes.log line into the keyed record that beslog2json.py makes. Every
+    record has 'time', 'pid', 'type' and, for newer logs, 'instance-id'. Request lines
+    get the request_fields, timing lines get their '*-us' values plus 'request-id' and
+    'timer-name', and all the other types get 'message'.
+    :param line: One line from a raw bes.log
+    :param prefix: Prefix for all the keys (CloudWatch uses 'hyrax-')
+    :return: The record as a dict, or None if the line cannot be split.
+    """
+    fields = split_log_line(line)
+    if fields is None:
+        return None
+
+    time, instance_id, pid, record_type, message = fields
+    record = {prefix + "time": time}
+    if instance_id is not None:
+        record[prefix + "instance-id"] = instance_id
+    record[prefix + "pid"] = pid
+    record[prefix + "type"] = record_type
+
+    if record_type == "request":
+        values = message.split('|&|')[1:]  # skip 'OLFS'
+        for key, value in zip(request_fields, values):
+            record[prefix + key] = value
+        if prefix + "olfs-start-time" in record:
+            try:
+                record[prefix + "olfs-start-time"] = int(record[prefix + "olfs-start-time"])
+            except ValueError:
+                pass
+    elif record_type == "timing":
+        values = message.split('|&|')
+        # Name/value pairs like 'elapsed-us|&|1200|&|start-us|&|...' then the request id and timer name
+        while len(values) >= 2 and values[0].endswith("-us"):
+            try:
+                record[prefix + values[0]] = int(values[1])
+            except ValueError:
+                record[prefix + values[0]] = values[1]
+            values = values[2:]
+        if len(values) >= 2:
+            record[prefix + "request-id"] = values[0]
+            values = values[1:]
+        record[prefix + "timer-name"] = '|&|'.join(values)
+    else:
+        record[prefix + "message"] = message
+
+    return record
+
+
+def is_raw_bes_log(input_file):
+    """
+    Peek at a file to see if it is a raw bes.log and not JSON.
+    :param input_file: The file to check
+    :return: True if the first non-blank line is '|&|' delimited
+    """
+    with open(input_file, 'r') as infile:
+        for line in infile:
+            if line.strip():
+                return not line.lstrip().startswith(("{", "[")) and '|&|' in line
+    return False
+
+
+def read_bes_log_records(input_file, prefix="hyrax-"):
+    """
+    Read a raw bes.log, one line at a time, yielding the keyed record for each line.
+    Lines that cannot be split are skipped.
+    :param input_file: Path to the raw bes.log
+    :param prefix: Prefix for all the keys
+    :return: A generator of records
+    """
+    with open(input_file, 'r') as infile:
+        for line in infile:
+            record = log_line_to_record(line, prefix)
+            if record is not None:
+                yield record
+
+
+def export_logs_to_parquet(input_file, output_file, batch_size=65536):
+    """
+    Export a raw bes.log to a typed, columnar Parquet file. The columns are 'time' (int64
+    Unix time), 'instance_id', 'pid' and 'type' (all dictionary encoded, i.e., categorical)
+    and 'message' (the rest of the log line). Lines are written in row groups of batch_size
+    lines so the whole log is never held in memory.
+
+    Parameters:
+    - input_file: Path to the raw bes.log.
+    - output_file: Path to the Parquet file.
+    - batch_size: Number of log lines in each row group.
+    """
+    # pyarrow is only needed for this export; don't make the CSV tools depend on it.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("time", pa.int64()),
+        ("instance_id", pa.dictionary(pa.int32(), pa.string())),
+        ("pid", pa.dictionary(pa.int32(), pa.int64())),
+        ("type", pa.dictionary(pa.int8(), pa.string())),
+        ("message", pa.string()),
+    ])
+
+    def write_batch(writer, columns):
+        arrays = [pa.array(columns[0], type=pa.int64()),
+                  pa.array(columns[1], type=pa.string()).dictionary_encode(),
+                  pa.array(columns[2], type=pa.int64()).dictionary_encode(),
+                  pa.array(columns[3], type=pa.string()).dictionary_encode(),
+                  pa.array(columns[4], type=pa.string())]
+        arrays[1] = arrays[1].cast(schema.field("instance_id").type)
+        arrays[2] = arrays[2].cast(schema.field("pid").type)
+        arrays[3] = arrays[3].cast(schema.field("type").type)
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+    line_count = 0
+    bad_count = 0
+    columns = ([], [], [], [], [])
+    with open(input_file, 'r') as infile, pq.ParquetWriter(output_file, schema) as writer:
+        for line in infile:
+            fields = split_log_line(line)
+            if fields is None:
+                bad_count += 1
+                continue
+
+            line_count += 1
+            for column, value in zip(columns, fields):
+                column.append(value)
+
+            if len(columns[0]) >= batch_size:
+                write_batch(writer, columns)
+                columns = ([], [], [], [], [])
+
+        if columns[0]:
+            write_batch(writer, columns)
+
+    if bad_count:
+        print(f"Error in the log file - {bad_count} lines were not classified.")
+
+    if common.verbose:
+        print(f"Exported {line_count} lines to {output_file}")
+
+
+def follow_log(input_file, output_file, split=False, field=2, poll_interval=1.0, report_interval=60.0,
+               idle_timeout=None):
+    """
+    Follow (tail) a raw bes.log that is still being written, appending each new line to
+    the CSV output_file and, optionally, to the per-PID CSV files that split_csv_by_pid()
+    makes. The log is read from the start and then polled for new lines, so the cost of
+    each poll depends only on the new lines. If the log is rotated (a new file appears
+    under the same name) or truncated, its unterminated last line (if any) is written and
+    it is reopened and read from the start. The same happens to the last line on Ctrl-C.
+
+    Running counts of each record type and the line rate are printed every report_interval
+    seconds and when the follow stops.
+
+    Parameters:
+    - input_file: Path to the raw bes.log.
+    - output_file: Path to the CSV file; it is rewritten from the start.
+    - split: Also append each line to <output base>_pid_<PID>.csv
+    - field: zero-based index of the PID in the CSV line (see split_csv_by_pid())
+    - poll_interval: Seconds to wait between looks for new lines.
+    - report_interval: Seconds between the running statistics reports.
+    - idle_timeout: Stop after this many seconds with no new lines; None means follow until
+      interrupted (Ctrl-C).
+    :return: A Counter of the record types seen (plus 'lines' and 'unknown')
+    """
+    counts = Counter()
+    seen_pids = set()
+    base_filename = os.path.splitext(os.path.basename(output_file))[0]
+    start_time = time.monotonic()
+    last_report = start_time
+    last_report_lines = 0
+
+    def report():
+        nonlocal last_report, last_report_lines
+        now = time.monotonic()
+        rate = (counts["lines"] - last_report_lines) / max(now - last_report, 1e-9)
+        mean_rate = counts["lines"] / max(now - start_time, 1e-9)
+        by_type = ", ".join(f"{key}: {counts[key]}" for key in log_record_types + ("unknown",) if counts[key])
+        print(f"Lines: {counts['lines']} ({rate:.1f}/s now, {mean_rate:.1f}/s overall) {by_type}")
+        last_report = now
+        last_report_lines = counts["lines"]
+
+    def process(lines, writer):
+        pid_groups = defaultdict(list)
+        for line in lines:
+            counts["lines"] += 1
+            split_fields = split_log_line(line)
+            counts[split_fields[3] if split_fields else "unknown"] += 1
+
+            fields = line.strip().split('|&|')
+            try:
+                fields[0] = convert_to_iso(fields[0])
+            except ValueError:
+                pass  # If conversion fails, keep the original value
+            writer.writerow(fields)
+            if split and len(fields) > field:
+                pid_groups[fields[field]].append(fields)
+
+        # Open the per-PID files only for this batch; a busy BES can have many PIDs.
+        for pid, rows in pid_groups.items():
+            mode = 'a' if pid in seen_pids else 'w'
+            seen_pids.add(pid)
+            with open(f"{base_filename}_pid_{pid}.csv", mode=mode, newline='') as pid_file:
+                csv.writer(pid_file).writerows(rows)
+
+    infile = open(input_file, 'r')
+    partial = ""
+    idle_since = time.monotonic()
+    try:
+        with open(output_file, 'w', newline='') as outfile:
+            writer = csv.writer(outfile)
+            try:
+                while True:
+                    data = infile.read()
+                    if data:
+                        idle_since = time.monotonic()
+                        lines = (partial + data).split("\n")
+                        partial = lines.pop()  # the last line may still be being written
+                        process([line for line in lines if line], writer)
+                        outfile.flush()
+                    else:
+                        # Rotated (a different file now has the name) or truncated? Start over.
+                        try:
+                            stat = os.stat(input_file)
+                            if stat.st_ino != os.fstat(infile.fileno()).st_ino or stat.st_size < infile.tell():
+                                if common.verbose:
+                                    print(f"{input_file} was rotated or truncated; reopening it")
+                                # The old file's last line will not be finished now
+                                if partial:
+                                    process([partial], writer)
+                                    partial = ""
+                                infile.close()
+                                infile = open(input_file, 'r')
+                                continue
+                        except FileNotFoundError:
+                            pass  # between the rename and the new file; keep waiting
+
+                        if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                            break
+                        time.sleep(poll_interval)
+
+                    if time.monotonic() - last_report >= report_interval:
+                        report()
+            except KeyboardInterrupt:
+                pass
+
+            if partial:
+                process([partial], writer)
+    finally:
+        infile.close()
+
+    report()
+    return counts
+
+
 def main():
     parser = argparse.ArgumentParser(description="Process raw BES log files, turning them into CSV files."
                                                  " The intent is to not only transform them to CSV, but to"
@@ -117,17 +419,33 @@ def main():
                         action="store_true")
 
     parser.add_argument("-i", "--input", help="The log file (raw or CSV) to process.", required=True)
+    parser.add_argument("-f", "--format", help="Output format for a raw log; parquet writes typed columns "
+                                               "instead of CSV text (needs pyarrow). default: csv",
+                        choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--follow", help="Follow a raw log that is still being written (like 'tail -F'), "
+                                         "appending to the CSV (and per-PID files with -s) as lines arrive",
+                        action="store_true")
+    parser.add_argument("--poll-interval", help="Seconds between looks for new lines with --follow. default: 1",
+                        type=float, default=1.0)
+    parser.add_argument("--idle-timeout", help="Stop --follow after this many seconds with no new lines. "
+                                               "default: follow until interrupted", type=float, default=None)
+    parser.add_argument("-b", "--batch-size", help="Lines per Parquet row group. default: 65536",
+                        type=int, default=65536)
 
     # parser.add_argument("providers", nargs="*")
 
     args = parser.parse_args()
-    global verbose
-    verbose = args.verbose
+    common.verbose = args.verbose
 
     # This kludge means this can be called with a file that is already in CSV
     # form and have that file split up OR is can be called by a 'raw' log and
     # have that turned into CSV and, maybe, split.
-    if args.split and os.path.splitext(args.input)[1] == ".csv":  # hack; look for csv file
+    if args.follow:
+        follow_log(args.input, f"{os.path.splitext(args.input)[0]}.csv", args.split,
+                   poll_interval=args.poll_interval, idle_timeout=args.idle_timeout)
+    elif args.format == "parquet":
+        export_logs_to_parquet(args.input, f"{os.path.splitext(args.input)[0]}.parquet", args.batch_size)
+    elif args.split and os.path.splitext(args.input)[1] == ".csv":  # hack; look for csv file
         split_csv_by_pid(args.input)
     else:
         input_csv = f"{os.path.splitext(args.input)[0]}.csv"
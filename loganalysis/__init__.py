@@ -0,0 +1,5 @@
+"""
+The Hyrax/NGAP log analysis tools as one package. The tools are still the scripts at the top of
+the repository (ngap-logs.py, download_logs.py, ...); 'loganalysis <command>' (or 'python -m
+loganalysis <command>') runs one of them, importing only that tool. See loganalysis.cli.
+"""
@@ -0,0 +1,5 @@
+import sys
+
+from loganalysis.cli import main
+
+sys.exit(main())
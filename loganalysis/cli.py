@@ -0,0 +1,142 @@
+import importlib
+import importlib.util
+import os
+import sys
+
+"""
+One entry point for all the tools: 'loganalysis merge|download|split|report|... [args]'. The
+arguments after the command are the tool's own (see 'loganalysis <command> -h').
+
+The command table below is all that is loaded up front; the tool (and its dependencies, e.g.,
+boto3 for download or numpy for rollups) is imported only when its command runs, so a command
+starts as fast as the tool itself would.
+
+Every command also takes the stats options (they are taken out before the tool sees its
+arguments, so they work only through this command, not when a script is run by itself; see
+stats.py):
+  --stats[=FILE]       write the wall and CPU time, records in/out and peak RSS of each stage
+                       (load, normalize, index, join, write, ...) as JSON to FILE or stderr
+  --stats-tracemalloc  also record the peak of the Python heap in each stage (slower)
+  --profile[=STAGE]    run cProfile in the slowest stage (or STAGE) and save it to
+                       loganalysis-<command>-<stage>.prof
+"""
+
+# The scripts live in the directory above this package
+tools_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# command -> (the module or script that implements it, a one line description)
+commands = {
+    "download": ("download_logs", "Download CloudWatch JSON for a log group and time range."),
+    "merge": ("ngap-logs.py", "Merge the request, response and BES logs by request id."),
+    "split": ("log_processing", "Turn a raw bes.log into CSV (or Parquet) and split it up by PID."),
+    "join": ("join_json_arrays", "Join the records in two JSON arrays on a key."),
+    "join-metrics": ("join_metrics_log_with_application_log", "Join the metrics log with the BES log."),
+    "merge-request-response": ("merge_request_response", "Merge the OLFS request and response logs."),
+    "reorder": ("reorder-records.py", "Reorder the fields in JSON log records."),
+    "report": ("combined_report", "Report on the combined log from merge."),
+    "query": ("combined_query", "Select records from the combined log with a query."),
+    "columns": ("combined_columns", "Write the columnar sidecar of a combined log."),
+    "rollups": ("rollups", "Per-minute/hour tables of requests and status classes by provider."),
+    "latency": ("latency_analysis", "Latency percentiles by status, provider, BES action and time."),
+    "anomalies": ("anomaly_detector", "Flag 5xx/404 surges and p99 latency spikes."),
+    "cluster": ("cluster_errors", "Group BES log messages into templates."),
+    "search": ("message_index", "Search the BES log messages with an index."),
+    "spans": ("service_chain_spans", "Span trees and critical paths of the BES profile records."),
+    "response-times": ("response_times2", "Build a csv (and percentiles) from hyrax500 timing files."),
+    "top": ("heavy_hitters", "Approximate top users, IPs, collections, codes and errors (Count-Min)."),
+    "distinct": ("distinct_counts", "Distinct users, IPs, collections and granules by time and provider."),
+    "sqlite": ("sqlite_store", "Load combined logs into a SQLite database and query it."),
+    "pipeline": ("hourly_pipeline", "Download, merge and roll up a range of hours in parallel."),
+    "generate": ("synthetic_logs", "Write synthetic request, response and BES logs."),
+    "benchmark": ("benchmark", "Time and memory-profile the tools on synthetic logs."),
+}
+
+
+def load_tool(name: str):
+    """
+    Import the module that implements a command. Scripts with a '-' in their name (e.g.,
+    ngap-logs.py) are loaded from their file.
+    """
+    if tools_dir not in sys.path:
+        sys.path.insert(0, tools_dir)
+    if not name.endswith(".py"):
+        return importlib.import_module(name)
+    module_name = name[:-3].replace("-", "_")
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(tools_dir, name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def stats_options(argv: list):
+    """
+    Take the stats options out of a command's arguments.
+    Returns: (the other arguments, a dict with 'stats' (None or a file name, '-' for stderr),
+    'tracemalloc' and 'profile' (None or a stage name, '' for the slowest stage))
+    """
+    options = {"stats": None, "tracemalloc": False, "profile": None}
+    rest = []
+    for arg in argv:
+        name, equals, value = arg.partition("=")
+        if name == "--stats":
+            options["stats"] = value if equals else "-"
+        elif arg == "--stats-tracemalloc":
+            options["tracemalloc"] = True
+        elif name == "--profile":
+            options["profile"] = value if equals else ""
+        else:
+            rest.append(arg)
+    if options["tracemalloc"] and options["stats"] is None:
+        options["stats"] = "-"
+    return rest, options
+
+
+def run_with_stats(command: str, module, argv: list, options: dict):
+    """
+    Run a tool's main() with the stats recorder on, then write the stats and the profile.
+    """
+    from loganalysis.stats import recorder, write_report, write_profile
+    recorder.start(options["tracemalloc"], options["profile"])
+    try:
+        return module.main()
+    finally:
+        recorder.stop()
+        if options["stats"] is not None:
+            write_report(recorder.report(command, argv), options["stats"])
+        if options["profile"] is not None:
+            profiled = recorder.profiled()
+            if profiled is None:
+                print(f"loganalysis: no stage of '{command}' was profiled", file=sys.stderr)
+            else:
+                name, profile = profiled
+                write_profile(name, profile, f"loganalysis-{command}-{name}.prof")
+
+
+def usage() -> str:
+    width = max(len(command) for command in commands)
+    lines = ["usage: loganalysis <command> [args]", "", "commands:"]
+    lines += [f"  {command:{width}}  {description}" for command, (_, description) in commands.items()]
+    lines += ["", "Use 'loganalysis <command> -h' for the arguments of a command. Every command also takes",
+              "--stats[=FILE], --stats-tracemalloc and --profile[=STAGE]; see 'pydoc loganalysis.cli'."]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0 if argv else 2
+    command = argv[0]
+    if command not in commands:
+        print(f"loganalysis: unknown command '{command}'\n\n{usage()}", file=sys.stderr)
+        return 2
+
+    args, options = stats_options(argv[1:])
+    module = load_tool(commands[command][0])
+    sys.argv = [f"loganalysis {command}"] + args
+    if options["stats"] is None and options["profile"] is None:
+        return module.main()
+    return run_with_stats(command, module, args, options)
@@ -0,0 +1,109 @@
+import re
+import sys
+from datetime import datetime
+
+"""
+The helpers that every tool here used to have its own copy of: the verbose logging, the
+progress dots, ISO 8601 times and the provider in a collectionId. Only the standard library
+is imported, so loading this (and the tools that use it) stays fast.
+"""
+
+verbose = False
+
+# The fields of a combined log record that give its time, in order of preference
+time_fields = ("cloudwatch_timestamp", "time_completed")
+
+provider_pattern = re.compile(r"C\d+-([A-Za-z0-9_]+)")
+no_provider = "-"
+
+# The collection concept id (C1234-POCLOUD) and granule name in a collectionId (a request path)
+collection_pattern = re.compile(r"collections/(C\d+-[A-Za-z0-9_]+)(?:/granules/([^/?#]+))?")
+
+# The named time bucket widths, in seconds
+bucket_sizes = {"minute": 60, "hour": 3600, "day": 86400}
+
+# An hour (e.g., an hourly_pipeline.py shard) and a time, as ISO 8601 without a time zone
+shard_format = "%Y-%m-%dT%H"
+time_format = "%Y-%m-%dT%H:%M:%S"
+
+
+def loggy(message: str):
+    """
+    Prints a log message to stderr when verbose is enabled.
+    """
+    if verbose:
+        print(f"# {message}", file=sys.stderr)
+
+
+def stderr(message: str):
+    """
+    Prints a log message to stderr.
+    """
+    print(f"# {message}", file=sys.stderr)
+
+
+def wrap_a_line(msg: str, count: int, width=80):
+    """
+    A progress bar which will inject a newline when count % width is zero.
+    """
+    print(msg, end='', file=sys.stderr)
+    if not count % width:
+        print("", file=sys.stderr)
+
+
+def convert_iso_to_unix(iso_string):
+    """
+    Converts an ISO 8601 formatted string to a Unix timestamp.
+    """
+    try:
+        time_format = "%Y-%m-%dT%H:%M:%S%z"
+        dt = datetime.strptime(iso_string, time_format)  # Handle Z timezones
+        unix_timestamp = dt.timestamp()
+        return int(unix_timestamp)  # return as an integer.
+    except ValueError as e:
+        stderr(f"Error: Invalid ISO 8601 format: {e}")
+        return None  # Or raise the exception, depending on your needs.
+    except Exception as e:
+        stderr(f"An unexpected error occurred: {e}")
+        return None
+
+
+def provider_of(collection_id: str) -> str:
+    """
+    The provider in a collectionId, e.g., POCLOUD for /hyrax/ngap/collections/C1234-POCLOUD/...
+    """
+    match = provider_pattern.search(collection_id or "")
+    return match.group(1) if match else no_provider
+
+
+def collection_of(collection_id: str):
+    """
+    The collection concept id in a collectionId, e.g., C1234-POCLOUD for
+    /hyrax/ngap/collections/C1234-POCLOUD/granules/..., or None if it has none.
+    """
+    match = collection_pattern.search(collection_id or "")
+    return match.group(1) if match else None
+
+
+def bucket_seconds(bucket: str) -> int:
+    """
+    The width of a time bucket: 'minute', 'hour', 'day' or a number of seconds.
+    """
+    if bucket in bucket_sizes:
+        return bucket_sizes[bucket]
+    seconds = int(bucket)
+    if seconds <= 0:
+        raise ValueError(f"The bucket size must be positive, not {bucket}")
+    return seconds
+
+
+def parse_time(value: str) -> datetime:
+    """
+    Parse an ISO 8601 time (2025-03-27T09:00:00), hour (2025-03-27T09) or date (2025-03-27).
+    """
+    for fmt in (time_format, "%Y-%m-%dT%H:%M", shard_format, "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"Not an ISO 8601 time: '{value}'")
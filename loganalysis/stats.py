@@ -0,0 +1,182 @@
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+"""
+Per-stage timing and memory numbers for a run of a tool, instead of wrapping it in 'time' and
+'python -m cProfile' by hand (see the note in the ngap-logs.py header).
+
+The tools mark their stages (load, normalize, index, join, write, ...) with
+
+    with stage("index") as s:
+        ...
+        s.records_in = count
+
+'loganalysis <command> --stats' turns the recording on and writes a JSON document with the
+wall and CPU time, records in and out and peak RSS of each stage (and, with
+--stats-tracemalloc, the peak of the Python heap in each stage). '--profile' runs cProfile in
+each stage and keeps the profile of the slowest one (or, with '--profile=STAGE', only that
+stage). When stats are off, stage() does nothing but yield a throwaway object.
+
+A stage's peak_rss_mb is the process's high-water mark (ru_maxrss) when the stage ends, so it
+includes the peaks of the stages before it; rss_growth_mb is how much the stage itself raised it
+(0 when it stayed under an earlier peak).
+"""
+
+
+class Stage:
+    """
+    The numbers for one stage. The tool sets records_in and records_out.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.records_in = None
+        self.records_out = None
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_rss_mb = None
+        self.rss_growth_mb = None
+        self.tracemalloc_peak_mb = None
+        self.profile = None
+
+    def to_dict(self) -> dict:
+        result = {"name": self.name, "wall_s": round(self.wall_s, 6), "cpu_s": round(self.cpu_s, 6)}
+        for key in ("records_in", "records_out", "peak_rss_mb", "rss_growth_mb", "tracemalloc_peak_mb"):
+            value = getattr(self, key)
+            if value is not None:
+                result[key] = round(value, 3) if isinstance(value, float) else value
+        return result
+
+
+def peak_rss_mb() -> float:
+    """
+    The peak resident set size of this process so far, in MB (ru_maxrss is KB on Linux, bytes on macOS).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Recorder:
+    """
+    Records the stages of one run. There is one, 'recorder', per process; see start() and stage().
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.tracemalloc = False
+        self.profile = None         # None, a stage name, or "" for the slowest stage
+        self.stages = []
+        self.started = None
+
+    def start(self, tracemalloc: bool = False, profile=None):
+        self.enabled = True
+        self.tracemalloc = tracemalloc
+        self.profile = profile
+        self.stages = []
+        self.started = (time.perf_counter(), time.process_time())
+        if tracemalloc:
+            import tracemalloc as tm
+            tm.start()
+
+    def stop(self):
+        self.enabled = False
+        if self.tracemalloc:
+            import tracemalloc as tm
+            tm.stop()
+
+    def _profiling(self, name: str) -> bool:
+        return self.profile is not None and self.profile in ("", name)
+
+    @contextmanager
+    def stage(self, name: str):
+        current = Stage(name)
+        if not self.enabled:
+            yield current
+            return
+        profiler = None
+        if self._profiling(name):
+            import cProfile
+            profiler = cProfile.Profile()
+        if self.tracemalloc:
+            import tracemalloc as tm
+            # reset_peak() is new in 3.9; before that, the peak is the run's so far
+            if hasattr(tm, "reset_peak"):
+                tm.reset_peak()
+        rss = peak_rss_mb()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield current
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            current.wall_s = time.perf_counter() - wall
+            current.cpu_s = time.process_time() - cpu
+            current.peak_rss_mb = peak_rss_mb()
+            current.rss_growth_mb = current.peak_rss_mb - rss
+            if self.tracemalloc:
+                import tracemalloc as tm
+                current.tracemalloc_peak_mb = tm.get_traced_memory()[1] / (1024 * 1024)
+            if profiler is not None:
+                # Keep only the slowest profiled stage
+                profiled = [s for s in self.stages if s.profile is not None]
+                if not profiled or current.wall_s > profiled[0].wall_s:
+                    for s in profiled:
+                        s.profile = None
+                    current.profile = profiler
+            self.stages.append(current)
+
+    def report(self, tool: str = None, argv=None) -> dict:
+        """
+        The JSON document for the run so far.
+        """
+        wall, cpu = self.started or (time.perf_counter(), time.process_time())
+        result = {"tool": tool, "argv": list(argv) if argv is not None else None,
+                  "wall_s": round(time.perf_counter() - wall, 6), "cpu_s": round(time.process_time() - cpu, 6),
+                  "peak_rss_mb": round(peak_rss_mb(), 3), "stages": [s.to_dict() for s in self.stages]}
+        profiled = next((s for s in self.stages if s.profile is not None), None)
+        if profiled is not None:
+            result["profiled_stage"] = profiled.name
+        return result
+
+    def profiled(self):
+        """
+        The (stage name, cProfile.Profile) of the profiled stage, or None.
+        """
+        return next(((s.name, s.profile) for s in self.stages if s.profile is not None), None)
+
+
+recorder = Recorder()
+
+
+def stage(name: str):
+    """
+    Record a stage of the current run (a no-op unless stats are on). Use as a context manager.
+    """
+    return recorder.stage(name)
+
+
+def write_report(report: dict, destination: str = "-"):
+    """
+    Write the stats document as JSON to a file, or to stderr for '-'.
+    """
+    text = json.dumps(report, indent=2)
+    if destination == "-":
+        print(text, file=sys.stderr)
+    else:
+        with open(destination, 'w') as f:
+            f.write(text + "\n")
+
+
+def write_profile(name: str, profile, destination: str, limit: int = 25):
+    """
+    Save a stage's profile (pstats format) and print its top functions by cumulative time to stderr.
+    """
+    import pstats
+    profile.dump_stats(destination)
+    print(f"# Profile of stage '{name}' saved to {destination}", file=sys.stderr)
+    pstats.Stats(profile, stream=sys.stderr).sort_stats("cumulative").print_stats(limit)
@@ -7,7 +7,11 @@ value as an index.
 
 import json
 
-def merge_json_files(file1_path, file2_path, output_path):
+from join_json_arrays import join_json_arrays_partitioned, parse_memory_size
+from loganalysis.stats import stage
+
+
+def merge_json_files(file1_path, file2_path, output_path, memory_limit=0):
     """
     Merges two JSON files based on the 'request_id' field.
 
@@ -15,28 +19,41 @@ def merge_json_files(file1_path, file2_path, output_path):
         file1_path (str): Path to the first JSON file.
         file2_path (str): Path to the second JSON file.
         output_path (str): Path to the output JSON file.
+        memory_limit (int): If not zero, partition the files on disk so that the merge
+            uses about this many bytes of memory (see join_json_arrays_partitioned()).
     """
 
     try:
-        with open(file1_path, 'r') as f1, open(file2_path, 'r') as f2:
+        if memory_limit:
+            join_json_arrays_partitioned(file1_path, file2_path, 'request_id', output_path, memory_limit)
+            print(f"Merged data written to {output_path}")
+            return
+
+        with stage("load") as loading, open(file1_path, 'r') as f1, open(file2_path, 'r') as f2:
             data1 = json.load(f1)
             data2 = json.load(f2)
+            loading.records_out = len(data1) + len(data2)
 
         # Create a dictionary for quick lookup from data2
-        data2_dict = {item['request_id']: item for item in data2}
+        with stage("index") as indexing:
+            data2_dict = {item['request_id']: item for item in data2}
+            indexing.records_in, indexing.records_out = len(data2), len(data2_dict)
 
         merged_data = []
-        for item1 in data1:
-            request_id = item1['request_id']
-            if request_id in data2_dict:
-                # Merge the dictionaries
-                merged_item = {**item1, **data2_dict[request_id]}
-                merged_data.append(merged_item)
-            else:
-                merged_data.append(item1)  # Keep item1 if no match in data2
-
-        with open(output_path, 'w') as output_file:
+        with stage("join") as joining:
+            for item1 in data1:
+                request_id = item1['request_id']
+                if request_id in data2_dict:
+                    # Merge the dictionaries
+                    merged_item = {**item1, **data2_dict[request_id]}
+                    merged_data.append(merged_item)
+                else:
+                    merged_data.append(item1)  # Keep item1 if no match in data2
+            joining.records_in = joining.records_out = len(merged_data)
+
+        with stage("write") as writing, open(output_path, 'w') as output_file:
             json.dump(merged_data, output_file, indent=2)
+            writing.records_out = len(merged_data)
 
         print(f"Merged data written to {output_path}")
 
@@ -47,9 +64,24 @@ def merge_json_files(file1_path, file2_path, output_path):
     except Exception as e:
         print(f"An error occurred: {e}")
 
-# Example usage:
-file1_path = 'request_log.json'  # Replace with your file paths
-file2_path = 'response_log.json'
-output_path = 'merged_request_response.json'
 
-merge_json_files(file1_path, file2_path, output_path)
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Merge the request and response logs using 'request_id'.")
+    parser.add_argument("-q", "--request_log", help="The request log. default: request_log.json",
+                        default="request_log.json")
+    parser.add_argument("-r", "--response_log", help="The response log. default: response_log.json",
+                        default="response_log.json")
+    parser.add_argument("-o", "--output", help="Output file name. default: merged_request_response.json",
+                        default="merged_request_response.json")
+    parser.add_argument("-m", "--memory-limit", help="Merge logs too big for memory by partitioning them on disk "
+                                                     "(e.g., 512M, 2G)", default="")
+
+    args = parser.parse_args()
+
+    merge_json_files(args.request_log, args.response_log, args.output,
+                     parse_memory_size(args.memory_limit) if args.memory_limit else 0)
+
+
+if __name__ == "__main__":
+    main()
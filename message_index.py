@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+import bisect
+import json
+import os
+import re
+import struct
+from array import array
+
+from json_stream import iter_json_records
+from log_processing import is_raw_bes_log, log_line_to_record
+from loganalysis import common
+from loganalysis.common import loggy
+from loganalysis.stats import stage
+
+"""
+A full-text index over the 'hyrax-message', 'hyrax-url-path' and 'hyrax-local-path' values in a
+BES log, so finding every record that mentions a granule, 'NgapApi.cc:304' or 'Memory Cache miss'
+does not mean a jq 'contains' scan of the whole log for each search.
+
+The index (<log>.midx) is built in one pass. The text is split into lower case terms (runs of
+letters and digits) and, for each term, the numbers of the records that have it are stored as
+delta-encoded varints. The index also holds the byte offset and length of each record in the
+log and the request id of each record (its own hyrax-request-id or the last one logged by the
+same instance and pid), so a search reads only the terms' postings and the matching records.
+
+A search for several terms finds the records that have all of them. A phrase search (-p) also
+checks that the text appears, ignoring case, in one of the indexed fields of the record.
+The log can be a JSON array, raw JSON records or a raw bes.log.
+"""
+
+index_magic = b"HYMIDX1\n"
+index_suffix = ".midx"
+indexed_fields = ("message", "url-path", "local-path")
+term_pattern = re.compile(r"[a-z0-9]+")
+
+
+def terms_of(text: str) -> list:
+    """
+    The terms in a piece of text: lower case runs of letters and digits.
+    """
+    return term_pattern.findall(text.lower())
+
+
+def encode_postings(numbers) -> bytes:
+    """
+    Encode increasing record numbers as the varints of their differences.
+    """
+    out = bytearray()
+    previous = 0
+    for number in numbers:
+        delta = number - previous
+        previous = number
+        while delta >= 0x80:
+            out.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_postings(data: bytes) -> list:
+    """
+    The record numbers from encode_postings().
+    """
+    numbers = []
+    number = 0
+    delta = 0
+    shift = 0
+    for byte in data:
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            number += delta
+            numbers.append(number)
+            delta = 0
+            shift = 0
+    return numbers
+
+
+def iter_log_records(source_file: str, prefix: str = "hyrax-"):
+    """
+    Yield (byte offset, byte length, record) for each record in a BES log: JSON or a raw bes.log.
+    """
+    if not is_raw_bes_log(source_file):
+        yield from iter_json_records(source_file, with_offsets=True)
+        return
+    offset = 0
+    with open(source_file, 'rb') as f:
+        for line in f:
+            record = log_line_to_record(line.decode("utf-8", errors="replace"), prefix)
+            if record is not None:
+                yield offset, len(line), record
+            offset += len(line)
+
+
+def build_index(source_file: str, index_file: str = None, prefix: str = "hyrax-") -> str:
+    """
+    Index a BES log in one pass. Returns the name of the index file (default: <log>.midx).
+    """
+    index_file = index_file or source_file + index_suffix
+    stat = os.stat(source_file)
+    raw = is_raw_bes_log(source_file)
+    fields = [prefix + field for field in indexed_fields]
+    request_id_key, instance_key, pid_key = prefix + "request-id", prefix + "instance-id", prefix + "pid"
+
+    postings = {}
+    offsets = array('Q')
+    lengths = array('I')
+    request_numbers = array('i')
+    request_ids = {}
+    latest_request = {}     # (instance, pid) -> the number of the last request id it logged
+    for number, (offset, length, record) in enumerate(iter_log_records(source_file, prefix)):
+        offsets.append(offset)
+        lengths.append(length)
+        process = (record.get(instance_key), record.get(pid_key))
+        if record.get(request_id_key):
+            latest_request[process] = request_ids.setdefault(record[request_id_key], len(request_ids))
+        request_numbers.append(latest_request.get(process, -1))
+        seen = set()
+        for field in fields:
+            value = record.get(field)
+            if isinstance(value, str):
+                seen.update(terms_of(value))
+        for term in seen:
+            postings.setdefault(term, []).append(number)
+
+    terms = sorted(postings)
+    starts = array('Q', [0])
+    blobs = []
+    for term in terms:
+        blobs.append(encode_postings(postings[term]))
+        starts.append(starts[-1] + len(blobs[-1]))
+    sections = ["\n".join(terms).encode("utf-8"), starts.tobytes(), b"".join(blobs), offsets.tobytes(),
+                lengths.tobytes(), request_numbers.tobytes(), "\n".join(request_ids).encode("utf-8")]
+    header = json.dumps({"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns, "count": len(offsets),
+                         "terms": len(terms), "prefix": prefix, "fields": fields, "raw": raw,
+                         "sections": [len(section) for section in sections]}).encode("utf-8")
+    with open(index_file, 'wb') as f:
+        f.write(index_magic + struct.pack("<I", len(header)) + header)
+        for section in sections:
+            f.write(section)
+    loggy(f"Indexed {len(terms)} terms in {len(offsets)} records of {source_file} into {index_file}")
+    return index_file
+
+
+class MessageIndex:
+    """
+    A loaded message index. search() finds records; records() reads them from the log.
+    """
+
+    def __init__(self, source_file: str, index_file: str = None):
+        self.source_file = source_file
+        with open(index_file or source_file + index_suffix, 'rb') as f:
+            if f.read(len(index_magic)) != index_magic:
+                raise ValueError(f"{f.name} is not a message index")
+            header_length, = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(header_length))
+            terms, starts, postings, offsets, lengths, request_numbers, request_ids = \
+                (f.read(size) for size in self.header["sections"])
+        self.terms = terms.decode("utf-8").split("\n") if self.header["terms"] else []
+        self.starts = array('Q')
+        self.starts.frombytes(starts)
+        self.postings = postings
+        self.offsets = array('Q')
+        self.offsets.frombytes(offsets)
+        self.lengths = array('I')
+        self.lengths.frombytes(lengths)
+        self.request_numbers = array('i')
+        self.request_numbers.frombytes(request_numbers)
+        self.request_ids = request_ids.decode("utf-8").split("\n") if request_ids else []
+
+    @property
+    def count(self) -> int:
+        return len(self.offsets)
+
+    def is_current(self) -> bool:
+        """
+        True if the log has not changed since it was indexed.
+        """
+        stat = os.stat(self.source_file)
+        return stat.st_size == self.header["source_size"] and stat.st_mtime_ns == self.header["source_mtime_ns"]
+
+    def term_postings(self, term: str) -> list:
+        """
+        The numbers of the records that have a term.
+        """
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return []
+        return decode_postings(self.postings[self.starts[i]:self.starts[i + 1]])
+
+    def request_id(self, number: int):
+        request_number = self.request_numbers[number]
+        return self.request_ids[request_number] if request_number >= 0 else None
+
+    def records(self, numbers):
+        """
+        Yield (request id, record) for the given record numbers, read from the log.
+        """
+        raw = self.header["raw"]
+        with open(self.source_file, 'rb') as f:
+            for number in numbers:
+                f.seek(self.offsets[number])
+                data = f.read(self.lengths[number])
+                record = log_line_to_record(data.decode("utf-8", errors="replace"), self.header["prefix"]) \
+                    if raw else json.loads(data)
+                yield self.request_id(number), record
+
+    def search(self, query: str, phrase: bool = False):
+        """
+        Find the records that have all the terms in the query (and, for a phrase, the query text).
+        Returns: A list of (request id, record) tuples, in log order
+        """
+        postings = sorted((self.term_postings(term) for term in set(terms_of(query))), key=len)
+        if not postings:
+            return []
+        numbers = set(postings[0])     # the shortest first, so the set only gets smaller
+        for numbers_with_term in postings[1:]:
+            if not numbers:
+                break
+            numbers.intersection_update(numbers_with_term)
+        results = list(self.records(sorted(numbers)))
+        if phrase:
+            text = query.lower()
+            results = [(request_id, record) for request_id, record in results
+                       if any(isinstance(record.get(field), str) and text in record[field].lower()
+                              for field in self.header["fields"])]
+        return results
+
+
+def open_index(source_file: str, index_file: str = None, prefix: str = "hyrax-", rebuild: bool = False):
+    """
+    Load the index of a BES log, building it first if it is missing, out of date or rebuild is True.
+    """
+    index_file = index_file or source_file + index_suffix
+    if not rebuild and os.path.exists(index_file):
+        try:
+            index = MessageIndex(source_file, index_file)
+            if index.is_current() and index.header["prefix"] == prefix:
+                return index
+            loggy(f"{index_file} is out of date")
+        except (OSError, ValueError, KeyError) as e:
+            loggy(f"Could not load {index_file}: {e}")
+    build_index(source_file, index_file, prefix)
+    return MessageIndex(source_file, index_file)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Search the hyrax-message, hyrax-url-path and hyrax-local-path "
+                                                 "values of a BES log using an index (<log>.midx) that is built "
+                                                 "the first time. Prints the request id and record of each match.")
+    parser.add_argument("query", help="The terms to find, e.g., 'NgapApi.cc:304' or 'Memory Cache miss'.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", help="The BES log: JSON or a raw bes.log. default: bes_log.json",
+                        default="bes_log.json")
+    parser.add_argument("-x", "--index", help="The index file. default: <input>.midx", default=None)
+    parser.add_argument("-b", "--bes_prefix", help="The prefix of the BES log keys. default: hyrax-",
+                        default="hyrax-")
+    parser.add_argument("-r", "--rebuild", help="Rebuild the index even if it is current.", action="store_true")
+    parser.add_argument("-p", "--phrase", help="Match the query as a phrase, not just all of its terms.",
+                        action="store_true")
+    parser.add_argument("-c", "--count", help="Only print the number of matching records.", action="store_true")
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    with stage("index") as indexing:
+        index = open_index(args.input, args.index, args.bes_prefix, args.rebuild)
+        indexing.records_out = index.count
+    with stage("search") as searching:
+        searching.records_in = index.count
+        results = index.search(args.query, args.phrase)
+        searching.records_out = len(results)
+    if args.count:
+        print(len(results))
+        return
+    with stage("write") as writing:
+        for request_id, record in results:
+            print(f"{request_id or '-'}\t{json.dumps(record)}")
+        writing.records_out = len(results)
+    loggy(f"{len(results)} of {index.count} records matched")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,16 @@
 #!/usr/bin/env python3
 
 import json
-import sys
-from datetime import datetime
+from collections import namedtuple
+
+from log_processing import is_raw_bes_log, read_bes_log_records
+from json_stream import iter_json_records, JsonObjectWriter
+from join_json_arrays import sort_merge_join
+from event_dedup import Deduplicator
+from service_chain_spans import add_spans
+from loganalysis import common
+from loganalysis.common import loggy, stderr, convert_iso_to_unix
+from loganalysis.stats import stage
 
 
 """
@@ -36,53 +44,14 @@ the logged information for a particular request ID.
 # 12161
 #
 # jhrg 3/27/25
+#
+# The merge now reads each log once into an index on the request id (get_merged_sources()),
+# so the two list/dict comprehensions above are no longer run once per request.
 
 
-verbose = False
 max_records = 0
 
 
-def loggy(message: str):
-    """
-    Prints a log message tpo stderr when verbose is enabled.
-    """
-    if verbose:
-        print(f"# {message}", file=sys.stderr)
-
-
-def stderr(message: str):
-    """
-    Prints a log message to stderr.
-    """
-    print(f"# {message}", file=sys.stderr)
-
-
-def wrap_a_line(msg: str, count: int, width=80):
-    """
-    A progress bar which will inject a newline when count % width is zero.
-    """
-    print(msg, end='', file=sys.stderr)
-    if not count % width:
-        print("", file=sys.stderr)
-
-
-def convert_iso_to_unix(iso_string):
-    """
-    Converts an ISO 8601 formatted string to a Unix timestamp.
-    """
-    try:
-        time_format = "%Y-%m-%dT%H:%M:%S%z"
-        dt = datetime.strptime(iso_string, time_format)  # Handle Z timezones
-        unix_timestamp = dt.timestamp()
-        return int(unix_timestamp)  # return as an integer.
-    except ValueError as e:
-        stderr(f"Error: Invalid ISO 8601 format: {e}")
-        return None  # Or raise the exception, depending on your needs.
-    except Exception as e:
-        stderr(f"An unexpected error occurred: {e}")
-        return None
-
-
 application_log_request_type = "request"
 application_log_info_type = "info"
 application_log_error_type = "error"
@@ -94,12 +63,12 @@ bes_log_type_key = "type"
 bes_log_prefix = ""
 
 
-# TODO - Make this "peek" at the file ??
 def get_records(source_file: str):
     """
     Reads JSON records from the supplied file into a list. First it tries to read the file as a collection of json
     objects without the delimiting json list syntax of commas and square brackets. If that fails, then it tries to
     read the file as a json list of objects with the attendant commas and enclosing square brackets: [{},{},{}]
+    If the file is a raw bes.log ('|&|' delimited lines) it is parsed directly into the same keyed records.
     Args:
         source_file:
 
@@ -110,6 +79,14 @@ def get_records(source_file: str):
     failed = False
     loggy(f"{prolog}BEGIN")
     try:
+        # Peek at the file; a raw bes.log does not need a trip through beslog2json.py and jq.
+        try:
+            if is_raw_bes_log(source_file):
+                return get_bes_log_records(source_file)
+        except FileNotFoundError:
+            stderr(f"{prolog}ERROR: File not found. path: '{source_file}'")
+            exit(404)
+
         # Try as a list formatted json file.
         try:
             return get_list_records(source_file)
@@ -185,6 +162,21 @@ def get_raw_records(source_file: str):
     return records
 
 
+def get_bes_log_records(source_file: str):
+    """
+    Reads a raw bes.log, a line at a time, and returns a list of the keyed records.
+    Args:
+        source_file: The raw bes.log file.
+
+    Returns: The list of records.
+    """
+    prolog = "get_bes_log_records() - "
+    loggy(f"{prolog}Loading raw bes.log records from: '{source_file}'")
+    records = list(read_bes_log_records(source_file, bes_log_prefix))
+    loggy(f"{prolog}Loaded {len(records)} records from '{source_file}'.")
+    return records
+
+
 def get_match(records: list, search_key: str, search_value: str, destination_name: str):
     """
     Finds the first matching record in records.
@@ -329,50 +321,266 @@ def get_request(target_request_id: str,
         json.dump(request_log_record, fio, indent=2)
 
 
+# One input log for the merge: its name, file, the key holding the request id, whether a request has many records
+# in it (the records are listed under 'name') or one (its fields are merged into the lifecycle record), and the key
+# of its time (for --sort-merge). The first source is the request log; every request in it gets a lifecycle record.
+LogSource = namedtuple("LogSource", "name file key many time_key")
+
+
+def default_sources(request_log_file: str, response_log_file: str, bes_log_file: str, time_keys=None):
+    """
+    The three logs that ngap-logs.py has always merged: request_log, response_log and bes.
+    Args:
+        request_log_file: The CloudWatch request_log for the hyrax log group.
+        response_log_file: The CloudWatch response_log for the hyrax log group
+        bes_log_file: The BES application log, json or raw, from the same time period as the metrics log.
+        time_keys: The time keys for the three logs, for --sort-merge.
+
+    Returns: A list of LogSource
+    """
+    time_keys = time_keys or ("cloudwatch_timestamp", "time_completed", bes_log_prefix + "time")
+    return [LogSource("request_log", request_log_file, request_id_key, False, time_keys[0]),
+            LogSource("response_log", response_log_file, request_id_key, False, time_keys[1]),
+            LogSource("bes", bes_log_file, bes_log_request_id_key, True, time_keys[2])]
+
+
+def missing_error(source_name: str) -> tuple:
+    """
+    The key and message a lifecycle record gets when a 'one' source has no record for it. The response log
+    keeps the 'ERROR' key the merge has always written; every other source gets its own 'ERROR_<name>' key,
+    so one source's error does not replace another's.
+    Returns: (key, message)
+    """
+    key = "ERROR" if source_name == "response_log" else f"ERROR_{source_name}"
+    return key, f"Failed to locate matching record in {source_name}"
+
+
+def merge_lifecycle_record(request_id: str, sources: list, matches: list):
+    """
+    Builds the lifecycle record for request_id from the records that matched it in each source.
+    Args:
+        request_id: The request id
+        sources: The LogSource for each source
+        matches: The list of matching records from each source, in the order of 'sources'
+
+    Returns: The lifecycle record
+    """
+    result_record = {}
+    for source, records in zip(sources, matches):
+        if source.many:
+            result_record[source.name] = records
+        elif records:
+            result_record.update(records[-1])   # the last one wins, as in get_match()
+        else:
+            error_key, error = missing_error(source.name)
+            result_record.update({source.key: request_id, error_key: error})
+    return result_record
+
+
 def get_merged(request_log_file: str,
                response_log_file: str,
                bes_log_file: str,
-               out_file: str):
+               out_file: str,
+               extra_sources: list = ()):
     """
     Merge the request life cycle data from the three logs: Cloudwatch request_log, Cloudwatch response_log and the
-    BES application log (bes.log).
+    BES application log (bes.log), plus any extra_sources.
     Args:
         request_log_file: The CloudWatch request_log for the hyrax log group.
         response_log_file: The CloudWatch response_log for the hyrax log group
         bes_log_file: The BES application log, encoded as json. from the same time period as the metrics log.
         out_file: Filename where the JSON should be written.
+        extra_sources: More LogSources to merge (e.g., the hyrax_edl_profiling_log)
 
     Returns: nothing
     """
-    prolog = "get_merged() - "
-    request_log_records = get_records(request_log_file)
-    response_log_records = get_records(response_log_file)
-    bes_log_records = get_records(bes_log_file)
+    sources = default_sources(request_log_file, response_log_file, bes_log_file) + list(extra_sources)
+    get_merged_sources(sources, out_file)
+
+
+def column_builder(columns_format: str):
+    """
+    A ColumnBuilder for the columnar sidecar, or None if columns_format is None. The import is here so that
+    numpy is only needed when a sidecar is written.
+    """
+    if not columns_format:
+        return None
+    from combined_columns import ColumnBuilder
+    return ColumnBuilder()
 
-    # Build a list of all the request_id values in the request_log_records
-    request_ids = [
-        record.get(request_id_key, "")
-        for record in request_log_records
-        if record.get(request_id_key, "") != ""
-    ]
-    # Now make a dictionary of all the request lifecycle records
+
+def save_columns(builder, out_file: str, columns_format: str):
+    if builder is not None:
+        from combined_columns import sidecar_path
+        path = sidecar_path(out_file, columns_format)
+        with stage("write"):
+            builder.save(path, out_file)
+        stderr(f"Columnar sidecar saved to {path}")
+
+
+def get_merged_sources(sources: list, out_file: str, columns_format: str = None, spans: bool = False,
+                       dedup=False):
+    """
+    Merge any number of logs in one pass over each. Every source is read once, a record at a time, into an index
+    on its key; then one pass over the request ids of the first source builds the lifecycle records.
+    Args:
+        sources: A list of LogSource; the first is the request log.
+        out_file: Filename where the JSON should be written.
+        columns_format: Also write a columnar sidecar of the records' scalar fields ('npz' or 'parquet'; see
+            combined_columns.py)
+        spans: Add the span tree, critical path and stage times of the BES profile records to each record as
+            'spans' (see service_chain_spans.py)
+        dedup: Drop the records that are in the sources more than once, by their CloudWatch eventId or, in the
+            'one' sources, their content (see event_dedup.py). True uses one Deduplicator for all the sources;
+            pass a Deduplicator to share it with other merges (e.g., the hours of a multi-day run)
+
+    Returns: A tuple of (the records of the other sources whose key is not in the first source (e.g., the
+    response to a request logged in the hour before), as a dict of source name -> {key: records}, and the
+    set of request ids written)
+    """
+    prolog = "get_merged_sources() - "
+
+    deduplicator = run_deduplicator(dedup)
+
+    # Build a list of all the request_id values in the first source and an index for each source
+    request_ids = []
+    indexes = []
+    with stage("index") as indexing:
+        indexing.records_in = 0
+        for source_num, source in enumerate(sources):
+            loggy(f"{prolog}Indexing {source.name} from '{source.file}' on '{source.key}'")
+            index = {}
+            # A request has one record in a 'one' source, so a record identical to another is a copy
+            for record in iter_records(source.file, deduplicator, not source.many):
+                indexing.records_in += 1
+                key_value = record.get(source.key, "")
+                if key_value == "":
+                    continue
+                index.setdefault(key_value, []).append(record)
+                if source_num == 0:
+                    request_ids.append(key_value)
+            loggy(f"{prolog}Indexed {len(index)} keys from {source.name}")
+            indexes.append(index)
+        indexing.records_out = len(request_ids)
+
+    # Now write the request lifecycle records, a request_id at a time
     id_num = 0
-    merged_logs = {}
-    for request_id in request_ids:
-        id_num += 1
-        loggy(f"{prolog}--------------------------------------------------------------------------------------")
-        loggy(f"{prolog}IdCount: {id_num}. Merging request_id: {request_id} ")
-        merged_logs[request_id] = get_request_record(request_id, request_log_records, response_log_records,
-                                                     bes_log_records)
+    written = set()
+    builder = column_builder(columns_format)
+    with stage("join") as joining, open(out_file, 'w') as fio, JsonObjectWriter(fio, indent=2) as writer:
+        joining.records_in = len(request_ids)
+        for request_id in request_ids:
+            if request_id in written:
+                continue
+            written.add(request_id)
+            id_num += 1
+            loggy(f"{prolog}IdCount: {id_num}. Merging request_id: {request_id} ")
+            matches = [index.get(request_id, []) for index in indexes]
+            record = merge_lifecycle_record(request_id, sources, matches)
+            if spans:
+                add_spans(record, bes_log_prefix)
+            offset, length = writer.write(request_id, record)
+            if builder is not None:
+                builder.add(record, offset, length)
+        joining.records_out = id_num
+    save_columns(builder, out_file, columns_format)
+    orphans = {source.name: {key: records for key, records in index.items() if key not in written}
+               for source, index in zip(sources[1:], indexes[1:])}
+    return orphans, written
+
+
+def run_deduplicator(dedup):
+    """
+    The Deduplicator for a merge: the one given, a new one if dedup is True, or None.
+    """
+    if isinstance(dedup, Deduplicator):
+        return dedup
+    return Deduplicator() if dedup else None
 
-    # Write the results to the file
-    with open(out_file, 'w') as fio:
-        json.dump(merged_logs, fio, indent=2)
+
+def iter_records(source_file: str, deduplicator: Deduplicator = None, content: bool = True):
+    """
+    Yields the records in source_file one at a time: a JSON list, raw json records or a raw bes.log.
+    Args:
+        source_file: The file of records.
+        deduplicator: Drop the records it has already seen (see event_dedup.py). The lines of a raw
+            bes.log have no event id and identical lines are real, so they are not deduplicated.
+        content: Also drop records without an event id that are the same as one seen before. Use False
+            for logs, like the BES log, where identical records can be real.
+
+    Returns: A generator of records
+    """
+    if is_raw_bes_log(source_file):
+        return read_bes_log_records(source_file, bes_log_prefix)
+    records = iter_json_records(source_file)
+    return dedup_records(records, source_file, deduplicator, content) if deduplicator is not None else records
+
+
+def dedup_records(records, source_file: str, deduplicator: Deduplicator, content: bool = True):
+    # Count this file's duplicates here; the deduplicator may be shared with streams read at the same time
+    seen = duplicates = 0
+    for record in records:
+        seen += 1
+        if deduplicator.is_duplicate(record, content):
+            duplicates += 1
+        else:
+            yield record
+    if duplicates:
+        stderr(f"Dropped {duplicates} duplicate records (of {seen}) from '{source_file}'")
+
+
+def get_merged_sort_merge(sources: list,
+                          out_file: str,
+                          window: float,
+                          columns_format: str = None,
+                          spans: bool = False,
+                          dedup=False):
+    """
+    Merge the request life cycle data from the logs, like get_merged_sources(), by streaming the logs in time order.
+    Only the records within 'window' seconds of the newest record are held in memory, so a week of logs can be
+    merged with a small working set. The records for a request in each log must be within 'window' seconds of its
+    request log record. A request that is in the request log more than once is written once, with all its
+    records. When the logs are in time order the output is the same as get_merged_sources().
+    Args:
+        sources: A list of LogSource; the first is the request log.
+        out_file: Filename where the JSON should be written.
+        window: The lateness window in seconds.
+        columns_format: Also write a columnar sidecar ('npz' or 'parquet'); see get_merged_sources().
+        spans: Add 'spans' to each record; see get_merged_sources().
+        dedup: Drop the records that are in the sources more than once; see get_merged_sources().
+
+    Returns: nothing
+    """
+    prolog = "get_merged_sort_merge() - "
+    deduplicator = run_deduplicator(dedup)
+    streams = [(iter_records(source.file, deduplicator, not source.many),
+                lambda record, key=source.key: record.get(key, ""),
+                source.time_key) for source in sources]
+
+    id_num = 0
+    written = set()
+    builder = column_builder(columns_format)
+    with stage("join") as joining, open(out_file, 'w') as fio, JsonObjectWriter(fio, indent=2) as writer:
+        for request_log, matches in sort_merge_join(streams, window):
+            request_id = request_log[sources[0].key]
+            # A repeated request log record yields the same matches again; keep the first
+            if request_id in written:
+                continue
+            written.add(request_id)
+            id_num += 1
+            loggy(f"{prolog}IdCount: {id_num}. Merged request_id: {request_id} ")
+            record = merge_lifecycle_record(request_id, sources, matches)
+            if spans:
+                add_spans(record, bes_log_prefix)
+            offset, length = writer.write(request_id, record)
+            if builder is not None:
+                builder.add(record, offset, length)
+        joining.records_out = id_num
+    save_columns(builder, out_file, columns_format)
 
 
 # ngap-logs.py -i request_id -r response_log.json -q request_log.json -b bes_log.json -o output_file
 def main():
-    global verbose
     global bes_log_prefix
     global bes_log_type_key
     global bes_log_request_id_key
@@ -405,7 +613,7 @@ def main():
 
     default = "bes_log.json"
     parser.add_argument("-b", "--bes_log",
-                        help=f"The BES application log converted to JSON by beslog2json.py. default: {default}",
+                        help=f"The BES application log, either JSON or a raw bes.log. default: {default}",
                         default="bes_log.json")
 
     default = "hyrax-"
@@ -418,15 +626,54 @@ def main():
                         help=f"Type of operation: R for find request record by request id, M for merge all records by request id. default: {default}",
                         default="M")
 
+    parser.add_argument("-s", "--sort-merge",
+                        help="Merge by streaming the logs in time order, holding only the records within --window "
+                             "seconds in memory. The request log needs times; see download_logs.py -t.",
+                        action="store_true")
+
+    default = 300
+    parser.add_argument("-w", "--window",
+                        help=f"The lateness window in seconds for --sort-merge. default: {default}",
+                        type=float, default=default)
+
+    default = "cloudwatch_timestamp,time_completed,time"
+    parser.add_argument("--time_keys",
+                        help=f"The time keys for the request, response and BES logs for --sort-merge (the BES key "
+                             f"gets the BES prefix). default: {default}",
+                        default=default)
+
+    parser.add_argument("-S", "--source", nargs="+", action="append", default=[],
+                        metavar="NAME FILE [KEY [one|many [TIME_KEY]]]",
+                        help="Another log to merge by request id, e.g., '-S edl edl_log.json request_id many'. "
+                             "With 'many' its records are listed under NAME; with 'one' (the default) its fields "
+                             "are merged into the lifecycle record (or, if it has none, ERROR_NAME is set). KEY defaults "
+                             "to request_id. Can be repeated.")
+
+    parser.add_argument("-c", "--columns", choices=("npz", "parquet"), default=None,
+                        help="Also write a columnar sidecar (<output>.npz or <output>.parquet) of the scalar fields "
+                             "of each record, for combined_report.py, combined_query.py and the analysis tools.")
+
+    parser.add_argument("-P", "--spans",
+                        help="Add the span tree, critical path and stage times of the BES 'Profile timing' records "
+                             "to each record as 'spans'; see service_chain_spans.py.",
+                        action="store_true")
+
+    parser.add_argument("-D", "--dedup",
+                        help="Drop the records that are in the logs more than once (overlapping or retried "
+                             "downloads), by their CloudWatch eventId (see download_logs.py -i) or, without one, "
+                             "their content. BES records without an eventId and the lines of a raw bes.log are "
+                             "kept, since identical BES records can be real.",
+                        action="store_true")
+
     default = "hyrax_combined_logs.json"
     parser.add_argument("-o", "--output",
                         help=f"Output file name. default: {default}",
                         default="hyrax_combined_logs.json")
 
     args = parser.parse_args()
-    verbose = args.verbose
+    common.verbose = args.verbose
 
-    loggy(f"verbose: {verbose}")
+    loggy(f"verbose: {common.verbose}")
     loggy(f"args: {args}")
     if len(args.bes_prefix) != 0:
         bes_log_type_key = args.bes_prefix + bes_log_type_key
@@ -440,7 +687,21 @@ def main():
         get_request(args.request_id, args.request_log, args.response_log, args.bes_log, args.output)
         stderr(f"Request records extracted and saved to {args.output}")
     elif args.type == "M":
-        get_merged(args.request_log, args.response_log, args.bes_log, args.output)
+        request_time_key, response_time_key, bes_time_key = args.time_keys.split(",")
+        sources = default_sources(args.request_log, args.response_log, args.bes_log,
+                                  (request_time_key, response_time_key, bes_log_prefix + bes_time_key))
+        for source in args.source:
+            if len(source) < 2 or len(source) > 5 or (len(source) > 3 and source[3] not in ("one", "many")):
+                parser.error(f"--source needs NAME FILE [KEY [one|many [TIME_KEY]]], not: {' '.join(source)}")
+            sources.append(LogSource(source[0], source[1],
+                                     source[2] if len(source) > 2 else request_id_key,
+                                     len(source) > 3 and source[3] == "many",
+                                     source[4] if len(source) > 4 else "cloudwatch_timestamp"))
+
+        if args.sort_merge:
+            get_merged_sort_merge(sources, args.output, args.window, args.columns, args.spans, args.dedup)
+        else:
+            get_merged_sources(sources, args.output, args.columns, args.spans, args.dedup)
         stderr(f"Merged data extracted and saved to {args.output}")
 
 
@@ -2,39 +2,77 @@
 #
 # reorder-records.py: Reorder fields in JSON records
 
-import json
 import argparse
+import re
 
-def reorder_json_fields(input_file, output_file):
-    # Specify the fields to reorder
-    priority_fields = ["hyrax-time", "hyrax-instance-id", "hyrax-pid", "hyrax-type"]
+from json_stream import iter_json_records, iter_json_object_items, JsonArrayWriter, JsonObjectWriter
+from loganalysis.stats import stage
 
-    # Load the JSON log file
-    with open(input_file, 'r') as file:
-        records = json.load(file)
+# The fields listed first, by default
+default_priority_fields = ["hyrax-time", "hyrax-instance-id", "hyrax-pid", "hyrax-type"]
 
-    # Reorder fields in each record
-    reordered_records = []
-    for record in records:
-        reordered_record = {field: record[field] for field in priority_fields if field in record}
-        reordered_record.update({k: v for k, v in record.items() if k not in priority_fields})
-        reordered_records.append(reordered_record)
+# A combined log from ngap-logs.py is an object whose first member is a record: {"<request id>": {...
+combined_log_start = re.compile(r'\s*\{\s*"(?:[^"\\]|\\.)*"\s*:\s*\{')
+
+
+def reorder_record(record, priority_fields):
+    """
+    Return a copy of record with the priority_fields first, followed by all the others.
+    """
+    reordered_record = {field: record[field] for field in priority_fields if field in record}
+    reordered_record.update({k: v for k, v in record.items() if k not in priority_fields})
+    return reordered_record
+
+
+def reorder_lifecycle_record(record, priority_fields):
+    """
+    Return a copy of a combined log record with the records in its lists (e.g., 'bes') reordered.
+    """
+    return {key: [reorder_record(entry, priority_fields) if isinstance(entry, dict) else entry for entry in value]
+            if isinstance(value, list) else value
+            for key, value in reorder_record(record, priority_fields).items()}
+
+
+def is_combined_log(input_file):
+    with open(input_file, 'r', encoding="utf-8") as file:
+        return combined_log_start.match(file.read(65536)) is not None
+
+
+def reorder_json_fields(input_file, output_file, priority_fields=None):
+    # Specify the fields to reorder; an empty list means none
+    if priority_fields is None:
+        priority_fields = default_priority_fields
+
+    # Read the JSON log file a record at a time and write each reordered record as soon as it
+    # is read, so memory use does not depend on the size of the file. The output is the same
+    # as json.dump() of the whole list (or, for a combined log, object) with indent=4.
+    with stage("reorder") as reordering:
+        if is_combined_log(input_file):
+            with open(input_file, 'r', encoding="utf-8", newline="") as source, open(output_file, 'w') as file, \
+                    JsonObjectWriter(file, indent=4) as writer:
+                for key, record in iter_json_object_items(source):
+                    writer.write(key, reorder_lifecycle_record(record, priority_fields))
+        else:
+            with open(output_file, 'w') as file, JsonArrayWriter(file, indent=4) as writer:
+                for record in iter_json_records(input_file):
+                    writer.write(reorder_record(record, priority_fields))
+        reordering.records_in = reordering.records_out = writer.count
 
-    # Write the reordered JSON records back to a file
-    with open(output_file, 'w') as file:
-        json.dump(reordered_records, file, indent=4)
 
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Reorder JSON log fields.")
     parser.add_argument("-i", "--input", required=True, help="Input JSON file")
     parser.add_argument("-o", "--output", default="reordered_logs.json", help="Output JSON file (default: reordered_logs.json)")
+    parser.add_argument("-f", "--fields", default=",".join(default_priority_fields),
+                        help=f"Comma separated fields to list first; '' for none "
+                             f"(default: {','.join(default_priority_fields)})")
 
     # Parse arguments
     args = parser.parse_args()
 
     # Reorder the JSON fields
-    reorder_json_fields(args.input, args.output)
+    reorder_json_fields(args.input, args.output, [field for field in args.fields.split(",") if field])
     print(f"Reordered logs saved to {args.output}")
 
 if __name__ == "__main__":
@@ -2,31 +2,42 @@
 
 import re
 import csv
+import glob
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
+from latency_histogram import LatencyHistogram
+from loganalysis.stats import stage
 
-# Define a function to process the lines
-def process_file(input_file, output_file):
+# Compile these once; they are matched against every line of every timing file.
+time_pattern = re.compile(r"Time to gather (\d+) responses: ([\d.]+) ms")
+error_pattern = re.compile(r"Error: (\d+); .+")
+
+summary_percentiles = (50, 90, 99)
+
+csv_header = ["Number of Responses", "Time (ms)", "HTTP Status Code"]
+
+
+def iter_timing_rows(input_file):
     """
-    After running a group of tests using hy500.py, process the 'combined timing' file. Build this
-    file using cat like cat sit-efs-urls-*_timing.txt > sit-efs-urls-combined_timing.txt
-    :param input_file: The combined timing file
-    :param output_file: A csv file with timing information and some limited error information
-    :return: Nothing
+    Read one timing file made by hy500.py and yield a row for each response time.
+    :param input_file: A timing file (or several cat'ed together)
+    :return: A generator of [number of responses, time (ms), HTTP status code] rows
     """
-    data = []
     pending_time = None
 
     with open(input_file, 'r') as file:
         for line in file:
             line = line.strip()
-            
+
             # Match lines with response times
-            match_time = re.match(r"Time to gather (\d+) responses: ([\d.]+) ms", line)
+            match_time = time_pattern.match(line)
             if match_time:
                 if pending_time:
                     # If there is a pending time, add it with status code 200
-                    data.append([pending_time["responses"], pending_time["time"], 200])
-                    pending_time = None
+                    yield [pending_time["responses"], pending_time["time"], 200]
 
                 responses = int(match_time.group(1))
                 time = float(match_time.group(2))
@@ -34,43 +45,176 @@ def process_file(input_file, output_file):
                 continue
 
             # Match lines with errors
-            match_error = re.match(r"Error: (\d+); .+", line)
+            match_error = error_pattern.match(line)
             if match_error:
                 status_code = int(match_error.group(1))
                 if pending_time:
                     # Add the pending time with the error code
-                    data.append([pending_time["responses"], pending_time["time"], status_code])
+                    yield [pending_time["responses"], pending_time["time"], status_code]
                     pending_time = None
 
     # If there's any remaining pending time, add it as successful
     if pending_time:
-        data.append([pending_time["responses"], pending_time["time"], 200])
+        yield [pending_time["responses"], pending_time["time"], 200]
+
+
+# Define a function to process the lines
+def process_file(input_file, output_file):
+    """
+    After running a group of tests using hy500.py, process the timing files. This used to need
+    a 'combined timing' file built using cat like cat sit-efs-urls-*_timing.txt > sit-efs-urls-combined_timing.txt
+    but now it can be given the list of files.
+    :param input_file: The combined timing file or a list of timing files
+    :param output_file: A csv file with timing information and some limited error information
+    :return: Nothing
+    """
+    input_files = [input_file] if isinstance(input_file, str) else input_file
 
-    # Write the processed data to a CSV file
+    # Write the processed data to a CSV file, a row at a time
     with open(output_file, 'w', newline='') as csvfile:
         csv_writer = csv.writer(csvfile)
         # Write the header
-        csv_writer.writerow(["Number of Responses", "Time (ms)", "HTTP Status Code"])
+        csv_writer.writerow(csv_header)
         # Write the data rows
-        csv_writer.writerows(data)
+        for timing_file in input_files:
+            csv_writer.writerows(iter_timing_rows(timing_file))
+
+
+def summarize_timing_file(input_file, csv_file=None, summarize=True):
+    """
+    Build streaming latency histograms for one timing file without keeping the rows and, with
+    csv_file, write its rows (without the header) there in the same pass.
+    :param input_file: A timing file
+    :param csv_file: Where to write the file's csv rows, or None
+    :param summarize: Build the histograms (False when only the csv is wanted)
+    :return: A dict of HTTP status code -> LatencyHistogram of the times (ms)
+    """
+    histograms = {}
+    out = open(csv_file, 'w', newline='') if csv_file else None
+    try:
+        writer = csv.writer(out) if out else None
+        for row in iter_timing_rows(input_file):
+            if writer is not None:
+                writer.writerow(row)
+            if summarize:
+                _, time, status_code = row
+                if status_code not in histograms:
+                    histograms[status_code] = LatencyHistogram()
+                histograms[status_code].record(time)
+    finally:
+        if out:
+            out.close()
+    return histograms
+
+
+def summarize_timing_files(input_files, jobs=None, output_file=None, summarize=True):
+    """
+    Summarize many timing files in parallel, one file per worker process. With output_file, the
+    workers also write the csv rows of their files, which are then joined, in the order of the
+    files, into output_file (the same csv as process_file()), so each file is read only once.
+    :param input_files: The timing files
+    :param jobs: The number of worker processes; None means one per CPU
+    :param output_file: The csv file to write, or None
+    :param summarize: Build the histograms (False when only the csv is wanted)
+    :return: A tuple of (dict of file -> the summarize_timing_file() result, the aggregate
+    of all the files in the same form)
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file)) if output_file else None) \
+            as part_dir:
+        parts = [os.path.join(part_dir, f"{n}.csv") if output_file else None for n in range(len(input_files))]
+        if len(input_files) > 1 and jobs != 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = executor.map(summarize_timing_file, input_files, parts, [summarize] * len(input_files))
+                per_file = dict(zip(input_files, results))
+        else:
+            per_file = {timing_file: summarize_timing_file(timing_file, part, summarize)
+                        for timing_file, part in zip(input_files, parts)}
+
+        if output_file:
+            with open(output_file, 'w', newline='') as csvfile:
+                csv.writer(csvfile).writerow(csv_header)
+                for part in parts:
+                    with open(part, 'r', newline='') as f:
+                        shutil.copyfileobj(f, csvfile)
+
+    aggregate = {}
+    for histograms in per_file.values():
+        for status_code, histogram in histograms.items():
+            if status_code not in aggregate:
+                aggregate[status_code] = LatencyHistogram(histogram.relative_accuracy)
+            aggregate[status_code].merge(histogram)
+
+    return per_file, aggregate
+
+
+def summary_rows(name, histograms):
+    """
+    Rows of [name, status, count, p50, p90, p99, max] for each status code and for all of them.
+    """
+    rows = []
+    total = None
+    for status_code in sorted(histograms):
+        histogram = histograms[status_code]
+        summary = histogram.summary(summary_percentiles)
+        rows.append([name, status_code] + list(summary.values()))
+        total = LatencyHistogram(histogram.relative_accuracy) if total is None else total
+        total.merge(histogram)
+    if total is not None:
+        rows.append([name, "all"] + list(total.summary(summary_percentiles).values()))
+    return rows
+
+
+def print_summary(per_file, aggregate):
+    """
+    Print the latency summaries for each file and then the aggregate.
+    """
+    header = ["File", "Status", "Count"] + [f"p{p}" for p in summary_percentiles] + ["max (ms)"]
+    rows = []
+    for timing_file, histograms in per_file.items():
+        rows.extend(summary_rows(timing_file, histograms))
+    if len(per_file) > 1:
+        rows.extend(summary_rows("ALL FILES", aggregate))
+
+    print(",".join(header))
+    for row in rows:
+        print(",".join(f"{value:.1f}" if isinstance(value, float) else str(value) for value in row))
 
 
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="After running a group of tests using hy500.py, process the "
-                                                 "'combined timing' file. Build this file using 'cat' like "
-                                                 "cat sit-efs-urls-*_timing.txt > sit-efs-urls-combined_timing.txt.")
+                                                 "timing files. Give the files (or globs like "
+                                                 "'sit-efs-urls-*_timing.txt') and this builds a csv file that's "
+                                                 "easy to graph and, with -s, prints latency percentiles for each "
+                                                 "file and all of them by HTTP status code.")
     parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
-    parser.add_argument("-i", "--input", help=".", required=True)
-    parser.add_argument("-o", "--output", help=".", default="output.csv")
+    parser.add_argument("-i", "--input", help="Timing files or globs.", nargs="+", required=True)
+    parser.add_argument("-o", "--output", help="The csv file. default: output.csv", default="output.csv")
+    parser.add_argument("-s", "--summary", help="Print p50/p90/p99/max latency by status code.",
+                        action="store_true")
+    parser.add_argument("-n", "--no-csv", help="Do not write the csv file (use with -s).", action="store_true")
+    parser.add_argument("-j", "--jobs", help="Worker processes. default: one per CPU", type=int,
+                        default=None)
 
     args = parser.parse_args()
 
-    process_file(args.input, args.output)
+    input_files = []
+    for pattern in args.input:
+        input_files.extend(sorted(glob.glob(pattern)) or [pattern])
 
-    print(f"Data extracted and saved to {args.output}")
+    if args.no_csv and not args.summary:
+        return
+    # One pass over each file, in parallel, writes its csv rows and builds its histograms
+    output_file = None if args.no_csv else args.output
+    with stage("timing") as summarizing:
+        summarizing.records_in = len(input_files)
+        per_file, aggregate = summarize_timing_files(input_files, args.jobs, output_file, args.summary)
+        summarizing.records_out = sum(histogram.count for histogram in aggregate.values())
+    if output_file:
+        print(f"Data extracted and saved to {output_file}")
+    if args.summary:
+        print_summary(per_file, aggregate)
 
 
 if __name__ == "__main__":
     main()
-
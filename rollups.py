@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import csv
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+
+from combined_columns import load_combined_columns, numeric_column, StringColumn
+from loganalysis import common
+from loganalysis.common import loggy, no_provider, provider_of, bucket_seconds
+from loganalysis.stats import stage
+
+"""
+Roll the combined log from ngap-logs.py up into per-minute (or per-hour, ...) tables of
+requests, HTTP status classes and output bytes for each provider, e.g., the 5xx counts over
+time by provider that the ngap-06.11.25 write-up put together by hand. The records are
+loaded as columns (from the columnar sidecar if there is a current one; see combined_columns.py)
+and all the counting is done with numpy bincount, so a day of records takes seconds.
+
+The provider comes from the collectionId, e.g., POCLOUD in
+/hyrax/ngap/collections/C1234-POCLOUD/granules/... Records without one are under '-'.
+"""
+
+status_classes = ("1xx", "2xx", "3xx", "4xx", "5xx", "other")
+
+# The columns a rollup needs
+rollup_fields = ["epoch_time", "http_response_code", "collectionId", "output_size"]
+
+
+def provider_codes(column, count: int):
+    """
+    Parse the provider of each distinct collectionId once.
+    Returns: A tuple of (the sorted provider names, an int array of each record's index in them)
+    """
+    if not isinstance(column, StringColumn):
+        return [no_provider], np.zeros(count, dtype=np.int64)
+    names = [provider_of(value) for value in column.values] + [no_provider]   # code -1 picks no_provider
+    providers, inverse = np.unique(np.array(names, dtype=object), return_inverse=True)
+    return list(providers), inverse.astype(np.int64)[column.codes]
+
+
+def rollup(columns: dict, width: int) -> dict:
+    """
+    Count the records in each (time bucket, provider).
+    Args:
+        columns: The rollup_fields columns of a combined log (see load_combined_columns())
+        width: The bucket width in seconds
+
+    Returns: A dict with 'buckets' (the start of each non-empty bucket, in seconds since the epoch),
+    'providers' (their names) and, for 'requests', each of status_classes and 'output_bytes', an
+    array of shape (buckets, providers). 'untimed' is the number of records without a time.
+    """
+    count = len(next(iter(columns.values()))) if columns else 0
+    times = numeric_column(columns.get("epoch_time"), count, fill=np.nan)
+    timed = ~np.isnan(times)
+
+    providers, provider = provider_codes(columns.get("collectionId"), count)
+    codes = numeric_column(columns.get("http_response_code"), count, fill=0, dtype=np.int64)
+    # 1xx..5xx are 0..4; anything else (including missing codes) is 'other'
+    status_class = codes // 100 - 1
+    status_class[(codes < 100) | (codes >= 600)] = len(status_classes) - 1
+    output_bytes = np.clip(numeric_column(columns.get("output_size"), count, fill=0), 0, None)  # -1 is unknown
+
+    bucket_numbers = np.floor(times[timed] / width).astype(np.int64)
+    buckets, bucket = np.unique(bucket_numbers, return_inverse=True)
+    shape = (len(buckets), len(providers))
+    group = bucket.reshape(-1) * len(providers) + provider[timed]
+    size = shape[0] * shape[1]
+
+    result = {"buckets": buckets * width, "providers": providers, "untimed": int(count - timed.sum()),
+              "requests": np.bincount(group, minlength=size).reshape(shape),
+              "output_bytes": np.bincount(group, weights=output_bytes[timed], minlength=size).reshape(shape)}
+    classes = np.bincount(group * len(status_classes) + status_class[timed],
+                          minlength=size * len(status_classes)).reshape(shape + (len(status_classes),))
+    for i, name in enumerate(status_classes):
+        result[name] = classes[:, :, i]
+    loggy(f"Rolled up {count} records into {shape[0]} buckets for {shape[1]} providers")
+    return result
+
+
+def rollup_rows(result: dict, totals: bool = False):
+    """
+    Yield a row for each non-empty (bucket, provider): time, provider, requests, the status
+    classes and output bytes. With totals, also a row for ALL providers in each bucket.
+    """
+    metrics = ["requests"] + list(status_classes) + ["output_bytes"]
+    for b, start in enumerate(result["buckets"].tolist()):
+        time = datetime.fromtimestamp(start, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        for p, provider in enumerate(result["providers"]):
+            if result["requests"][b, p]:
+                yield [time, provider] + [int(result[metric][b, p]) for metric in metrics]
+        if totals:
+            yield [time, "ALL"] + [int(result[metric][b].sum()) for metric in metrics]
+
+
+def rollup_header():
+    return ["time", "provider", "requests"] + list(status_classes) + ["output_bytes"]
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Per-minute or per-hour tables of requests, status classes "
+                                                 "(2xx, 4xx, 5xx, ...) and output bytes for each provider from "
+                                                 "the combined log from ngap-logs.py.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", help="The combined log. default: hyrax_combined_logs.json",
+                        default="hyrax_combined_logs.json")
+    parser.add_argument("-b", "--bucket", help="The bucket size: minute, hour, day or seconds. default: minute",
+                        default="minute")
+    parser.add_argument("-t", "--totals", help="Add a row for ALL providers in each bucket.", action="store_true")
+    parser.add_argument("-o", "--output", help="Write the csv to this file instead of stdout.", default=None)
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    try:
+        width = bucket_seconds(args.bucket)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with stage("load") as loading:
+        columns = load_combined_columns(args.input, rollup_fields)
+        loading.records_out = len(next(iter(columns.values()))) if columns else 0
+    with stage("rollup") as rolling:
+        rolling.records_in = loading.records_out
+        result = rollup(columns, width)
+        rolling.records_out = len(result["buckets"])
+    if result["untimed"]:
+        print(f"# {result['untimed']} records without a time were left out", file=sys.stderr)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        with stage("write") as writing:
+            writer = csv.writer(out)
+            writer.writerow(rollup_header())
+            writing.records_out = 0
+            for row in rollup_rows(result, args.totals):
+                writer.writerow(row)
+                writing.records_out += 1
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
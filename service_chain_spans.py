@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+import sys
+
+from json_stream import iter_combined_records
+from loganalysis import common
+from loganalysis.common import loggy
+# 'stage' is a profiled BES stage here; this records a stage of the run for --stats
+from loganalysis.stats import stage as record_stage
+
+"""
+Turn the BES 'Profile timing' records of a request (the CMR lookup, the DMR++ fetch, the TEA
+redirect, the SuperChunk reads, ...) into a tree of spans, so the slow stage of every request
+can be found without untangling the flat 'bes' list of the combined log by hand or with the
+Julia tools in hyrax_service_chain_profiling.
+
+Each profile record has a start (hyrax-start-us) and an elapsed time (hyrax-elapsed-us). The
+spans are sorted by start (longest first) and nested with a stack: a span is a child of the
+innermost open span that contains it. For each span the self time is its elapsed time less the
+union of its children's intervals (children can overlap, e.g., parallel SuperChunk reads). The
+critical path is found by walking back from the end of each span through the child that
+finished last before the current point, so the critical times along it add up to the time
+from the first span's start to the last span's end.
+
+ngap-logs.py -P adds these as 'spans' to each lifecycle record while it merges. This script
+reports them: the stages of one request (-r) or, for all the requests, the count, total
+elapsed, self and critical path time of each stage.
+"""
+
+profile_timer_prefix = "Profile timing"
+
+
+def _microseconds(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class Span:
+    """
+    One profiled stage of a request: an interval in microseconds and the spans nested in it.
+    """
+
+    def __init__(self, name: str, details: str, start: int, elapsed: int):
+        self.name = name
+        self.details = details
+        self.start = start
+        self.end = start + elapsed
+        self.children = []
+        self.self_time = elapsed
+
+    @property
+    def elapsed(self) -> int:
+        return self.end - self.start
+
+    def to_dict(self) -> dict:
+        span = {"name": self.name, "start_us": self.start, "elapsed_us": self.elapsed, "self_us": self.self_time}
+        if self.details:
+            span["details"] = self.details
+        if self.children:
+            span["children"] = [child.to_dict() for child in self.children]
+        return span
+
+
+def profile_span(bes_record: dict, prefix: str = "hyrax-"):
+    """
+    The Span for a BES 'Profile timing' record, or None if it is not one (or has no start or elapsed time).
+    The timer name 'Profile timing: <stage> - <details>' gives the name and details.
+    """
+    if not isinstance(bes_record, dict) or bes_record.get(prefix + "type") != "timing":
+        return None
+    timer_name = bes_record.get(prefix + "timer-name")
+    if not isinstance(timer_name, str) or not timer_name.startswith(profile_timer_prefix):
+        return None
+    start = _microseconds(bes_record.get(prefix + "start-us"))
+    elapsed = _microseconds(bes_record.get(prefix + "elapsed-us"))
+    if start is None or elapsed is None or elapsed < 0:
+        return None
+    name = timer_name[len(profile_timer_prefix):].lstrip(":").strip()
+    name, _, details = name.partition(" - ")
+    return Span(name, details, start, elapsed)
+
+
+def nest_spans(spans: list) -> list:
+    """
+    Nest spans by containment and set their self times.
+    Returns: The root spans, in start order
+    """
+    roots = []
+    stack = []
+    for span in sorted(spans, key=lambda span: (span.start, -span.end)):
+        while stack and span.end > stack[-1].end:
+            stack.pop()
+        (stack[-1].children if stack else roots).append(span)
+        stack.append(span)
+
+    for span in spans:
+        covered = 0
+        cover_start = cover_end = None
+        for child in span.children:    # in start order
+            if cover_end is None or child.start > cover_end:
+                if cover_end is not None:
+                    covered += cover_end - cover_start
+                cover_start, cover_end = child.start, child.end
+            else:
+                cover_end = max(cover_end, child.end)
+        if cover_end is not None:
+            covered += cover_end - cover_start
+        span.self_time = span.elapsed - covered
+    return roots
+
+
+def _critical_path(start: int, end: int, children: list, span, path: list):
+    """
+    Add the critical path through the time from start to end (the part of span, or of the
+    request if span is None, that ends the request) to path.
+    """
+    cursor = end
+    segments = []
+    own = 0
+    while True:
+        candidates = [child for child in children if child.start < cursor]
+        if not candidates:
+            break
+        child = max(candidates, key=lambda child: min(child.end, cursor))
+        child_end = min(child.end, cursor)
+        own += cursor - child_end
+        segments.append((child, child_end))
+        cursor = child.start
+    own += max(cursor - start, 0)
+    if span is not None:
+        path.append({"name": span.name, "start_us": span.start, "critical_us": own})
+    for child, child_end in reversed(segments):
+        _critical_path(child.start, child_end, child.children, child, path)
+
+
+def request_spans(bes_records, prefix: str = "hyrax-"):
+    """
+    The span tree, critical path and per-stage times of one request from its BES records.
+    Returns: None if there are no profile records; otherwise a dict with the request's 'start_us'
+    and 'elapsed_us' (first span start to last span end), the 'tree' of spans, the 'critical_path'
+    (the spans on it in time order, each with its 'critical_us') and 'stages', the 'count',
+    'elapsed_us', 'self_us' and 'critical_us' of each stage name.
+    """
+    spans = [span for span in map(lambda record: profile_span(record, prefix), bes_records or ())
+             if span is not None]
+    if not spans:
+        return None
+    roots = nest_spans(spans)
+    start = min(span.start for span in spans)
+    end = max(span.end for span in spans)
+    path = []
+    _critical_path(start, end, roots, None, path)
+
+    stages = {}
+    for span in spans:
+        stage = stages.setdefault(span.name, {"count": 0, "elapsed_us": 0, "self_us": 0, "critical_us": 0})
+        stage["count"] += 1
+        stage["elapsed_us"] += span.elapsed
+        stage["self_us"] += span.self_time
+    for step in path:
+        stages[step["name"]]["critical_us"] += step["critical_us"]
+    return {"start_us": start, "elapsed_us": end - start, "tree": [root.to_dict() for root in roots],
+            "critical_path": path, "stages": stages}
+
+
+def add_spans(record: dict, prefix: str = "hyrax-", bes_key: str = "bes"):
+    """
+    Add 'spans' (see request_spans()) to a lifecycle record that has profile records in its BES list.
+    """
+    spans = request_spans(record.get(bes_key), prefix)
+    if spans is not None:
+        record["spans"] = spans
+    return record
+
+
+def stage_totals(combined_log_file: str, prefix: str = "hyrax-") -> dict:
+    """
+    The stage times summed over all the requests in a combined log. Records that already have
+    'spans' (ngap-logs.py -P) are not worked out again.
+    Returns: A dict of stage name -> {'requests', 'count', 'elapsed_us', 'self_us', 'critical_us'}
+    """
+    totals = {}
+    requests = 0
+    for record in iter_combined_records(combined_log_file):
+        spans = record.get("spans") or request_spans(record.get("bes"), prefix)
+        if not spans:
+            continue
+        requests += 1
+        for name, stage in spans["stages"].items():
+            total = totals.setdefault(name, {"requests": 0, "count": 0, "elapsed_us": 0, "self_us": 0,
+                                             "critical_us": 0})
+            total["requests"] += 1
+            for key, value in stage.items():
+                total[key] += value
+    loggy(f"Found profile records for {requests} requests")
+    return totals
+
+
+def print_tree(spans: dict):
+    """
+    Print a request's span tree, indented, with the elapsed and self times in ms; '*' marks the
+    spans on the critical path.
+    """
+    critical = {(step["name"], step["start_us"]) for step in spans["critical_path"]}
+
+    def print_span(span: dict, depth: int):
+        mark = "*" if (span["name"], span["start_us"]) in critical else " "
+        details = f" - {span['details']}" if span.get("details") else ""
+        print(f"{mark} {span['elapsed_us'] / 1000:10.3f} {span['self_us'] / 1000:10.3f}  "
+              f"{'  ' * depth}{span['name']}{details}")
+        for child in span.get("children", []):
+            print_span(child, depth + 1)
+
+    print(f"  {'elapsed ms':>10} {'self ms':>10}")
+    for root in spans["tree"]:
+        print_span(root, 0)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="The BES 'Profile timing' records of the combined log from "
+                                                 "ngap-logs.py as span trees: the time each stage took, its self "
+                                                 "time and its time on the critical path.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", help="The combined log. default: hyrax_combined_logs.json",
+                        default="hyrax_combined_logs.json")
+    parser.add_argument("-p", "--bes_prefix", help="The prefix of the BES log keys. default: hyrax-",
+                        default="hyrax-")
+    parser.add_argument("-r", "--request_id", help="Print the span tree of this request.", default=None)
+    parser.add_argument("-j", "--json", help="With -r, print the spans as JSON.", action="store_true")
+    parser.add_argument("-o", "--output", help="Write the stage csv to this file instead of stdout.", default=None)
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    if args.request_id:
+        for record in iter_combined_records(args.input):
+            if args.request_id in (record.get("request_id"), record.get(args.bes_prefix + "request-id")):
+                spans = record.get("spans") or request_spans(record.get("bes"), args.bes_prefix)
+                break
+        else:
+            parser.error(f"Request {args.request_id} is not in {args.input}")
+        if not spans:
+            print(f"# {args.request_id} has no profile records", file=sys.stderr)
+        elif args.json:
+            print(json.dumps(spans, indent=2))
+        else:
+            print_tree(spans)
+        return
+
+    with record_stage("spans") as spanning:
+        totals = stage_totals(args.input, args.bes_prefix)
+        spanning.records_out = len(totals)
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        with record_stage("write") as writing:
+            writer = csv.writer(out)
+            writer.writerow(["stage", "requests", "count", "elapsed_ms", "self_ms", "critical_ms"])
+            for name, total in sorted(totals.items(), key=lambda item: -item[1]["critical_us"]):
+                writer.writerow([name, total["requests"], total["count"]] +
+                                [f"{total[key] / 1000:.1f}" for key in ("elapsed_us", "self_us", "critical_us")])
+            writing.records_out = len(totals)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
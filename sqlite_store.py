@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timezone
+
+from json_stream import iter_combined_records
+from join_json_arrays import record_time
+from loganalysis import common
+from loganalysis.common import loggy, stderr, provider_of, time_fields
+from loganalysis.stats import stage
+
+"""
+Load the combined logs from ngap-logs.py into a SQLite database, so the questions that now
+take a jq pass over the whole log (how many 404s for POCLOUD? which users got 401s?) are SQL
+queries that take milliseconds. Any number of logs (e.g., the hours from hourly_pipeline.py)
+can be loaded into the same database; a request that is loaded again replaces the old one.
+
+The tables:
+    requests: one row per request: request_id, time (seconds since the epoch), user_id,
+        user_ip, collection_id, provider, bes_action, bes_count, load_id and the other
+        fields of the request log as JSON (extra)
+    responses: the response log fields of each request that has one: http_response_code,
+        time_completed, total_time (ms), output_size
+    bes: the BES records of each request, in order: time, type, instance_id, pid, message
+        (or timer name), elapsed_us and the other fields as JSON (fields); the BES key
+        prefix is taken off the names
+    loads: each log loaded: the file, when, and the number of records
+with indexes on request_id, http_response_code, collection_id, user_id and time, and views
+for the logs_overview.sh and combined_analysis.sh reports: lifecycle, response_codes,
+provider_codes, unmatched_requests, requests_404 and user_ids_401. For example:
+
+    sqlite3 hyrax_logs.sqlite 'select * from provider_codes'
+
+The rows are inserted with executemany() in batches, in WAL mode.
+"""
+
+response_fields = ("http_response_code", "time_completed", "total_time", "output_size")
+request_columns = {"request_id": "request_id", "user_id": "user_id", "user_ip": "user_ip",
+                   "collectionId": "collection_id"}
+# Keys that are not request log fields: the BES records, the spans of ngap-logs.py -P, ...
+skipped_fields = ("bes", "spans")
+bes_columns = ("time", "type", "instance-id", "pid", "request-id")
+
+schema = """
+CREATE TABLE IF NOT EXISTS loads (
+    load_id INTEGER PRIMARY KEY, source TEXT, loaded_at TEXT, records INTEGER);
+CREATE TABLE IF NOT EXISTS requests (
+    request_id TEXT PRIMARY KEY, time REAL, user_id TEXT, user_ip TEXT, collection_id TEXT, provider TEXT,
+    bes_action TEXT, bes_count INTEGER, load_id INTEGER, extra TEXT);
+CREATE TABLE IF NOT EXISTS responses (
+    request_id TEXT PRIMARY KEY, http_response_code INTEGER, time_completed TEXT, total_time REAL,
+    output_size INTEGER);
+CREATE TABLE IF NOT EXISTS bes (
+    request_id TEXT, seq INTEGER, time INTEGER, type TEXT, instance_id TEXT, pid INTEGER, message TEXT,
+    elapsed_us INTEGER, fields TEXT, PRIMARY KEY (request_id, seq)) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS requests_time ON requests (time);
+CREATE INDEX IF NOT EXISTS requests_collection_id ON requests (collection_id);
+CREATE INDEX IF NOT EXISTS requests_user_id ON requests (user_id);
+CREATE INDEX IF NOT EXISTS responses_code ON responses (http_response_code);
+CREATE INDEX IF NOT EXISTS bes_time ON bes (time);
+
+CREATE VIEW IF NOT EXISTS lifecycle AS
+    SELECT r.*, s.http_response_code, s.time_completed, s.total_time, s.output_size
+    FROM requests r LEFT JOIN responses s USING (request_id);
+CREATE VIEW IF NOT EXISTS response_codes AS
+    SELECT http_response_code,
+           CASE http_response_code WHEN 200 THEN '200 OK' WHEN 400 THEN '400 User Error'
+               WHEN 401 THEN '401 Unauthorized' WHEN 404 THEN '404 Not Found'
+               WHEN 500 THEN '500 Server Error' WHEN 502 THEN '502 Bad Gateway' END AS label,
+           COUNT(*) AS records
+    FROM lifecycle GROUP BY http_response_code;
+CREATE VIEW IF NOT EXISTS provider_codes AS
+    SELECT provider, http_response_code, COUNT(*) AS records
+    FROM lifecycle GROUP BY provider, http_response_code;
+CREATE VIEW IF NOT EXISTS unmatched_requests AS
+    SELECT * FROM lifecycle WHERE bes_count = 0;
+CREATE VIEW IF NOT EXISTS requests_404 AS
+    SELECT *, CASE WHEN collection_id LIKE '/hyrax/ngap%' THEN 'ngap'
+                   WHEN collection_id LIKE '/hyrax/CMR%' THEN 'cmr'
+                   WHEN collection_id IS NULL OR collection_id = '' THEN 'none'
+                   ELSE 'other' END AS service
+    FROM lifecycle WHERE http_response_code = 404;
+CREATE VIEW IF NOT EXISTS user_ids_401 AS
+    SELECT user_id, COUNT(*) AS records, SUM(collection_id LIKE '%login%') AS login_records
+    FROM lifecycle WHERE http_response_code = 401 GROUP BY user_id;
+"""
+
+
+def connect(database: str) -> sqlite3.Connection:
+    """
+    Open (or make) the database, in WAL mode, with the tables, indexes and views.
+    """
+    connection = sqlite3.connect(database)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(schema)
+    return connection
+
+
+def _json(value):
+    return json.dumps(value, ensure_ascii=False) if value else None
+
+
+def _bes_action(bes: list, prefix: str):
+    for record in bes:
+        if isinstance(record, dict) and record.get(prefix + "type") == "request":
+            return record.get(prefix + "bes-action")
+    return None
+
+
+def _integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def record_rows(record: dict, load_id: int, prefix: str = "hyrax-"):
+    """
+    Split a lifecycle record into its rows.
+    Returns: (the requests row, the responses row or None, the list of bes rows)
+    """
+    request_id = record.get("request_id")
+    bes = record.get("bes") if isinstance(record.get("bes"), list) else []
+    time = next((seconds for seconds in (record_time(record.get(field)) for field in time_fields)
+                 if seconds is not None), None)
+    extra = {key: value for key, value in record.items()
+             if key not in request_columns and key not in response_fields and key not in skipped_fields}
+    collection = record.get("collectionId")
+    request = (request_id, time, record.get("user_id"), record.get("user_ip"), collection,
+               provider_of(collection), _bes_action(bes, prefix), len(bes), load_id, _json(extra))
+
+    response = None
+    if record.get("http_response_code") is not None:
+        response = (request_id, _integer(record.get("http_response_code")), record.get("time_completed"),
+                    record.get("total_time"), _integer(record.get("output_size")))
+
+    bes_rows = []
+    for seq, entry in enumerate(bes):
+        if not isinstance(entry, dict):
+            continue
+        fields = {key[len(prefix):] if key.startswith(prefix) else key: value for key, value in entry.items()}
+        message = fields.pop("message", None)
+        if message is None:
+            message = fields.pop("timer-name", None)
+        elapsed = _integer(fields.pop("elapsed-us", None))
+        row = [fields.pop(column, None) for column in bes_columns]
+        bes_rows.append((request_id, seq, _integer(row[0]), row[1], row[2], _integer(row[3]), message, elapsed,
+                         _json(fields)))
+    return request, response, bes_rows
+
+
+def load_combined_log(connection: sqlite3.Connection, combined_log_file: str, prefix: str = "hyrax-",
+                      batch_size: int = 5000) -> int:
+    """
+    Load a combined log into the database, batch_size records per executemany(). A request that
+    is already in the database is replaced (with its response and BES records).
+    Returns: The number of records loaded
+    """
+    replacing = connection.execute("SELECT EXISTS (SELECT 1 FROM requests)").fetchone()[0]
+    with connection:
+        load_id = connection.execute("INSERT INTO loads (source, loaded_at, records) VALUES (?, ?, 0)",
+                                     (os.path.abspath(combined_log_file),
+                                      datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))).lastrowid
+
+    def flush(requests, responses, bes):
+        with connection:
+            if replacing:
+                ids = [(row[0],) for row in requests]
+                connection.executemany("DELETE FROM responses WHERE request_id = ?", ids)
+                connection.executemany("DELETE FROM bes WHERE request_id = ?", ids)
+            connection.executemany("INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", requests)
+            connection.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", responses)
+            connection.executemany("INSERT OR REPLACE INTO bes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", bes)
+
+    count = 0
+    requests, responses, bes = [], [], []
+    with stage("write") as writing:
+        for record in iter_combined_records(combined_log_file):
+            if not isinstance(record, dict) or record.get("request_id") is None:
+                continue
+            request, response, bes_rows = record_rows(record, load_id, prefix)
+            requests.append(request)
+            if response is not None:
+                responses.append(response)
+            bes.extend(bes_rows)
+            count += 1
+            if len(requests) >= batch_size:
+                flush(requests, responses, bes)
+                requests, responses, bes = [], [], []
+        if requests:
+            flush(requests, responses, bes)
+        writing.records_in = writing.records_out = count
+
+    with connection:
+        connection.execute("UPDATE loads SET records = ? WHERE load_id = ?", (count, load_id))
+    loggy(f"Loaded {count} records from {combined_log_file}")
+    return count
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Load the combined logs from ngap-logs.py into a SQLite database "
+                                                 "(requests, responses and bes tables, and views for the "
+                                                 "logs_overview.sh reports) and, optionally, run a query on it.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-i", "--input", nargs="+", default=None,
+                        help="The combined logs to load. default: hyrax_combined_logs.json, unless there is a -q")
+    parser.add_argument("-d", "--database", help="The SQLite database. default: hyrax_logs.sqlite",
+                        default="hyrax_logs.sqlite")
+    parser.add_argument("-p", "--bes_prefix", help="The prefix of the BES log keys. default: hyrax-",
+                        default="hyrax-")
+    parser.add_argument("-b", "--batch", help="Records per batch of inserts. default: 5000", type=int, default=5000)
+    parser.add_argument("-q", "--query", help="Run this SQL on the database (after loading any -i logs) and print "
+                                              "the result as csv.", default=None)
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    inputs = args.input if args.input is not None else [] if args.query else ["hyrax_combined_logs.json"]
+    connection = connect(args.database)
+    try:
+        for combined_log_file in inputs:
+            if not os.path.exists(combined_log_file):
+                parser.error(f"No such file: {combined_log_file}")
+            count = load_combined_log(connection, combined_log_file, args.bes_prefix, args.batch)
+            stderr(f"Loaded {count} records from {combined_log_file} into {args.database}")
+        if args.query:
+            cursor = connection.execute(args.query)
+            writer = csv.writer(sys.stdout)
+            writer.writerow([column[0] for column in cursor.description or ()])
+            writer.writerows(cursor)
+    except sqlite3.Error as e:
+        parser.error(f"SQLite: {e}")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
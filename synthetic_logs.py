@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+
+import heapq
+import json
+import math
+import os
+import random
+from datetime import datetime, timezone
+
+from json_stream import JsonArrayWriter
+from log_processing import request_fields
+from loganalysis import common
+from loganalysis.common import loggy
+from loganalysis.stats import stage
+
+"""
+Make a request log, response log and BES log that look like an hour (or 100 hours) of NGAP
+Hyrax traffic, for benchmarks (benchmark.py) and for trying the tools without AWS access.
+
+The defaults come from the hour of logs in the ngap-logs.py header: 12145 requests and about
+8.6 BES records per request. The records have the same keys as the CloudWatch logs; request
+ids look like 'https-openssl-apr-8443-exec-7_37_<uuid>'; users, collections and instances
+are drawn from skewed (Zipf-like) distributions; each request is handled by one pid on one
+instance; and given fractions of the requests get 404, 401 and 5xx responses, have no BES
+records (unmatched) or have no response record. Each log is written in time order (the BES
+and response records of a request are written when they happen), so memory use does not
+grow with the scale. The output is the same for the same seed.
+"""
+
+hour_requests = 12145
+
+providers = (("POCLOUD", 45), ("NSIDC_CPRD", 25), ("GES_DISC", 12), ("LPCLOUD", 10), ("ORNL_CLOUD", 5),
+             ("ASF", 3))
+# suffix -> (bes action, return as)
+dap_suffixes = ((".dmr.html", "get.dmr", "dap"), (".dmr", "get.dmr", "dap"), (".dap", "get.dap", "dap"),
+                (".dap.nc4", "get.dap", "netcdf-4"), (".dds", "get.dds", "dap2"), (".das", "get.das", "dap2"))
+# Paths that never reach the BES: (path, status code)
+other_paths = (("/hyrax/", 200), ("/hyrax/docs/index.html", 200), ("/hyrax/CMR/", 404), ("/hyrax/login", 401),
+               ("/hyrax/version", 200), ("/favicon.ico", 404))
+user_agents = ("Wget#1#21#3 #linux-gnu#", "curl#8#4#0", "python-requests#2#31#0", "Mozilla#5#0 (Macintosh)",
+               "xarray#2024#6#0 pydap#3#5")
+server_error_messages = ((500, "ERROR: NgapApi.cc:304 The server timed out after 30 seconds"),
+                         (502, "ERROR! HttpError (CurlUtils.cc:798) The remote host returned HTTP status 503"),
+                         (500, "ERROR: BESUtil.cc:298 Could not open {path} (file not found)"),
+                         (503, "ERROR: DmrppRequestHandler.cc:412 Could not get the DMR++ for {path}"))
+
+
+def _zipf_weights(count: int, exponent: float = 1.1) -> list:
+    return [1 / (k + 1) ** exponent for k in range(count)]
+
+
+def _hex(rng: random.Random, digits: int) -> str:
+    return f"{rng.getrandbits(digits * 4):0{digits}x}"
+
+
+def _uuid(rng: random.Random) -> str:
+    text = _hex(rng, 32)
+    return f"{text[:8]}-{text[8:12]}-{text[12:16]}-{text[16:20]}-{text[20:]}"
+
+
+def _iso(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+0000")
+
+
+def bes_log_line(record: dict, prefix: str = "hyrax-") -> str:
+    """
+    A BES record as a raw bes.log line; the inverse of log_processing.log_line_to_record().
+    """
+    fields = [record[prefix + "time"], record[prefix + "instance-id"], record[prefix + "pid"], record[prefix + "type"]]
+    record_type = record[prefix + "type"]
+    if record_type == "request":
+        fields += ["OLFS"] + [record.get(prefix + key, "-") for key in request_fields]
+    elif record_type == "timing":
+        for key in ("elapsed-us", "start-us", "stop-us"):
+            if prefix + key in record:
+                fields += [key, record[prefix + key]]
+        fields += [record.get(prefix + "request-id", "-"), record[prefix + "timer-name"]]
+    else:
+        fields.append(record[prefix + "message"])
+    return "|&|".join(str(field) for field in fields) + "\n"
+
+
+class LogGenerator:
+    """
+    Makes the records of synthetic requests. requests() yields, for each request in time order,
+    the request log record, the response log record (or None) and the BES records.
+    """
+
+    def __init__(self, seed: int = 0, users: int = 800, collections: int = 300, instances: int = 6,
+                 pids: int = 24, not_found: float = 0.05, unauthorized: float = 0.01, server_errors: float = 0.02,
+                 unmatched: float = 0.06, missing_responses: float = 0.002):
+        """
+        Args:
+            seed: The random seed
+            users: The number of distinct users (each has one or two IP addresses)
+            collections: The number of distinct collections
+            instances: The number of Hyrax instances
+            pids: The number of BES processes on each instance
+            not_found: The fraction of NGAP requests that get a 404
+            unauthorized: The fraction of all requests that get a 401 (at /hyrax/login)
+            server_errors: The fraction of NGAP requests that get a 5xx (with an error in the BES log)
+            unmatched: The fraction of requests that never reach the BES
+            missing_responses: The fraction of requests without a response log record
+        """
+        self.rng = random.Random(seed)
+        rng = self.rng
+        self.users = [(f"user{_hex(rng, 4)}{i}", [f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+                                                   for _ in range(rng.choice((1, 1, 2)))]) for i in range(users)]
+        self.user_weights = list(self._cumulative(_zipf_weights(users)))
+        names = [name for name, _ in providers]
+        weights = [weight for _, weight in providers]
+        self.collections = [f"C{rng.randrange(10 ** 9, 10 ** 10)}-{rng.choices(names, weights)[0]}"
+                            for _ in range(collections)]
+        self.collection_weights = list(self._cumulative(_zipf_weights(collections, 0.9)))
+        self.instances = [f"h-{_uuid(rng)}" for _ in range(instances)]
+        self.pids = [[rng.randrange(1000, 60000) for _ in range(pids)] for _ in range(instances)]
+        self.not_found = not_found
+        self.unauthorized = unauthorized
+        self.server_errors = server_errors
+        self.unmatched = unmatched
+        self.missing_responses = missing_responses
+        self.count = 0
+
+    @staticmethod
+    def _cumulative(weights):
+        total = 0.0
+        for weight in weights:
+            total += weight
+            yield total
+
+    def _granule(self, collection: str) -> str:
+        rng = self.rng
+        day = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() + rng.randrange(365) * 86400
+        return f"{collection.split('-')[1]}_L2_{rng.randrange(100000):05d}_" \
+               f"{datetime.fromtimestamp(day, tz=timezone.utc):%Y%m%dT%H%M%S}_R{rng.randrange(19000, 20000)}_001.h5"
+
+    def requests(self, start: float, count: int):
+        """
+        Yield (request log record, response log record or None, BES records) for count requests
+        starting at 'start' (seconds since the epoch), spread evenly (with jitter) over count /
+        hour_requests hours.
+        """
+        rng = self.rng
+        spacing = 3600.0 / hour_requests
+        for i in range(count):
+            self.count += 1
+            begin = start + (i + rng.random()) * spacing
+            user, ips = rng.choices(self.users, cum_weights=self.user_weights)[0]
+            thread = rng.randrange(1, 200)
+            request_id = f"https-openssl-apr-8443-exec-{thread}_{self.count}_{_uuid(rng)}"
+
+            roll = rng.random()
+            bes_action = return_as = local_path = None
+            if roll < self.unauthorized:
+                path, code = "/hyrax/login", 401
+            elif roll < self.unauthorized + self.unmatched:
+                path, code = rng.choice(other_paths)
+            else:
+                collection = rng.choices(self.collections, cum_weights=self.collection_weights)[0]
+                suffix, bes_action, return_as = rng.choice(dap_suffixes)
+                local_path = f"collections/{collection}/granules/{self._granule(collection)}"
+                path = f"/hyrax/ngap/{local_path}{suffix}"
+                roll = rng.random()
+                code = 404 if roll < self.not_found else \
+                    rng.choice(server_error_messages)[0] if roll < self.not_found + self.server_errors else 200
+
+            # total_time (ms) is log-normal; errors take longer
+            total_time = max(1, int(rng.lognormvariate(math.log(250 if code < 500 else 4000), 1.0)))
+            output_size = rng.randrange(2000, 5_000_000) if code == 200 and bes_action else \
+                rng.randrange(200, 20000) if code == 200 else -1
+            begin_ms = int(begin * 1000)
+            end = begin + total_time / 1000
+
+            request = {"cloudwatch_timestamp": begin_ms, "request_id": request_id, "user_id": user,
+                       "user_ip": rng.choice(ips), "rangeBeginDateTime": "", "rangeEndDateTime": "",
+                       "collectionId": path,
+                       "parameters": {"service_name": "hyrax", "service_provider": "OPeNDAP",
+                                      "service_id": "hyrax_prod"},
+                       "job_ids": ["N/A"]}
+            response = None if rng.random() < self.missing_responses else \
+                {"cloudwatch_timestamp": int(end * 1000), "request_id": request_id, "http_response_code": code,
+                 "time_completed": _iso(end), "total_time": total_time, "output_size": output_size}
+            bes = [] if bes_action is None else \
+                self._bes_records(request_id, user, request["user_ip"], path, local_path, bes_action, return_as,
+                                  code, begin_ms, total_time)
+            yield request, response, bes
+
+    def _bes_records(self, request_id, user, ip, path, local_path, bes_action, return_as, code, begin_ms,
+                     total_time):
+        rng = self.rng
+        p = "hyrax-"
+        instance = rng.randrange(len(self.instances))
+        common_fields = {p + "instance-id": self.instances[instance], p + "pid": rng.choice(self.pids[instance])}
+        start_us = begin_ms * 1000 + rng.randrange(500, 3000)
+        total_us = max(total_time * 1000 - 3000, 1000)
+
+        def record(offset_us, record_type, **fields):
+            result = {p + "time": (start_us + offset_us) // 1_000_000, **common_fields, p + "type": record_type}
+            result.update((p + key.replace("_", "-"), value) for key, value in fields.items())
+            return result
+
+        def timing(name, offset_us, elapsed_us):
+            return record(offset_us + elapsed_us, "timing", elapsed_us=elapsed_us, start_us=start_us + offset_us,
+                          stop_us=start_us + offset_us + elapsed_us, request_id=request_id,
+                          timer_name=f"Profile timing: {name}")
+
+        records = [record(0, "request", client_ip=ip, user_agent=rng.choice(user_agents),
+                          session_id=_hex(rng, 32).upper(), user_id=user, olfs_start_time=begin_ms,
+                          request_id=request_id, http_verb="HTTP-GET", url_path=path, query_string="-",
+                          bes_action=bes_action, return_as=return_as, local_path=local_path, ce="-")]
+        records.append(record(100, "info", message=f"BESXMLInterface::log_the_command() - {bes_action} "
+                                                   f"{local_path} return as {return_as}"))
+        hit = rng.random() < 0.3
+        records.append(record(200, "info", message=f"NgapOwnedContainer::get_item_from_dmrpp_cache() - Memory Cache "
+                                                   f"{'hit' if hit else 'miss'}, DMR++: {local_path}"))
+        # The stages of the service chain, as fractions of the request's time
+        cmr = int(total_us * rng.uniform(0.05, 0.25))
+        records.append(timing(f"Get granule record from CMR - {local_path.split('/')[1]}", 300, cmr))
+        cursor = 300 + cmr
+        records.append(record(cursor, "info", message=f"NgapApi::find_get_data_url_in_granules_umm_json() - "
+                                                      f"Found the data URL for {local_path}"))
+        if not hit:
+            dmrpp = int(total_us * rng.uniform(0.1, 0.3))
+            tea = int(dmrpp * rng.uniform(0.2, 0.6))
+            records.append(timing("Get DMR++ from S3", cursor, dmrpp))
+            records.append(timing("Get signed url from TEA", cursor + 100, tea))
+            cursor += dmrpp
+        if code == 404:
+            records.append(record(cursor, "error", message=f"ERROR: NgapApi.cc:210 Could not find {local_path}"))
+        elif code >= 500:
+            message = next(text for status, text in server_error_messages if status == code) if rng.random() < 0.5 else \
+                rng.choice(server_error_messages)[1]
+            records.append(record(cursor, "error", message=message.format(path=local_path)))
+        elif bes_action == "get.dap":
+            remaining = max(total_us - cursor, 1000)
+            for n in range(rng.choice((1, 2, 2, 3, 4))):     # parallel reads
+                offset = cursor + rng.randrange(0, max(remaining // 10, 1))
+                records.append(timing(f"Get SuperChunk data - {n}", offset,
+                                      int((total_us - offset) * rng.uniform(0.3, 0.9))))
+        records.append(timing("Handle request", 0, total_us))
+        records.append(record(total_us, "timing", elapsed_us=total_us, start_us=start_us,
+                              request_id=request_id, timer_name=f"Command timing: {bes_action}"))
+        return records
+
+
+def generate_logs(directory: str, scale: float = 1.0, start: str = "2025-02-14T07:00:00", seed: int = 0,
+                  bes_format: str = "json", **options) -> dict:
+    """
+    Write request_log.json, response_log.json and bes_log.json (and/or bes.log) to a directory.
+    Args:
+        directory: Where to write the logs
+        scale: The amount of traffic, in hours at the rate in the ngap-logs.py header (1 = 12145 requests)
+        start: The time of the first request (ISO 8601, UTC)
+        seed: The random seed
+        bes_format: 'json', 'raw' or 'both'
+        options: Passed to LogGenerator (user and collection counts, error fractions, ...)
+
+    Returns: The number of records in each log and the names of the files
+    """
+    os.makedirs(directory, exist_ok=True)
+    begin = datetime.strptime(start, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    count = max(int(round(hour_requests * scale)), 1)
+    generator = LogGenerator(seed, **options)
+    files = {"request_log": os.path.join(directory, "request_log.json"),
+             "response_log": os.path.join(directory, "response_log.json")}
+    if bes_format in ("json", "both"):
+        files["bes_log"] = os.path.join(directory, "bes_log.json")
+    if bes_format in ("raw", "both"):
+        files["bes_raw_log"] = os.path.join(directory, "bes.log")
+    counts = dict.fromkeys(["request_log", "response_log", "bes_log"], 0)
+
+    pending_responses = []      # heaps of (time, sequence, record) not yet due
+    pending_bes = []
+    sequence = 0
+    with open(files["request_log"], 'w') as request_file, open(files["response_log"], 'w') as response_file, \
+            JsonArrayWriter(request_file) as requests, JsonArrayWriter(response_file) as responses:
+        bes_json = open(files["bes_log"], 'w') if "bes_log" in files else None
+        bes_raw = open(files["bes_raw_log"], 'w') if "bes_raw_log" in files else None
+        bes_writer = JsonArrayWriter(bes_json) if bes_json else None
+
+        def write_bes(record):
+            counts["bes_log"] += 1
+            if bes_writer is not None:
+                bes_writer.write(record)
+            if bes_raw is not None:
+                bes_raw.write(bes_log_line(record))
+
+        def flush(until_ms):
+            while pending_responses and pending_responses[0][0] <= until_ms:
+                responses.write(heapq.heappop(pending_responses)[2])
+                counts["response_log"] += 1
+            while pending_bes and pending_bes[0][0] <= until_ms:
+                write_bes(heapq.heappop(pending_bes)[2])
+
+        try:
+            for request, response, bes in generator.requests(begin, count):
+                now = request["cloudwatch_timestamp"]
+                flush(now)
+                requests.write(request)
+                counts["request_log"] += 1
+                if response is not None:
+                    sequence += 1
+                    heapq.heappush(pending_responses, (response["cloudwatch_timestamp"], sequence, response))
+                for record in bes:
+                    sequence += 1
+                    due = record.get("hyrax-stop-us", record["hyrax-time"] * 1_000_000) // 1000
+                    heapq.heappush(pending_bes, (max(due, now), sequence, record))
+            flush(math.inf)
+        finally:
+            if bes_writer is not None:
+                bes_writer.close()
+                bes_json.close()
+            if bes_raw is not None:
+                bes_raw.close()
+
+    loggy(f"Wrote {counts['request_log']} requests, {counts['response_log']} responses and "
+          f"{counts['bes_log']} BES records to {directory}")
+    return {"counts": counts, "files": files}
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Write synthetic request, response and BES logs that look like "
+                                                 "NGAP Hyrax traffic, for benchmarks and testing.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity.", action="store_true")
+    parser.add_argument("-d", "--directory", help="The output directory. default: synthetic_logs",
+                        default="synthetic_logs")
+    parser.add_argument("-s", "--scale", help=f"Hours of traffic ({hour_requests} requests each). default: 1",
+                        type=float, default=1.0)
+    parser.add_argument("--start", help="The time of the first request (UTC). default: 2025-02-14T07:00:00",
+                        default="2025-02-14T07:00:00")
+    parser.add_argument("--seed", help="The random seed. default: 0", type=int, default=0)
+    parser.add_argument("-b", "--bes-format", help="Write the BES log as JSON (bes_log.json), a raw bes.log or "
+                                                   "both. default: json", choices=("json", "raw", "both"),
+                        default="json")
+    parser.add_argument("--users", help="The number of distinct users. default: 800", type=int, default=800)
+    parser.add_argument("--collections", help="The number of distinct collections. default: 300", type=int,
+                        default=300)
+    parser.add_argument("--instances", help="The number of Hyrax instances. default: 6", type=int, default=6)
+    parser.add_argument("--not-found", help="The fraction of NGAP requests that get a 404. default: 0.05",
+                        type=float, default=0.05)
+    parser.add_argument("--server-errors", help="The fraction of NGAP requests that get a 5xx. default: 0.02",
+                        type=float, default=0.02)
+    parser.add_argument("--unmatched", help="The fraction of requests that never reach the BES. default: 0.06",
+                        type=float, default=0.06)
+
+    args = parser.parse_args()
+    common.verbose = args.verbose
+
+    with stage("generate") as generating:
+        result = generate_logs(args.directory, args.scale, args.start, args.seed, args.bes_format,
+                               users=args.users, collections=args.collections, instances=args.instances,
+                               not_found=args.not_found, server_errors=args.server_errors, unmatched=args.unmatched)
+        generating.records_out = sum(result["counts"].values())
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import unittest
+import json
+
+from anomaly_detector import AnomalyDetector, Observation, detect, observation, observations_from_pages
+
+start = 1749600000  # 2025-06-11T00:00:00Z
+
+
+def traffic(seconds, surge_from=None, surge_to=None):
+    """
+    Five requests a second, all 200s taking 100ms, except that from surge_from to surge_to
+    one of the POCLOUD requests a second, on instance h-0, fails with a 503 and take 2s.
+    """
+    for t in range(seconds):
+        for i in range(5):
+            provider = "POCLOUD" if i % 2 else "NSIDC_CPRD"
+            instance = f"h-{i % 3}"
+            if surge_from is not None and surge_from <= t < surge_to and provider == "POCLOUD" and instance == "h-0":
+                yield Observation(start + t, 503, 2000, provider, instance)
+            else:
+                yield Observation(start + t, 200, 100, provider, instance)
+
+
+class TestAnomalyDetector(unittest.TestCase):
+
+    def test_quiet(self):
+        self.assertEqual(list(detect(traffic(1200), AnomalyDetector())), [])
+
+    def test_surge(self):
+        detector = AnomalyDetector()
+        anomalies = list(detect(traffic(1200, 900, 960), detector))
+        self.assertTrue(anomalies)
+        by_metric = {}
+        for anomaly in anomalies:
+            by_metric.setdefault(anomaly["metric"], anomaly)
+        self.assertEqual(set(by_metric), {"5xx_rate", "p99_latency"})
+        first = by_metric["5xx_rate"]
+        self.assertEqual(first["start"], "2025-06-11T00:14:10Z")
+        self.assertEqual(first["top_providers"][0][0], "POCLOUD")
+        self.assertEqual(first["top_instances"], [("h-0", 10)])
+        self.assertEqual(by_metric["p99_latency"]["top_providers"], [("POCLOUD", 10)])
+        self.assertEqual(detector.records, 6000)
+
+    def test_gap(self):
+        # An hour with no records is not a problem
+        observations = list(traffic(600)) + [obs._replace(time=obs.time + 3600) for obs in traffic(600)]
+        self.assertEqual(list(detect(observations, AnomalyDetector())), [])
+
+    def test_observations(self):
+        record = {"cloudwatch_timestamp": 1749600000000, "http_response_code": 503, "total_time": 12,
+                  "collectionId": "/hyrax/ngap/collections/C1-POCLOUD/granules/g.h5",
+                  "bes": [{"hyrax-instance-id": "h-1"}]}
+        self.assertEqual(observation(record), Observation(1749600000.0, 503, 12, "POCLOUD", "h-1"))
+        self.assertIsNone(observation({"http_response_code": 200}))
+
+        pages = [[{"timestamp": 1749600001000, "logStreamName": "stream-1",
+                   "message": json.dumps({"http_response_code": 404})},
+                  {"timestamp": 1749600002000, "message": "not json"}]]
+        self.assertEqual(list(observations_from_pages(pages)),
+                         [Observation(1749600001.0, 404, None, "-", "stream-1")])
+
+    def test_bad_window(self):
+        with self.assertRaises(ValueError):
+            AnomalyDetector(window=5, step=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
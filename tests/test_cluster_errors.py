@@ -0,0 +1,75 @@
+import unittest
+import tempfile
+import os
+import json
+
+from cluster_errors import TemplateMiner, cluster_messages, tokenize_message, iter_bes_records
+
+bes_log = [
+    {"hyrax-time": 1739516400, "hyrax-instance-id": "h-1", "hyrax-pid": 10, "hyrax-type": "request",
+     "hyrax-request-id": "req-1"},
+    {"hyrax-time": 1739516401, "hyrax-instance-id": "h-1", "hyrax-pid": 10, "hyrax-type": "error",
+     "hyrax-message": "ERROR: BESUtil.cc:298 Could not open /tmp/bes/cache/a1b2c3 (file not found)"},
+    {"hyrax-time": 1739516402, "hyrax-instance-id": "h-2", "hyrax-pid": 20, "hyrax-type": "request",
+     "hyrax-request-id": "req-2"},
+    {"hyrax-time": 1739516403, "hyrax-instance-id": "h-1", "hyrax-pid": 10, "hyrax-type": "error",
+     "hyrax-message": "ERROR: BESUtil.cc:298 Could not open /tmp/bes/cache/ffee99 (file not found)"},
+    {"hyrax-time": 1739516404, "hyrax-instance-id": "h-2", "hyrax-pid": 20, "hyrax-type": "error",
+     "hyrax-message": "ERROR: NgapApi.cc:304 The server timed out after 30 seconds"},
+    {"hyrax-time": 1739516405, "hyrax-instance-id": "h-2", "hyrax-pid": 20, "hyrax-type": "error",
+     "hyrax-message": "ERROR: BESUtil.cc:298 Could not open /data/x.h5 (file not found)"},
+    {"hyrax-time": 1739516406, "hyrax-instance-id": "h-2", "hyrax-pid": 20, "hyrax-type": "info",
+     "hyrax-message": "NgapOwnedContainer::get_item() - Memory Cache miss, DMR++: collections/C1-PO/granules/g.h5"},
+    {"hyrax-time": 1739516407, "hyrax-instance-id": "h-1", "hyrax-pid": 10, "hyrax-type": "verbose",
+     "hyrax-message": "Ignored"},
+]
+
+
+class TestClusterErrors(unittest.TestCase):
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize_message("BESUtil.cc:298 open(/tmp/x) 42 times, id 4b6c1400-d790-481f-987e-202bfcd74b58"),
+                         ["BESUtil.cc:298", "<PATH>)", "<NUM>", "times,", "id", "<ID>"])
+
+    def test_cluster(self):
+        miner = TemplateMiner()
+        assigned = []
+        count = cluster_messages(bes_log, miner, assignments=lambda record, template: assigned.append(template.id))
+        self.assertEqual(count, 5)
+        self.assertEqual(assigned, [1, 1, 2, 1, 3])
+
+        besutil = miner.templates[0]
+        self.assertEqual(besutil.text, "ERROR: BESUtil.cc:298 Could not open <PATH> (file not found)")
+        self.assertEqual(besutil.count, 3)
+        self.assertEqual((besutil.first_seen, besutil.last_seen), (1739516401, 1739516405))
+        # The request ids come from the last request logged by the same instance and pid
+        self.assertEqual(besutil.examples, ["req-1", "req-2"])
+        self.assertEqual(miner.templates[1].text, "ERROR: NgapApi.cc:304 The server timed out after <NUM> seconds")
+        self.assertEqual(miner.templates[2].types, {"info": 1})
+
+    def test_variable_words_merge(self):
+        miner = TemplateMiner()
+        first = miner.add("Cache purge removed granule alpha")
+        second = miner.add("Cache purge removed granule beta")
+        self.assertIs(first, second)
+        self.assertEqual(first.text, "Cache purge removed granule <*>")
+        self.assertIsNot(miner.add("Something else entirely happened here"), first)
+
+    def test_raw_bes_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bes.log")
+            with open(path, 'w') as f:
+                f.write("1739516401|&|h-1|&|10|&|error|&|BESUtil.cc:298 Could not open /a/b\n")
+                f.write("1739516402|&|h-1|&|10|&|error|&|BESUtil.cc:298 Could not open /c/d\n")
+            miner = TemplateMiner()
+            self.assertEqual(cluster_messages(iter_bes_records(path), miner), 2)
+            self.assertEqual(len(miner.templates), 1)
+
+            path = os.path.join(directory, "errors.json")
+            with open(path, 'w') as f:
+                json.dump(bes_log, f)
+            self.assertEqual(cluster_messages(iter_bes_records(path), TemplateMiner()), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
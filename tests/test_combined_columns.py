@@ -0,0 +1,96 @@
+import unittest
+import tempfile
+import os
+import json
+import io
+
+import numpy as np
+
+from combined_columns import ColumnBuilder, StringColumn, build_sidecar, load_columns, iter_column_records, \
+    find_sidecar, sidecar_path
+from combined_query import open_index
+from combined_report import report_combined_logs
+from json_stream import JsonObjectWriter
+from tests.test_combined_report import combined_log
+
+try:
+    import pyarrow  # noqa: F401
+    have_pyarrow = True
+except ImportError:
+    have_pyarrow = False
+
+
+class TestCombinedColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.combined_file = os.path.join(self.directory.name, "hyrax_combined_logs.json")
+        with open(self.combined_file, 'w') as f:
+            json.dump(combined_log, f, indent=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check_sidecar(self, sidecar_format):
+        path = build_sidecar(self.combined_file, sidecar_format)
+        self.assertEqual(path, sidecar_path(self.combined_file, sidecar_format))
+        self.assertEqual(find_sidecar(self.combined_file), path)
+
+        columns, meta = load_columns(path)
+        self.assertEqual(meta["count"], len(combined_log))
+        self.assertIsInstance(columns["collectionId"], StringColumn)
+        self.assertEqual(columns["http_response_code"].dtype, np.int64)
+        self.assertEqual(columns["bes_count"].tolist(), [1, 0, 0, 0, 1, 1])
+
+        records = list(iter_column_records(columns))
+        for record, expected in zip(records, combined_log.values()):
+            for key in ("request_id", "user_id", "http_response_code", "collectionId"):
+                self.assertEqual(record[key], expected[key])
+        with open(self.combined_file, 'rb') as f:
+            f.seek(records[1]["record_offset"])
+            self.assertEqual(json.loads(f.read(records[1]["record_length"])), combined_log["r2"])
+
+    def test_npz(self):
+        self.check_sidecar("npz")
+
+    @unittest.skipIf(not have_pyarrow, "pyarrow is not installed")
+    def test_parquet(self):
+        self.check_sidecar("parquet")
+
+    def test_missing_values(self):
+        builder = ColumnBuilder()
+        builder.add({"total_time": 5, "collectionId": "a"})
+        builder.add({"total_time": 1.5, "time_completed": "2025-02-14T07:00:12+0000"})
+        arrays = builder.arrays()
+        self.assertEqual(arrays["total_time"].dtype, np.float64)
+        self.assertEqual(arrays["collectionId"].codes.tolist(), [0, -1])
+        self.assertEqual(arrays["time_completed"].codes.tolist(), [-1, 0])
+        self.assertEqual(arrays["epoch_time"].tolist(), [None, 1739516412.0])
+
+    def test_writer_offsets(self):
+        # The offsets returned by JsonObjectWriter are what ngap-logs.py puts in the sidecar
+        out = io.StringIO()
+        with JsonObjectWriter(out, indent=2) as writer:
+            offsets = [writer.write(key, record) for key, record in combined_log.items()]
+        text = out.getvalue()
+        for (offset, length), record in zip(offsets, combined_log.values()):
+            self.assertEqual(json.loads(text[offset:offset + length]), record)
+
+    def test_report_and_query_use_sidecar(self):
+        expected = report_combined_logs(self.combined_file, write_files=False)
+        build_sidecar(self.combined_file)
+        self.assertEqual(report_combined_logs(self.combined_file, write_files=False), expected)
+
+        index = open_index(self.combined_file)
+        self.assertEqual([r["request_id"] for r in index.records(index.query("code=404 and not has(bes)"))],
+                         ["r2", "r3"])
+
+    def test_stale_sidecar(self):
+        build_sidecar(self.combined_file)
+        with open(self.combined_file, 'w') as f:
+            json.dump({"r1": combined_log["r1"]}, f)
+        self.assertIsNone(find_sidecar(self.combined_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
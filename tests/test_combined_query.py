@@ -0,0 +1,61 @@
+import unittest
+import tempfile
+import os
+import json
+
+from combined_query import open_index, parse_query, CombinedIndex
+from combined_report import record_files
+from tests.test_combined_report import combined_log
+
+
+class TestCombinedQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.combined_file = os.path.join(self.directory.name, "hyrax_combined_logs.json")
+        with open(self.combined_file, 'w') as f:
+            json.dump(combined_log, f, indent=2)
+        self.index = open_index(self.combined_file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def request_ids(self, query):
+        return [record["request_id"] for record in self.index.records(self.index.query(query))]
+
+    def test_queries(self):
+        self.assertEqual(self.request_ids("code=404"), ["r2", "r3", "r5"])
+        self.assertEqual(self.request_ids("code=404 and collectionId^=/hyrax/ngap and not has(bes)"), ["r2"])
+        self.assertEqual(self.request_ids("code>=500 or (user_id=d and code=4xx)"), ["r4", "r5", "r6"])
+        self.assertEqual(self.request_ids("collectionId~=POCLOUD and code!=200"), ["r6"])
+        self.assertEqual(self.request_ids("collectionId='/hyrax/login'"), ["r4"])
+        self.assertEqual(self.request_ids("user_ip=10.0.0.1"), [])
+
+    def test_matches_report_predicates(self):
+        # The same records as the combined_report.py record files
+        queries = {"unmatched_records": "not has(bes)", "cmr_records": "collectionId~=/hyrax/CMR",
+                   "all_ngap_404_records": "collectionId^=/hyrax/ngap and code=404",
+                   "nsidc_cprd_records": "collectionId~=NSIDC_CPRD", "all_401_records": "code=401"}
+        for name, query in queries.items():
+            expected = [r["request_id"] for r in combined_log.values() if record_files[name](r)]
+            self.assertEqual(self.request_ids(query), expected, name)
+
+    def test_index_is_saved_and_rebuilt(self):
+        index_file = self.combined_file + ".qidx"
+        self.assertTrue(os.path.exists(index_file))
+        loaded = CombinedIndex(self.combined_file).load(index_file)
+        self.assertTrue(loaded.is_current())
+        self.assertEqual(loaded.query("code=404"), self.index.query("code=404"))
+
+        with open(self.combined_file, 'w') as f:
+            json.dump({"r7": {"request_id": "r7", "http_response_code": 404}}, f)
+        self.assertEqual(open_index(self.combined_file).count, 1)
+
+    def test_bad_queries(self):
+        for query in ("code", "size=3", "code ^= 4", "(code=200", "code=200 user_id=a"):
+            with self.assertRaises(ValueError, msg=query):
+                parse_query(query)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import tempfile
+import os
+import json
+from io import StringIO
+import contextlib
+
+from combined_report import report_combined_logs, print_report
+
+combined_log = {
+    "r1": {"request_id": "r1", "user_id": "a", "http_response_code": 200,
+           "collectionId": "/hyrax/ngap/collections/C1-POCLOUD/granules/g1.h5", "bes": [{"hyrax-type": "request"}]},
+    "r2": {"request_id": "r2", "user_id": "b", "http_response_code": 404,
+           "collectionId": "/hyrax/ngap/collections/C2-NSIDC_CPRD/granules/g2.h5", "bes": []},
+    "r3": {"request_id": "r3", "user_id": "c", "http_response_code": 404, "collectionId": "/hyrax/CMR/x", "bes": []},
+    "r4": {"request_id": "r4", "user_id": "d", "http_response_code": 401, "collectionId": "/hyrax/login"},
+    "r5": {"request_id": "r5", "user_id": "d", "http_response_code": 404, "collectionId": "/hyrax/docs/x.html",
+           "bes": [{"hyrax-type": "request"}]},
+    "r6": {"request_id": "r6", "user_id": "e", "http_response_code": 500,
+           "collectionId": "/hyrax/ngap/collections/C1-POCLOUD/granules/g3.h5", "bes": [{"hyrax-type": "request"}]},
+}
+
+
+class TestCombinedReport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.combined_file = os.path.join(self.directory.name, "hyrax_combined_logs.json")
+        with open(self.combined_file, 'w') as f:
+            json.dump(combined_log, f, indent=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_counts(self):
+        report = report_combined_logs(self.combined_file, self.directory.name)
+        self.assertEqual(report["records"], 6)
+        self.assertEqual(report["unmatched_records"], 3)
+        self.assertEqual(report["cmr_records"], 1)
+        self.assertEqual(report["cmr_404"], 1)
+        self.assertEqual(report["all_404_records"], 3)
+        self.assertEqual(report["all_ngap_404_records"], 1)
+        self.assertEqual(report["other_404_records"], 1)
+        self.assertEqual(report["unmatched_ngap_404_records"], 1)
+        self.assertEqual(report["nsidc_404_records"], 1)
+        self.assertEqual(report["POCLOUD_codes"], {200: 1, 500: 1})
+        self.assertEqual(report["login_401"], 1)
+        self.assertEqual(report["401_user_ids"], {"d"})
+        self.assertEqual(report["codes"][404], 3)
+
+    def test_record_files(self):
+        report_combined_logs(self.combined_file, self.directory.name)
+        with open(os.path.join(self.directory.name, "all_404_records"), 'r') as f:
+            text = f.read()
+        self.assertEqual(text.count('"request_id"'), 3)
+        self.assertTrue(text.startswith(json.dumps(combined_log["r2"], indent=2)))
+
+    def test_print_report(self):
+        out = StringIO()
+        with contextlib.redirect_stdout(out):
+            print_report(report_combined_logs(self.combined_file, write_files=False))
+        self.assertIn("Located 2 records for POCLOUD", out.getvalue())
+        self.assertIn("Located 1 (500 Server Error) response records for POCLOUD", out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import tempfile
+import os
+import json
+
+from hyperloglog import HyperLogLog
+from distinct_counts import DistinctCounts, dimension_values, load_counts, save_counts
+from combined_report import report_combined_logs
+
+
+def record(seconds: int, user: str, granule: str = "g1.dap.nc4", provider: str = "POCLOUD") -> dict:
+    return {"cloudwatch_timestamp": seconds * 1000, "user_id": user, "user_ip": f"10.0.0.{user[-1]}",
+            "collectionId": f"/hyrax/ngap/collections/C1-{provider}/granules/{granule}"}
+
+
+class TestHyperLogLog(unittest.TestCase):
+
+    def test_count(self):
+        sketch = HyperLogLog()
+        for n in range(50000):
+            sketch.add(f"user{n % 20000}")
+        self.assertLess(abs(sketch.count() - 20000), 20000 * 4 * sketch.error())
+        small = HyperLogLog()
+        for item in ["a", "b", "c", "a"]:
+            small.add(item)
+        self.assertEqual(small.count(), 3)
+
+    def test_merge_round_trip(self):
+        one, two = HyperLogLog(10), HyperLogLog(10)
+        for n in range(300):
+            one.add(str(n))
+            two.add(str(n + 200))
+        copy = HyperLogLog.from_dict(json.loads(json.dumps(one.to_dict())))
+        self.assertEqual(copy.registers, one.registers)
+        self.assertAlmostEqual(copy.merge(two).count(), 500, delta=25)
+        with self.assertRaises(ValueError):
+            one.merge(HyperLogLog(12))
+
+
+class TestDistinctCounts(unittest.TestCase):
+
+    def test_dimension_values(self):
+        self.assertEqual(dimension_values(record(0, "u1")), [("user", "u1"), ("ip", "10.0.0.1"),
+                                                              ("collection", "C1-POCLOUD"),
+                                                              ("granule", "C1-POCLOUD/g1")])
+        self.assertEqual(dimension_values({"user_id": "", "collectionId": "/hyrax/CMR/x"}), [])
+
+    def test_counts(self):
+        counts = DistinctCounts(width=3600)
+        hour = 1743066000
+        for r in [record(hour, "u1"), record(hour + 10, "u2", "g1.dmr"), record(hour + 3600, "u1", "g2.dap"),
+                  record(hour + 3700, "u3", provider="NSIDC_CPRD"), {"user_id": "u4"}]:
+            counts.add(r)
+        self.assertEqual(counts.untimed, 1)
+        self.assertEqual(counts.counts(), {hour: {"user": 3, "ip": 3, "collection": 2, "granule": 3}})
+        self.assertEqual(counts.counts(provider="POCLOUD", per=3600)[hour + 3600]["user"], 1)
+        self.assertEqual(counts.counts(hour + 3600, hour + 7200, "ALL")[hour + 3600]["user"], 2)
+        with self.assertRaises(ValueError):
+            counts.counts(per=600)
+
+        # A saved store merges with another; the union is not the sum
+        other = DistinctCounts(width=3600)
+        other.add(record(hour + 20, "u2"))
+        other.add(record(hour + 30, "u5"))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "distinct.json")
+            save_counts(counts, path)
+            merged = load_counts(path).merge(other)
+        self.assertEqual(merged.counts(provider="POCLOUD")[hour]["user"], 3)
+        self.assertEqual(merged.providers(), ["ALL", "NSIDC_CPRD", "POCLOUD"])
+        with self.assertRaises(ValueError):
+            merged.merge(DistinctCounts(width=60))
+
+    def test_report_pass(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "combined.json")
+            with open(path, 'w') as f:
+                json.dump([record(1743066000, "u1"), record(1743066001, "u2")], f)
+            distinct = DistinctCounts()
+            report = report_combined_logs(path, write_files=False, distinct=distinct)
+        self.assertEqual(report["records"], 2)
+        self.assertEqual(distinct.counts()[1743066000]["user"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
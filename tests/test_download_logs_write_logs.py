@@ -43,6 +43,14 @@ class TestWriteLogs(unittest.TestCase):
             content = f.read()
             self.assertEqual(content.strip(), '[\n{"key1": "value1"},\n{"key3": "value3"}\n]')
 
+    def test_timestamps(self):
+        events = [{"message": '{"key1": "value1"}', "timestamp": 1672531200000}, {"message": "not json"},
+                  {"message": '{}', "timestamp": 1672531260000}]
+        download_logs.write_logs(events, self.output_file, "cloudwatch_timestamp")
+        with open(self.output_file, 'r') as f:
+            self.assertEqual(json.load(f), [{"cloudwatch_timestamp": 1672531200000, "key1": "value1"},
+                                            {"cloudwatch_timestamp": 1672531260000}])
+
     def test_none_events(self):
         with self.assertRaises(ValueError):
             download_logs.write_logs(None, self.output_file)
@@ -0,0 +1,95 @@
+import unittest
+import tempfile
+import os
+import io
+import json
+from contextlib import redirect_stderr
+
+from event_dedup import record_key, BloomFilter, Deduplicator
+from json_stream import iter_combined_records
+from loganalysis.cli import load_tool
+import download_logs
+
+
+class TestEventDedup(unittest.TestCase):
+
+    def test_record_key(self):
+        # The event id is the key when there is one; otherwise the content, in any key order
+        self.assertEqual(record_key({"cloudwatch_event_id": "1", "a": 1}), record_key({"cloudwatch_event_id": "1"}))
+        self.assertEqual(record_key({"a": 1, "b": 2}), record_key({"b": 2, "a": 1}))
+        self.assertNotEqual(record_key({"a": 1}), record_key({"a": 2}))
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 1e-3)
+        keys = [record_key({"n": n}) for n in range(2000)]
+        for key in keys[:1000]:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys[:1000]))
+        self.assertLess(sum(key in bloom for key in keys[1000:]), 10)
+
+    def test_deduplicator(self):
+        # With a window of 2 keys, the first records are in the Bloom filter by the time they repeat
+        deduplicator = Deduplicator(window=2, capacity=100)
+        records = [{"n": n} for n in range(10)]
+        self.assertEqual(list(deduplicator.filter(records + records[:3] + [{"n": 10}])), records + [{"n": 10}])
+        self.assertIsNotNone(deduplicator.bloom)
+        self.assertEqual((deduplicator.seen, deduplicator.duplicates), (14, 3))
+
+    def test_content_false(self):
+        # Only records with an event id can be duplicates
+        deduplicator = Deduplicator(content=False)
+        records = [{"n": 1}, {"n": 1}, {"cloudwatch_event_id": "e1"}, {"cloudwatch_event_id": "e1"}]
+        self.assertEqual(list(deduplicator.filter(records)), records[:3])
+
+    def test_shared_and_raw_bes_log(self):
+        merge = load_tool("ngap-logs.py")
+        deduplicator = Deduplicator()
+        with tempfile.TemporaryDirectory() as directory:
+            raw, one, two = (os.path.join(directory, name) for name in ("bes.log", "one.json", "two.json"))
+            # Two identical info lines from one process in the same second are both real
+            with open(raw, 'w') as f:
+                f.write("1739516401|&|h-1|&|10|&|info|&|Reading the catalog\n" * 2)
+            for path in (one, two):
+                with open(path, 'w') as f:
+                    json.dump([{"cloudwatch_event_id": "e1"}, {"cloudwatch_event_id": path}], f)
+            self.assertEqual(len(list(merge.iter_records(raw, deduplicator))), 2)
+            # One deduplicator across files drops what an earlier file had
+            with redirect_stderr(io.StringIO()):
+                self.assertEqual(len(list(merge.iter_records(one, deduplicator))), 2)
+                self.assertEqual(list(merge.iter_records(two, deduplicator)), [{"cloudwatch_event_id": two}])
+
+    def test_write_logs_event_ids(self):
+        events = [{"message": '{"a": 1}', "eventId": "e1", "timestamp": 5},
+                  {"message": '{"a": 2}', "eventId": "e2", "timestamp": 6},
+                  {"message": '{"a": 1}', "eventId": "e1", "timestamp": 5}]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "log.json")
+            download_logs.write_logs(events, path, "cloudwatch_timestamp", "cloudwatch_event_id")
+            with open(path) as f:
+                self.assertEqual(json.load(f), [{"cloudwatch_timestamp": 5, "cloudwatch_event_id": "e1", "a": 1},
+                                                {"cloudwatch_timestamp": 6, "cloudwatch_event_id": "e2", "a": 2}])
+
+    def test_merge_dedup(self):
+        merge = load_tool("ngap-logs.py")
+        request = {"request_id": "A", "cloudwatch_event_id": "r1"}
+        # Identical BES records without an eventId can be real; ones with the same eventId are copies
+        bes = [{"request-id": "A", "message": "one"}, {"request-id": "A", "message": "two"},
+               {"request-id": "A", "message": "three", "cloudwatch_event_id": "b3"}]
+        with tempfile.TemporaryDirectory() as directory:
+            files = [os.path.join(directory, name) for name in ("request.json", "response.json", "bes.json",
+                                                                 "combined.json")]
+            for path, records in zip(files, ([request, request], [{"request_id": "A", "code": 200}] * 2,
+                                             bes + bes[2:] + bes[:1])):
+                with open(path, 'w') as f:
+                    json.dump(records, f)
+            sources = merge.default_sources(*files[:3])
+            with redirect_stderr(io.StringIO()) as err:
+                merge.get_merged_sources(sources, files[3], dedup=True)
+            self.assertIn("Dropped 1 duplicate records (of 2) from", err.getvalue())
+            self.assertIn("Dropped 1 duplicate records (of 5) from", err.getvalue())
+            record, = iter_combined_records(files[3])
+            self.assertEqual([r["message"] for r in record["bes"]], ["one", "two", "three", "one"])
+
+
+if __name__ == '__main__':
+    unittest.main()
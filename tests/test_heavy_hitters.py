@@ -0,0 +1,107 @@
+import unittest
+import tempfile
+import os
+import io
+import sys
+import json
+import csv
+from collections import Counter
+from contextlib import redirect_stdout
+from unittest import mock
+
+from count_min import CountMinSketch, HeavyHitters
+from heavy_hitters import count_records, error_templates, report_rows
+import heavy_hitters
+
+
+def zipf_items(n: int = 20000) -> list:
+    # item i appears about n / (i + 1) / 10 times
+    return [f"item{i}" for i in range(200) for _ in range(max(n // (i + 1) // 10, 1))]
+
+
+class TestCountMin(unittest.TestCase):
+
+    def test_estimates(self):
+        sketch = CountMinSketch(epsilon=0.01, delta=0.01)
+        items = zipf_items()
+        for item in items:
+            sketch.add(item)
+        counts = Counter(items)
+        self.assertEqual(sketch.total, len(items))
+        for item, count in counts.items():
+            self.assertGreaterEqual(sketch.estimate(item), count)
+            self.assertLessEqual(sketch.estimate(item), count + sketch.error())
+        self.assertLessEqual(sketch.estimate("missing"), sketch.error())
+
+    def test_merge_round_trip(self):
+        one, two = CountMinSketch(0.01), CountMinSketch(0.01)
+        for item in ["a"] * 5 + ["b"] * 3:
+            one.add(item)
+        two.add("a", 4)
+        copy = CountMinSketch.from_dict(json.loads(json.dumps(one.to_dict())))
+        self.assertEqual(copy.merge(two).estimate("a"), 9)
+        self.assertEqual(copy.total, 12)
+        with self.assertRaises(ValueError):
+            one.merge(CountMinSketch(0.1))
+
+    def test_heavy_hitters(self):
+        items = zipf_items()
+        hitters = HeavyHitters(k=5, epsilon=0.001)
+        for item in items:
+            hitters.add(item)
+        self.assertEqual([item for item, _ in hitters.top()], [f"item{i}" for i in range(5)])
+        self.assertEqual(hitters.top(1), [("item0", 2000)])
+
+        # Two shards, each with half of the items, merge to the same top five
+        halves = HeavyHitters(k=5, epsilon=0.001), HeavyHitters(k=5, epsilon=0.001)
+        for n, item in enumerate(items):
+            halves[n % 2].add(item)
+        merged = HeavyHitters.from_dict(json.loads(json.dumps(halves[0].to_dict()))).merge(halves[1])
+        self.assertEqual(merged.top(), hitters.top())
+
+
+class TestHeavyHitters(unittest.TestCase):
+
+    records = [{"request_id": "A", "user_id": "u1", "user_ip": "10.0.0.1", "http_response_code": 200,
+                "bes": [{"hyrax-type": "error", "hyrax-message": "ERROR: Could not find /a/b.nc file 12"}]},
+               {"request_id": "B", "user_id": "u1", "http_response_code": 404},
+               {"request_id": "C", "user_id": "u2", "http_response_code": 200},
+               {"hyrax-type": "error", "hyrax-message": "ERROR: Could not find /c/d.h5 file 7"}]
+
+    def test_count_records(self):
+        self.assertEqual(len(set(error_templates(self.records[0]))), 1)
+        self.assertEqual(set(error_templates(self.records[0])), set(error_templates(self.records[3])))
+        hitters = {name: HeavyHitters(3, 0.01) for name in ("user", "status", "error")}
+        self.assertEqual(count_records(self.records, hitters), 4)
+        rows = list(report_rows(hitters))
+        self.assertEqual(rows[0][:5], ["user", 1, "u1", 2, 2])
+        self.assertEqual([row[2:4] for row in rows if row[0] == "status"], [["200", 2], ["404", 1]])
+        self.assertEqual([row[3] for row in rows if row[0] == "error"], [2])
+
+    def test_collections(self):
+        # Requests for the granules of a collection count for its concept id; other paths are not collections
+        paths = ["/hyrax/ngap/providers/NSIDC_CPRD/collections/C3431576401-NSIDC_CPRD/granules/ATL03_001.h5.dmrpp",
+                 "/hyrax/ngap/providers/NSIDC_CPRD/collections/C3431576401-NSIDC_CPRD/granules/ATL03_002.h5.dap.nc4",
+                 "/hyrax/ngap/collections/C1234-POCLOUD/granules/sst.nc.dmr.xml", "/hyrax/login", "/hyrax/version"]
+        hitters = {"collection": HeavyHitters(3, 0.01)}
+        count_records([{"collectionId": path} for path in paths], hitters)
+        self.assertEqual([row[2:4] for row in report_rows(hitters)],
+                         [["C3431576401-NSIDC_CPRD", 2], ["C1234-POCLOUD", 1]])
+
+    def test_main_save_merge(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log, saved = os.path.join(directory, "combined.json"), os.path.join(directory, "top.json")
+            with open(log, 'w') as f:
+                json.dump(self.records, f)
+            argv = ["heavy_hitters.py", "-i", log, "-d", "user,ip", "-s", saved, "-e", "0.01"]
+            with mock.patch.object(sys, "argv", argv), redirect_stdout(io.StringIO()):
+                heavy_hitters.main()
+            argv = ["heavy_hitters.py", "-m", saved, saved, "-d", "user", "-e", "0.01"]
+            with mock.patch.object(sys, "argv", argv), redirect_stdout(io.StringIO()) as out:
+                heavy_hitters.main()
+            rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+            self.assertEqual([(row["item"], row["estimate"]) for row in rows], [("u1", "4"), ("u2", "2")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import tempfile
+import os
+import json
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+from json_stream import iter_combined_records
+from hourly_pipeline import hour_shards, run_pipeline, combine_rollups, download_shard, shard_files
+
+
+def request(request_id: str, time: int) -> dict:
+    return {"cloudwatch_timestamp": time * 1000, "request_id": request_id,
+            "collectionId": "/hyrax/ngap/collections/C1-POCLOUD/granules/g.dap.nc4"}
+
+
+def response(request_id: str, time: str, code: int = 200) -> dict:
+    return {"request_id": request_id, "http_response_code": code, "time_completed": time, "output_size": 10}
+
+
+def bes(request_id: str, time: int) -> dict:
+    return {"hyrax-type": "info", "hyrax-request-id": request_id, "hyrax-time": time, "hyrax-message": "m"}
+
+
+# 2025-03-27T09:00:00 and 10:00:00 UTC
+nine, ten = 1743066000, 1743069600
+
+# Request A starts at 09:59:59 and its response and last BES record are in the 10:00 hour
+shards = {
+    "2025-03-27T09": {"request_log": [request("A", ten - 1), request("B", nine + 60)],
+                      "response_log": [response("B", "2025-03-27T09:01:01Z")],
+                      "bes_log": [bes("B", nine + 60), bes("A", ten - 1)]},
+    "2025-03-27T10": {"request_log": [request("C", ten + 60)],
+                      "response_log": [response("A", "2025-03-27T10:00:01Z"), response("C", "2025-03-27T10:01:01Z"),
+                                       response("D", "2025-03-27T10:02:01Z", 500)],
+                      "bes_log": [bes("A", ten + 1), bes("C", ten + 60)]},
+}
+
+
+class TestHourlyPipeline(unittest.TestCase):
+
+    def test_hour_shards(self):
+        self.assertEqual(hour_shards("2025-03-27T09:30:00", "2025-03-27T11:00:00"),
+                         [("2025-03-27T09:00:00", "2025-03-27T10:00:00"),
+                          ("2025-03-27T10:00:00", "2025-03-27T11:00:00")])
+        self.assertEqual(len(hour_shards("2025-03-27", "2025-03-28")), 24)
+        self.assertEqual(hour_shards("2025-03-27T10", "2025-03-27T10"), [])
+
+    def test_combine_rollups(self):
+        rows = combine_rollups([[["2025-03-27T00:00:00Z", "POCLOUD", 2, 1]],
+                                [["2025-03-27T00:00:00Z", "POCLOUD", 3, 0], ["2025-03-27T00:00:00Z", "-", 1, 1]]])
+        self.assertEqual(rows, [["2025-03-27T00:00:00Z", "-", 1, 1], ["2025-03-27T00:00:00Z", "POCLOUD", 5, 1]])
+
+    @patch('download_logs.boto3.client')
+    def test_download_shard(self, mock_boto_client):
+        client = MagicMock()
+        mock_boto_client.return_value = client
+        client.filter_log_events.side_effect = lambda **params: {
+            "events": [{"message": '{"a": 1}', "timestamp": 5, "eventId": "e1"}]
+            if params["logGroupName"] == "requests" else []}
+        shard = ("2025-03-27T09:00:00", "2025-03-27T10:00:00")
+        with tempfile.TemporaryDirectory() as directory:
+            files = shard_files(directory)
+            download_shard(shard, files, {"request_log": "requests", "response_log": "responses"})
+            with open(files["request_log"]) as f:
+                self.assertEqual(json.load(f), [{"cloudwatch_timestamp": 5, "cloudwatch_event_id": "e1", "a": 1}])
+            # An hour with no events is an empty log
+            with open(files["response_log"]) as f:
+                self.assertEqual(json.load(f), [])
+            # CloudWatch's endTime is inclusive, so the shard ends a millisecond before the next hour
+            end = int(datetime.strptime(shard[1], "%Y-%m-%dT%H:%M:%S").timestamp() * 1000)
+            self.assertEqual({call.kwargs["endTime"] for call in client.filter_log_events.call_args_list}, {end - 1})
+            # A failed download is an error, not an empty hour
+            with self.assertRaises(ValueError):
+                download_shard(shard, files, {"bes_log": ""})
+            self.assertFalse(os.path.exists(files["bes_log"]))
+
+    def test_run_pipeline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for shard, logs in shards.items():
+                os.makedirs(os.path.join(directory, shard))
+                for name, records in logs.items():
+                    with open(os.path.join(directory, shard, name + ".json"), 'w') as f:
+                        json.dump(records, f)
+
+            summary = run_pipeline("2025-03-27T09:00:00", "2025-03-27T11:00:00", directory, processes=2,
+                                   download=False, bucket=3600)
+            self.assertEqual((summary["shards"], summary["requests"]), (2, 3))
+            # Response A and BES record A were moved to the 09:00 shard; response D has no request
+            self.assertEqual((summary["reconciled"], summary["unmatched"]), (2, 1))
+
+            records = {record["request_id"]: record
+                       for record in iter_combined_records(os.path.join(directory, "2025-03-27T09",
+                                                                        "hyrax_combined_logs.json"))}
+            self.assertNotIn("ERROR", records["A"])
+            self.assertEqual(records["A"]["http_response_code"], 200)
+            self.assertEqual([record["hyrax-time"] for record in records["A"]["bes"]], [ten - 1, ten + 1])
+            self.assertEqual(len(records["B"]["bes"]), 1)
+            self.assertTrue(os.path.exists(os.path.join(directory, "2025-03-27T10", "rollups.csv")))
+
+        self.assertEqual([row[:4] for row in summary["rows"]],
+                         [["2025-03-27T09:00:00Z", "POCLOUD", 2, 0], ["2025-03-27T10:00:00Z", "POCLOUD", 1, 0]])
+
+    def test_run_pipeline_dedup(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for shard, logs in shards.items():
+                os.makedirs(os.path.join(directory, shard))
+                for name, records in logs.items():
+                    records = [{"cloudwatch_event_id": f"{name}-{record.get('request_id', record.get('hyrax-request-id'))}-"
+                                                       f"{number}", **record} for number, record in enumerate(records)]
+                    if shard == "2025-03-27T10" and name == "request_log":
+                        # The 09:00 shard's request B was downloaded into this shard as well
+                        records.append({"cloudwatch_event_id": "request_log-B-1", **request("B", nine + 60)})
+                    with open(os.path.join(directory, shard, name + ".json"), 'w') as f:
+                        json.dump(records, f)
+
+            summary = run_pipeline("2025-03-27T09:00:00", "2025-03-27T11:00:00", directory, processes=2,
+                                   download=False, bucket=3600, dedup=True)
+            self.assertEqual(summary["duplicates"], 1)
+            self.assertEqual(summary["requests"], 3)
+            with open(os.path.join(directory, "2025-03-27T10", "request_log.json")) as f:
+                self.assertEqual([record["request_id"] for record in json.load(f)], ["C"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,11 @@ from io import StringIO
 import contextlib
 
 import json
-from join_json_arrays import join_json_arrays
+from unittest import mock
+
+import join_json_arrays as join_json_arrays_module
+from join_json_arrays import join_json_arrays, join_json_arrays_partitioned, parse_memory_size, \
+    sort_merge_join_json_arrays, sort_merge_join, record_time
 
 class TestJoinJsonArrays(unittest.TestCase):
 
@@ -88,6 +92,73 @@ class TestJoinJsonArrays(unittest.TestCase):
         printed = out.getvalue()
         self.assertIn("Joined 1 records", printed)
 
+    def test_partitioned_join_matches_in_memory(self):
+        left_data = [{"id": f"req-{i}", "value": i, "nested": {"a": [i, 1.5]}} for i in range(200)]
+        right_data = [{"id": f"req-{i}", "extra": "right", "value": -i} for i in range(0, 300, 3)]
+        right_data.append({"id": "req-3", "extra": "last one wins"})
+        json.dump(left_data, self.left_file)
+        self.left_file.seek(0)
+        json.dump(right_data, self.right_file)
+        self.right_file.seek(0)
+
+        join_json_arrays(self.left_file.name, self.right_file.name, 'id', self.result_file.name)
+        with open(self.result_file.name, 'r') as f:
+            in_memory = f.read()
+
+        # A tiny limit forces many partitions
+        join_json_arrays_partitioned(self.left_file.name, self.right_file.name, 'id', self.result_file.name, 1000)
+        with open(self.result_file.name, 'r') as f:
+            partitioned = f.read()
+
+        self.assertEqual(partitioned, in_memory)
+
+        # With few partitions allowed, the partitions that are still too big are partitioned again
+        with mock.patch.object(join_json_arrays_module, "max_partitions", 2), \
+                mock.patch.object(join_json_arrays_module, "join_partition",
+                                  wraps=join_json_arrays_module.join_partition) as join_partition:
+            join_json_arrays_partitioned(self.left_file.name, self.right_file.name, 'id', self.result_file.name,
+                                         1000)
+        self.assertGreater(join_partition.call_count, 2)
+        with open(self.result_file.name, 'r') as f:
+            self.assertEqual(f.read(), in_memory)
+
+    def test_parse_memory_size(self):
+        self.assertEqual(parse_memory_size("512M"), 512 * 1024 * 1024)
+        self.assertEqual(parse_memory_size("2g"), 2 * 1024 ** 3)
+        self.assertEqual(parse_memory_size("1000"), 1000)
+
+    def test_sort_merge_join_matches_in_memory(self):
+        left_data = [{"id": f"req-{i}", "ts": 1739516409000 + i * 1000} for i in range(100)]
+        right_data = [{"id": f"req-{i}", "time_completed": f"2025-02-14T07:{i // 60:02d}:{i % 60:02d}+0000",
+                       "code": 200} for i in range(0, 100, 2)]
+        json.dump(left_data, self.left_file)
+        self.left_file.seek(0)
+        json.dump(right_data, self.right_file)
+        self.right_file.seek(0)
+
+        join_json_arrays(self.left_file.name, self.right_file.name, 'id', self.result_file.name)
+        with open(self.result_file.name, 'r') as f:
+            in_memory = f.read()
+
+        sort_merge_join_json_arrays(self.left_file.name, self.right_file.name, 'id', self.result_file.name,
+                                    "ts", "time_completed", window=5000)
+        with open(self.result_file.name, 'r') as f:
+            self.assertEqual(f.read(), in_memory)
+
+    def test_sort_merge_join_window(self):
+        left = [{"id": "a", "t": 0}, {"id": "b", "t": 10}, {"id": "c", "t": 20}, {"id": "d", "t": 100}]
+        right = [{"id": "a", "t": 2}, {"id": "c", "t": 90}, {"id": "d", "t": 95}]
+        results = list(sort_merge_join([(left, lambda r: r["id"], "t"), (right, lambda r: r["id"], "t")], 10))
+        self.assertEqual([record["id"] for record, _ in results], ["a", "b", "c", "d"])
+        # 'c' on the right is too late to join
+        self.assertEqual([len(matches[1]) for _, matches in results], [1, 0, 0, 1])
+
+    def test_record_time(self):
+        self.assertEqual(record_time("2025-02-14T07:00:12+0000"), 1739516412)
+        self.assertEqual(record_time(1739516409753), 1739516409.753)
+        self.assertEqual(record_time(1739516409), 1739516409)
+        self.assertIsNone(record_time("not a time"))
+
 
 if __name__ == '__main__':
     unittest.main()
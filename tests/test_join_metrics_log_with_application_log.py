@@ -7,6 +7,7 @@ import contextlib
 
 import json
 from join_metrics_log_with_application_log import join_metrics_log_with_application_log_entries
+from log_processing import request_fields
 
 verbose = True
 
@@ -238,6 +239,27 @@ class TestJoinJsonArrays(unittest.TestCase):
             joined_data = json.load(f)
         self.assertEqual(joined_data, expected_output)
 
+    def test_join_with_raw_bes_log(self):
+        # Write the application log as a raw bes.log and check the join is the same.
+        def to_raw_line(record):
+            fields = [record["hyrax-time"], record["hyrax-instance-id"], record["hyrax-pid"], record["hyrax-type"]]
+            if record["hyrax-type"] == "request":
+                fields += ["OLFS"] + [record["hyrax-" + key] for key in request_fields]
+            else:
+                fields.append(record["hyrax-message"])
+            return "|&|".join(str(field) for field in fields) + "\n"
+
+        json.dump(metrics_log, self.metrics_log_file)
+        self.metrics_log_file.seek(0)
+        self.application_log_file.writelines(to_raw_line(record) for record in application_log)
+        self.application_log_file.seek(0)
+
+        join_metrics_log_with_application_log_entries(self.metrics_log_file.name, self.application_log_file.name, self.result_file.name)
+
+        with open(self.result_file.name, 'r') as f:
+            joined_data = json.load(f)
+        self.assertEqual(joined_data, expected_output)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import json
+from io import StringIO
+
+import os
+import tempfile
+
+from json_stream import iter_json_array, iter_json_values, iter_json_object_items, JsonArrayWriter, JsonObjectWriter, \
+    iter_combined_records, read_record_at
+
+records = [{"request_id": "r1", "size": 12345, "bes": [{"hyrax-message": "a, [b] {c}"}]},
+           {"request_id": "r2", "size": -1.5e3, "ok": True, "none": None},
+           {"request_id": "r3", "unicode": "café"}]
+
+
+class TestJsonStream(unittest.TestCase):
+
+    def test_array_small_chunks(self):
+        text = json.dumps(records, indent=2)
+        self.assertEqual(list(iter_json_array(StringIO(text), chunk_size=7)), records)
+
+    def test_array_of_numbers(self):
+        self.assertEqual(list(iter_json_array(StringIO("[1, 22, 333333, 4.25]"), chunk_size=3)), [1, 22, 333333, 4.25])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array(StringIO(" [ ] "))), [])
+
+    def test_raw_values(self):
+        text = "\n".join(json.dumps(record) for record in records)
+        self.assertEqual(list(iter_json_values(StringIO(text), chunk_size=5)), records)
+
+    def test_object_items(self):
+        combined = {record["request_id"]: record for record in records}
+        items = list(iter_json_object_items(StringIO(json.dumps(combined, indent=2)), chunk_size=11))
+        self.assertEqual(dict(items), combined)
+
+    def test_bad_array(self):
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_json_array(StringIO('[{"a": 1} {"b": 2}]')))
+
+    def test_writer_matches_json_dump(self):
+        for indent in (None, 2, 4):
+            for data in (records, [], [1]):
+                out = StringIO()
+                with JsonArrayWriter(out, indent=indent) as writer:
+                    for record in data:
+                        writer.write(record)
+                self.assertEqual(out.getvalue(), json.dumps(data, indent=indent))
+
+    def test_object_writer_matches_json_dump(self):
+        for indent in (None, 2):
+            for data in ({record["request_id"]: record for record in records}, {}):
+                out = StringIO()
+                with JsonObjectWriter(out, indent=indent) as writer:
+                    for key, value in data.items():
+                        writer.write(key, value)
+                self.assertEqual(out.getvalue(), json.dumps(data, indent=indent))
+
+    def test_offsets(self):
+        combined = {record["request_id"]: record for record in records}
+        for data in (combined, records):
+            with tempfile.NamedTemporaryFile(mode='w', encoding="utf-8", delete=False) as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            try:
+                items = list(iter_combined_records(f.name, chunk_size=16, with_offsets=True))
+                self.assertEqual([record for _, _, record in items], records)
+                with open(f.name, 'rb') as fp:
+                    for offset, length, record in items:
+                        self.assertEqual(read_record_at(fp, offset, length), record)
+            finally:
+                os.remove(f.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import tempfile
+import os
+import json
+
+import numpy as np
+
+from combined_columns import build_sidecar, load_combined_columns
+from latency_analysis import percentile_table, exact_latency, streaming_latency, bes_timer_latency, latency_fields
+
+
+def bes(action, *elapsed_us):
+    return [{"hyrax-type": "request", "hyrax-bes-action": action}] + \
+           [{"hyrax-type": "timing", "hyrax-elapsed-us": us, "hyrax-timer-name": "transmit"} for us in elapsed_us]
+
+
+combined_log = {
+    "r1": {"request_id": "r1", "cloudwatch_timestamp": 1739516400000, "http_response_code": 200, "total_time": 100,
+           "collectionId": "/hyrax/ngap/collections/C1-POCLOUD/granules/g1.h5", "bes": bes("get.dmr", 2000)},
+    "r2": {"request_id": "r2", "cloudwatch_timestamp": 1739516410000, "http_response_code": 200, "total_time": 300,
+           "collectionId": "/hyrax/ngap/collections/C1-POCLOUD/granules/g2.h5", "bes": bes("get.dap", 5000, 1000)},
+    "r3": {"request_id": "r3", "cloudwatch_timestamp": 1739520000000, "http_response_code": 404, "total_time": 20,
+           "collectionId": "/hyrax/ngap/collections/C2-NSIDC_CPRD/granules/g3.h5", "bes": []},
+    "r4": {"request_id": "r4", "time_completed": "2025-02-14T08:00:05+0000", "http_response_code": 500,
+           "total_time": 9000, "collectionId": "/hyrax/ngap/collections/C1-POCLOUD/granules/g4.h5",
+           "bes": bes("get.dap")},
+    "r5": {"request_id": "r5", "http_response_code": 200},
+}
+
+expected = [
+    ["all", "all", 4, 100, 9000, 9000, 9000],
+    ["status", "200", 2, 100, 300, 300, 300],
+    ["status", "404", 1, 20, 20, 20, 20],
+    ["status", "500", 1, 9000, 9000, 9000, 9000],
+    ["provider", "NSIDC_CPRD", 1, 20, 20, 20, 20],
+    ["provider", "POCLOUD", 3, 300, 9000, 9000, 9000],
+    ["bes_action", "-", 1, 20, 20, 20, 20],
+    ["bes_action", "get.dap", 2, 300, 9000, 9000, 9000],
+    ["bes_action", "get.dmr", 1, 100, 100, 100, 100],
+    ["bucket", "2025-02-14T07:00:00Z", 2, 100, 300, 300, 300],
+    ["bucket", "2025-02-14T08:00:00Z", 2, 20, 9000, 9000, 9000],
+]
+
+
+class TestLatencyAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.combined_file = os.path.join(self.directory.name, "hyrax_combined_logs.json")
+        with open(self.combined_file, 'w') as f:
+            json.dump(combined_log, f, indent=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_percentile_table(self):
+        values = np.array([5.0, 1.0, 3.0, 2.0, 4.0, 10.0])
+        groups = np.array([0, 0, 0, 0, 0, 2])
+        table = percentile_table(values, groups, 3, (50, 90))
+        self.assertEqual(table["count"].tolist(), [5, 0, 1])
+        self.assertEqual(table["p50"][0], 3.0)
+        self.assertEqual(table["p90"][0], 5.0)
+        self.assertTrue(np.isnan(table["max"][1]))
+        self.assertEqual(table["max"][2], 10.0)
+
+    def test_exact(self):
+        rows = exact_latency(load_combined_columns(self.combined_file, latency_fields))
+        self.assertEqual([[row[0], row[1]] + [float(v) for v in row[2:]] for row in rows], expected)
+
+    def test_exact_from_sidecar(self):
+        build_sidecar(self.combined_file)
+        rows = exact_latency(load_combined_columns(self.combined_file, latency_fields))
+        self.assertEqual([[row[0], row[1]] + [float(v) for v in row[2:]] for row in rows], expected)
+
+    def test_streaming(self):
+        rows = streaming_latency(self.combined_file)
+        self.assertEqual([row[:3] for row in rows], [row[:3] for row in expected])
+        for row, expected_row in zip(rows, expected):
+            for value, expected_value in zip(row[3:], expected_row[3:]):
+                self.assertAlmostEqual(value, expected_value, delta=expected_value * 0.02)
+
+    def test_bes_timers(self):
+        rows = bes_timer_latency(self.combined_file)
+        self.assertEqual([[row[0], row[1]] + [float(v) for v in row[2:]] for row in rows],
+                         [["bes_timer", "transmit", 3, 2.0, 5.0, 5.0, 5.0]])
+        approximate = bes_timer_latency(self.combined_file, approximate=True)
+        self.assertEqual(approximate[0][:3], ["bes_timer", "transmit", 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
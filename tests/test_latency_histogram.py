@@ -0,0 +1,79 @@
+import unittest
+import tempfile
+import os
+import random
+
+from latency_histogram import LatencyHistogram
+from response_times2 import summarize_timing_files, process_file
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles_within_accuracy(self):
+        random.seed(42)
+        values = [random.lognormvariate(5, 1) for _ in range(20000)]
+        histogram = LatencyHistogram(0.01)
+        for value in values:
+            histogram.record(value)
+
+        values.sort()
+        for p in (50, 90, 99):
+            exact = values[int(p / 100 * (len(values) - 1))]
+            self.assertAlmostEqual(histogram.percentile(p), exact, delta=exact * 0.02)
+        self.assertEqual(histogram.max, values[-1])
+        self.assertEqual(histogram.count, len(values))
+
+    def test_merge(self):
+        left, right, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for value in range(1, 1000):
+            (left if value % 2 else right).record(value)
+            both.record(value)
+        left.merge(right)
+        self.assertEqual(left.summary(), both.summary())
+        self.assertEqual(LatencyHistogram.from_dict(left.to_dict()).summary(), both.summary())
+
+    def test_empty(self):
+        self.assertIsNone(LatencyHistogram().percentile(50))
+
+
+class TestSummarizeTimingFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.files = []
+        for lines in (["Time to gather 10 responses: 100.0 ms", "Time to gather 10 responses: 300.0 ms",
+                       "Error: 404; Not Found"],
+                      ["Time to gather 10 responses: 200.0 ms"]):
+            f = tempfile.NamedTemporaryFile(mode='w', suffix="_timing.txt", delete=False)
+            f.write("\n".join(lines) + "\n")
+            f.close()
+            self.files.append(f.name)
+
+    def tearDown(self):
+        for name in self.files:
+            os.remove(name)
+
+    def test_summaries(self):
+        per_file, aggregate = summarize_timing_files(self.files, jobs=2)
+        self.assertEqual(sorted(per_file[self.files[0]]), [200, 404])
+        self.assertEqual(per_file[self.files[0]][404].max, 300.0)
+        self.assertEqual(aggregate[200].count, 2)
+        self.assertEqual(aggregate[200].max, 200.0)
+        self.assertAlmostEqual(aggregate[200].percentile(50), 100.0, delta=1.0)
+
+    def test_csv_in_the_same_pass(self):
+        # The workers write the same csv as process_file(), in the order of the files
+        with tempfile.TemporaryDirectory() as directory:
+            expected, output = os.path.join(directory, "expected.csv"), os.path.join(directory, "output.csv")
+            process_file(self.files, expected)
+            per_file, aggregate = summarize_timing_files(self.files, jobs=2, output_file=output)
+            with open(expected) as a, open(output) as b:
+                self.assertEqual(b.read(), a.read())
+            self.assertEqual(aggregate[200].count, 2)
+            self.assertEqual(sorted(os.listdir(directory)), ["expected.csv", "output.csv"])
+            summarize_timing_files(self.files, jobs=1, output_file=output, summarize=False)
+            with open(expected) as a, open(output) as b:
+                self.assertEqual(b.read(), a.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
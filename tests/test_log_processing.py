@@ -0,0 +1,167 @@
+import unittest
+import tempfile
+import os
+import csv
+import io
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest import mock
+
+from log_processing import split_log_line, log_line_to_record, export_logs_to_parquet, follow_log
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+raw_log = [
+    "1739516409|&|h-8bfd6a17|&|29751|&|request|&|OLFS|&|10.11.255.129|&|Wget|&|8A69DB9E|&|dongwu|&|1739516409753"
+    "|&|exec-7_37_4b6c1400|&|HTTP-GET|&|/hyrax/ngap/x.h5.dmr.html|&|-|&|get.dmr|&|dap|&|collections/x.h5|&|-\n",
+    "1739516409|&|h-8bfd6a17|&|29751|&|info|&|NgapOwnedContainer - Memory Cache miss\n",
+    "1739516412|&|h-8bfd6a17|&|29752|&|error|&|ERROR! HttpError (CurlUtils.cc:798)\n",
+    "1739516415|&|3120|&|timing|&|elapsed-us|&|1200|&|start-us|&|1739516415000000\n",
+    "this is not a log line\n",
+]
+
+
+class TestSplitLogLine(unittest.TestCase):
+
+    def test_instance_id_layout(self):
+        self.assertEqual(split_log_line(raw_log[1]),
+                         (1739516409, "h-8bfd6a17", 29751, "info", "NgapOwnedContainer - Memory Cache miss"))
+
+    def test_old_layout(self):
+        self.assertEqual(split_log_line(raw_log[3]),
+                         (1739516415, None, 3120, "timing", "elapsed-us|&|1200|&|start-us|&|1739516415000000"))
+
+    def test_bad_line(self):
+        self.assertIsNone(split_log_line(raw_log[4]))
+
+
+class TestLogLineToRecord(unittest.TestCase):
+
+    def test_request(self):
+        record = log_line_to_record(raw_log[0])
+        self.assertEqual(record["hyrax-type"], "request")
+        self.assertEqual(record["hyrax-request-id"], "exec-7_37_4b6c1400")
+        self.assertEqual(record["hyrax-olfs-start-time"], 1739516409753)
+        self.assertEqual(record["hyrax-bes-action"], "get.dmr")
+        self.assertEqual(record["hyrax-ce"], "-")
+
+    def test_info(self):
+        self.assertEqual(log_line_to_record(raw_log[1], prefix=""),
+                         {"time": 1739516409, "instance-id": "h-8bfd6a17", "pid": 29751, "type": "info",
+                          "message": "NgapOwnedContainer - Memory Cache miss"})
+
+    def test_timing(self):
+        line = "1739516415|&|h-1|&|3120|&|timing|&|elapsed-us|&|1200|&|start-us|&|17|&|stop-us|&|1217" \
+               "|&|exec-7_37|&|Profile timing: Request granule record from CMR - collections/x.h5\n"
+        record = log_line_to_record(line)
+        self.assertEqual(record["hyrax-elapsed-us"], 1200)
+        self.assertEqual(record["hyrax-start-us"], 17)
+        self.assertEqual(record["hyrax-request-id"], "exec-7_37")
+        self.assertEqual(record["hyrax-timer-name"],
+                         "Profile timing: Request granule record from CMR - collections/x.h5")
+
+
+@unittest.skipIf(pq is None, "pyarrow is not installed")
+class TestExportLogsToParquet(unittest.TestCase):
+
+    def setUp(self):
+        self.log_file = tempfile.NamedTemporaryFile(mode='w+', suffix=".log", delete=False)
+        self.log_file.writelines(raw_log)
+        self.log_file.close()
+        self.parquet_file = self.log_file.name.replace(".log", ".parquet")
+
+    def tearDown(self):
+        os.remove(self.log_file.name)
+        if os.path.exists(self.parquet_file):
+            os.remove(self.parquet_file)
+
+    def test_export(self):
+        export_logs_to_parquet(self.log_file.name, self.parquet_file, batch_size=2)
+
+        parquet_file = pq.ParquetFile(self.parquet_file)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+
+        table = parquet_file.read()
+        self.assertEqual(table.column("time").to_pylist(), [1739516409, 1739516409, 1739516412, 1739516415])
+        self.assertEqual(table.column("type").to_pylist(), ["request", "info", "error", "timing"])
+        self.assertEqual(table.column("pid").to_pylist(), [29751, 29751, 29752, 3120])
+        self.assertEqual(table.column("message").to_pylist()[1], "NgapOwnedContainer - Memory Cache miss")
+
+    def test_read_one_column(self):
+        export_logs_to_parquet(self.log_file.name, self.parquet_file)
+        table = pq.read_table(self.parquet_file, columns=["type"])
+        self.assertEqual(table.column_names, ["type"])
+
+
+class TestFollowLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.directory.name, "bes.log")
+        self.csv_file = os.path.join(self.directory.name, "bes.csv")
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)  # the per-PID files are written in the current directory
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def follow(self, steps, **options):
+        """
+        Run follow_log() with a clock that only moves when it sleeps; each sleep first runs the next step.
+        """
+        clock = {"now": 0.0}
+
+        def sleep(seconds):
+            if steps:
+                steps.pop(0)()
+            clock["now"] += seconds
+
+        fake_time = SimpleNamespace(monotonic=lambda: clock["now"], sleep=sleep)
+        with mock.patch("log_processing.time", fake_time), redirect_stdout(io.StringIO()):
+            return follow_log(self.log_file, self.csv_file, poll_interval=0.02, idle_timeout=0.1, **options)
+
+    def append(self, text):
+        with open(self.log_file, 'a') as f:
+            f.write(text)
+
+    def rotate(self, text):
+        os.rename(self.log_file, self.log_file + ".1")
+        with open(self.log_file, 'w') as f:
+            f.write(text)
+
+    def test_follow_with_rotation(self):
+        with open(self.log_file, 'w') as f:
+            f.writelines(raw_log[:2])
+
+        # The old file ends with an unterminated line when it is rotated
+        counts = self.follow([lambda: self.append(raw_log[2] + raw_log[1].rstrip("\n")),
+                              lambda: self.rotate(raw_log[3])], split=True)
+
+        self.assertEqual(counts["lines"], 5)
+        self.assertEqual(counts["request"], 1)
+        self.assertEqual(counts["info"], 2)
+        self.assertEqual(counts["error"], 1)
+        self.assertEqual(counts["timing"], 1)
+        with open(self.csv_file, 'r') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[2][0], "2025-02-14T07:00:12Z")
+        with open("bes_pid_29751.csv", 'r') as f:
+            self.assertEqual(len(list(csv.reader(f))), 3)
+
+    def test_follow_interrupted(self):
+        with open(self.log_file, 'w') as f:
+            f.write(raw_log[0] + raw_log[2].rstrip("\n"))
+
+        def interrupt():
+            raise KeyboardInterrupt
+
+        counts = self.follow([interrupt])
+        self.assertEqual((counts["lines"], counts["error"]), (2, 1))
+
+if __name__ == '__main__':
+    unittest.main()
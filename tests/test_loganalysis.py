@@ -0,0 +1,96 @@
+import unittest
+import tempfile
+import os
+import io
+import json
+import subprocess
+import sys
+from contextlib import redirect_stdout, redirect_stderr
+
+from loganalysis import common
+from loganalysis.cli import main, commands, tools_dir, stats_options
+from loganalysis.stats import recorder, stage
+
+
+class TestLogAnalysis(unittest.TestCase):
+
+    def test_common(self):
+        self.assertEqual(common.convert_iso_to_unix("2025-06-11T00:00:00+0000"), 1749600000)
+        self.assertEqual(common.provider_of("/hyrax/ngap/collections/C1234-POCLOUD/granules/g"), "POCLOUD")
+        self.assertEqual(common.provider_of(None), common.no_provider)
+
+    def test_commands_exist(self):
+        for command, (name, _) in commands.items():
+            path = os.path.join(tools_dir, name if name.endswith(".py") else name + ".py")
+            self.assertTrue(os.path.exists(path), f"{command}: {path}")
+
+    def test_usage(self):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(main(["-h"]), 0)
+        self.assertIn("merge", out.getvalue())
+        with redirect_stderr(io.StringIO()):
+            self.assertEqual(main(["no-such-command"]), 2)
+
+    def test_dispatch(self):
+        # reorder-records.py is loaded from its file
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "in.json")
+            result = os.path.join(directory, "out.json")
+            with open(source, 'w') as f:
+                json.dump([{"b": 1, "a": 2}], f)
+            argv = sys.argv
+            try:
+                with redirect_stdout(io.StringIO()):
+                    main(["reorder", "-i", source, "-o", result, "-f", "a"])
+            finally:
+                sys.argv = argv
+            with open(result) as f:
+                self.assertEqual(list(json.load(f)[0]), ["a", "b"])
+
+    def test_stats_options(self):
+        args, options = stats_options(["-i", "x", "--stats", "--profile=join", "-v"])
+        self.assertEqual(args, ["-i", "x", "-v"])
+        self.assertEqual(options, {"stats": "-", "tracemalloc": False, "profile": "join"})
+        self.assertEqual(stats_options(["--stats=out.json"])[1]["stats"], "out.json")
+        self.assertEqual(stats_options(["--stats-tracemalloc"])[1]["stats"], "-")
+
+    def test_stats(self):
+        # With the recorder off a stage records nothing
+        with stage("load") as s:
+            s.records_in = 1
+        self.assertEqual(recorder.stages, [])
+
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "in.json")
+            right = os.path.join(directory, "right.json")
+            result = os.path.join(directory, "out.json")
+            stats = os.path.join(directory, "stats.json")
+            with open(source, 'w') as f:
+                json.dump([{"b": 1, "a": 2}], f)
+            with open(right, 'w') as f:
+                json.dump([{"b": 1, "c": 4}], f)
+            argv = sys.argv
+            try:
+                with redirect_stdout(io.StringIO()):
+                    main(["join", "-l", source, "-r", right, "-k", "b", "-o", result, f"--stats={stats}"])
+            finally:
+                sys.argv = argv
+            self.assertFalse(recorder.enabled)
+            with open(stats) as f:
+                report = json.load(f)
+        self.assertEqual(report["tool"], "join")
+        self.assertEqual([s["name"] for s in report["stages"]], ["load", "index", "join", "write"])
+        self.assertEqual(report["stages"][2]["records_out"], 1)
+        self.assertGreater(report["peak_rss_mb"], 0)
+
+    def test_lazy_imports(self):
+        # Loading the tools that do not need them must not import boto3 or numpy
+        code = ("import sys, loganalysis.cli, download_logs, combined_report, combined_query, anomaly_detector; "
+                "print(sorted(m for m in ('boto3', 'numpy') if m in sys.modules))")
+        result = subprocess.run([sys.executable, "-c", code], cwd=tools_dir, capture_output=True, text=True)
+        self.assertEqual(result.stdout.strip(), "[]", result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import tempfile
+import os
+import json
+
+from message_index import open_index, encode_postings, decode_postings, terms_of
+from tests.test_cluster_errors import bes_log
+
+
+class TestMessageIndex(unittest.TestCase):
+
+    def test_postings(self):
+        numbers = [0, 3, 4, 200, 70000]
+        self.assertEqual(decode_postings(encode_postings(numbers)), numbers)
+        self.assertEqual(terms_of("NgapApi.cc:304 Memory Cache"), ["ngapapi", "cc", "304", "memory", "cache"])
+
+    def test_search(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bes_log.json")
+            with open(path, 'w') as f:
+                json.dump(bes_log, f, indent=2)
+            index = open_index(path)
+            self.assertTrue(os.path.exists(path + ".midx"))
+            self.assertEqual(index.count, len(bes_log))
+
+            results = index.search("BESUtil.cc:298 not found")
+            self.assertEqual([request_id for request_id, record in results], ["req-1", "req-1", "req-2"])
+            self.assertEqual(results[0][1], bes_log[1])
+            self.assertEqual(index.search("besutil ffee99")[0][1], bes_log[3])
+            self.assertEqual(index.search("no-such-term"), [])
+
+            self.assertEqual(len(index.search("memory cache miss", phrase=True)), 1)
+            self.assertEqual(index.search("miss cache memory", phrase=True), [])
+            self.assertEqual(len(index.search("miss cache memory")), 1)
+
+            # Rewriting the log makes the index out of date, so it is rebuilt
+            with open(path, 'w') as f:
+                json.dump(bes_log[:2], f)
+            index = open_index(path)
+            self.assertEqual(index.count, 2)
+            self.assertEqual(len(index.search("besutil")), 1)
+
+    def test_raw_bes_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bes.log")
+            with open(path, 'w') as f:
+                f.write("1739516400|&|h-1|&|10|&|error|&|BESUtil.cc:298 Could not open /a/b\n")
+                f.write("1739516401|&|h-1|&|10|&|info|&|NgapApi.cc:304 The server timed out\n")
+            results = open_index(path).search("ngapapi.cc:304")
+            self.assertEqual(len(results), 1)
+            self.assertEqual(results[0][1]["hyrax-message"], "NgapApi.cc:304 The server timed out")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import tempfile
+import os
+import io
+import sys
+import json
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import mock
+
+from loganalysis.cli import load_tool
+
+merge = load_tool("ngap-logs.py")
+
+requests = [{"request_id": "A", "user_id": "u1"}, {"request_id": "B", "user_id": "u2"},
+            {"request_id": "C", "user_id": "u3"}, {"request_id": "A", "user_id": "u1"}]
+responses = [{"request_id": "A", "http_response_code": 200}, {"request_id": "C", "http_response_code": 404},
+             {"request_id": "C", "http_response_code": 500}, {"request_id": "Z", "http_response_code": 200}]
+bes = [{"request-id": "A", "type": "request"}, {"request-id": "B", "type": "info"},
+       {"request-id": "A", "type": "timing"}]
+edl = [{"request_id": "A", "edl_time": 1}, {"request_id": "A", "edl_time": 2}, {"request_id": "C", "edl_time": 3}]
+
+
+class TestNgapLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.files = {}
+        for name, records in (("request", requests), ("response", responses), ("bes", bes), ("edl", edl)):
+            self.files[name] = os.path.join(self.directory.name, name + ".json")
+            with open(self.files[name], 'w') as f:
+                json.dump(records, f)
+        self.output = os.path.join(self.directory.name, "combined.json")
+        # Other tests load the module with the 'hyrax-' BES keys; these logs have none
+        patcher = mock.patch.multiple(merge, bes_log_prefix="", bes_log_type_key="type",
+                                      bes_log_request_id_key="request-id")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def run_main(self, *options):
+        argv = ["ngap-logs.py", "-p", "", "-q", self.files["request"], "-r", self.files["response"],
+                "-b", self.files["bes"], "-o", self.output, *options]
+        with mock.patch.object(sys, "argv", argv), redirect_stderr(io.StringIO()), redirect_stdout(io.StringIO()):
+            merge.main()
+        with open(self.output) as f:
+            return json.load(f)
+
+    def test_matches_get_request_record(self):
+        # The one-pass merge writes what the per-request get_request_record() builds for each request
+        orphans, written = merge.get_merged_sources(merge.default_sources(self.files["request"],
+                                                                          self.files["response"], self.files["bes"]),
+                                                    self.output)
+        self.assertEqual(written, {"A", "B", "C"})
+        self.assertEqual(list(orphans["response_log"]), ["Z"])
+        with open(self.output) as f:
+            merged = json.load(f)
+        expected = {request_id: merge.get_request_record(request_id, requests, responses, bes)
+                    for request_id in ("A", "B", "C")}
+        self.assertEqual(merged, expected)
+        self.assertEqual(merged["B"]["ERROR"], "Failed to locate matching record in response_log")
+        self.assertEqual(merged["C"]["http_response_code"], 500)
+
+    def test_sort_merge_duplicate_request(self):
+        # 'A' is in the request log twice; both merges write it once, with the same records
+        indexed = self.run_main()
+        with open(self.output) as f:
+            self.assertEqual(f.read().count('"A":'), 1)
+        self.assertEqual(self.run_main("-s"), indexed)
+        with open(self.output) as f:
+            self.assertEqual(f.read().count('"A":'), 1)
+        self.assertEqual(list(indexed), ["A", "B", "C"])
+
+    def test_sources(self):
+        merged = self.run_main("-S", "edl", self.files["edl"], "request_id", "many")
+        self.assertEqual([record["edl_time"] for record in merged["A"]["edl"]], [1, 2])
+        self.assertEqual(merged["B"]["edl"], [])
+
+        # Each 'one' source that has no record for a request keeps its own error
+        merged = self.run_main("-S", "edl1", self.files["edl"])
+        self.assertEqual(merged["A"]["edl_time"], 2)
+        self.assertEqual((merged["B"]["ERROR"], merged["B"]["ERROR_edl1"]),
+                         ("Failed to locate matching record in response_log",
+                          "Failed to locate matching record in edl1"))
+        self.assertNotIn("ERROR_edl1", merged["C"])
+
+        for bad in (["edl"], ["edl", self.files["edl"], "request_id", "some"]):
+            with self.assertRaises(SystemExit):
+                self.run_main("-S", *bad)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import tempfile
+import os
+import json
+
+from loganalysis.cli import load_tool
+
+reorder = load_tool("reorder-records.py")
+
+bes = [{"hyrax-message": "m", "hyrax-type": "info", "hyrax-time": 1, "hyrax-pid": 7},
+       {"hyrax-type": "timing", "a": 1}]
+
+
+class TestReorderRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.source = os.path.join(self.directory.name, "in.json")
+        self.result = os.path.join(self.directory.name, "out.json")
+
+    def reorder(self, data, fields=None):
+        with open(self.source, 'w') as f:
+            json.dump(data, f, indent=2)
+        reorder.reorder_json_fields(self.source, self.result, fields)
+        with open(self.result) as f:
+            text = f.read()
+        return text, json.loads(text)
+
+    def test_array(self):
+        text, records = self.reorder(bes)
+        self.assertEqual([list(record) for record in records],
+                         [["hyrax-time", "hyrax-pid", "hyrax-type", "hyrax-message"], ["hyrax-type", "a"]])
+        # The same text the whole-list json.dump() wrote
+        self.assertEqual(text, json.dumps(records, indent=4))
+
+    def test_combined_log(self):
+        combined = {"A": {"request_id": "A", "user_id": "u", "bes": bes}, "B": {"request_id": "B", "bes": []}}
+        text, records = self.reorder(combined)
+        self.assertEqual(list(records), ["A", "B"])
+        self.assertEqual(list(records["A"]), ["request_id", "user_id", "bes"])
+        self.assertEqual(list(records["A"]["bes"][0]), ["hyrax-time", "hyrax-pid", "hyrax-type", "hyrax-message"])
+        self.assertEqual(text, json.dumps(records, indent=4))
+
+    def test_fields(self):
+        _, records = self.reorder(bes, ["hyrax-message", "hyrax-pid"])
+        self.assertEqual(list(records[0]), ["hyrax-message", "hyrax-pid", "hyrax-type", "hyrax-time"])
+        # No priority fields: the records are written as they are
+        _, records = self.reorder(bes, [])
+        self.assertEqual([list(record) for record in records], [list(record) for record in bes])
+
+
+if __name__ == '__main__':
+    unittest.main()
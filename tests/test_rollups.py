@@ -0,0 +1,73 @@
+import unittest
+import tempfile
+import os
+import json
+
+from combined_columns import build_sidecar, load_combined_columns
+from rollups import rollup, rollup_rows, rollup_fields, provider_of, bucket_seconds
+
+# Two minutes of records for two providers
+combined_log = {
+    "r1": {"request_id": "r1", "cloudwatch_timestamp": 1739516400000, "http_response_code": 200,
+           "collectionId": "/hyrax/ngap/collections/C1-POCLOUD/granules/g1.h5", "output_size": 100},
+    "r2": {"request_id": "r2", "cloudwatch_timestamp": 1739516410000, "http_response_code": 503,
+           "collectionId": "/hyrax/ngap/collections/C1-POCLOUD/granules/g2.h5", "output_size": -1},
+    "r3": {"request_id": "r3", "cloudwatch_timestamp": 1739516420000, "http_response_code": 404,
+           "collectionId": "/hyrax/ngap/collections/C2-NSIDC_CPRD/granules/g3.h5", "output_size": 7},
+    "r4": {"request_id": "r4", "time_completed": "2025-02-14T07:01:05+0000", "http_response_code": 200,
+           "collectionId": "/hyrax/ngap/collections/C1-POCLOUD/granules/g4.h5", "output_size": 50},
+    "r5": {"request_id": "r5", "cloudwatch_timestamp": 1739516470000, "collectionId": "/hyrax/docs/x.html"},
+    "r6": {"request_id": "r6", "http_response_code": 200},
+}
+
+
+class TestRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.combined_file = os.path.join(self.directory.name, "hyrax_combined_logs.json")
+        with open(self.combined_file, 'w') as f:
+            json.dump(combined_log, f, indent=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_provider_of(self):
+        self.assertEqual(provider_of("/hyrax/ngap/collections/C2938661904-NSIDC_CPRD/granules/x.h5"), "NSIDC_CPRD")
+        self.assertEqual(provider_of("/hyrax/docs/x.html"), "-")
+        self.assertEqual(provider_of(None), "-")
+
+    def test_bucket_seconds(self):
+        self.assertEqual(bucket_seconds("hour"), 3600)
+        self.assertEqual(bucket_seconds("300"), 300)
+        with self.assertRaises(ValueError):
+            bucket_seconds("0")
+
+    def check_rows(self, columns):
+        result = rollup(columns, 60)
+        self.assertEqual(result["untimed"], 1)
+        rows = list(rollup_rows(result, totals=True))
+        # time, provider, requests, 1xx, 2xx, 3xx, 4xx, 5xx, other, output_bytes
+        self.assertEqual(rows, [
+            ["2025-02-14T07:00:00Z", "NSIDC_CPRD", 1, 0, 0, 0, 1, 0, 0, 7],
+            ["2025-02-14T07:00:00Z", "POCLOUD", 2, 0, 1, 0, 0, 1, 0, 100],
+            ["2025-02-14T07:00:00Z", "ALL", 3, 0, 1, 0, 1, 1, 0, 107],
+            ["2025-02-14T07:01:00Z", "-", 1, 0, 0, 0, 0, 0, 1, 0],
+            ["2025-02-14T07:01:00Z", "POCLOUD", 1, 0, 1, 0, 0, 0, 0, 50],
+            ["2025-02-14T07:01:00Z", "ALL", 2, 0, 1, 0, 0, 0, 1, 50],
+        ])
+
+    def test_rollup_from_json(self):
+        self.check_rows(load_combined_columns(self.combined_file, rollup_fields))
+
+    def test_rollup_from_sidecar(self):
+        build_sidecar(self.combined_file)
+        self.check_rows(load_combined_columns(self.combined_file, rollup_fields))
+
+    def test_empty(self):
+        result = rollup({}, 60)
+        self.assertEqual(list(rollup_rows(result)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
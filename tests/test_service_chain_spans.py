@@ -0,0 +1,78 @@
+import unittest
+import tempfile
+import os
+import json
+
+from json_stream import JsonObjectWriter
+from service_chain_spans import request_spans, add_spans, stage_totals, profile_span
+
+
+def timing(name: str, start: int, elapsed: int) -> dict:
+    return {"hyrax-type": "timing", "hyrax-request-id": "req-1", "hyrax-start-us": start,
+            "hyrax-elapsed-us": elapsed, "hyrax-timer-name": "Profile timing: " + name}
+
+
+# A request: the DAP request holds the CMR lookup, the DMR++ fetch and two parallel SuperChunk reads
+bes = [
+    {"hyrax-type": "request", "hyrax-request-id": "req-1"},
+    timing("Handle DAP request", 1000, 10000),
+    timing("Get granule record from CMR - C1-POCLOUD", 1500, 2000),
+    timing("Get DMR++ from S3", 3600, 1400),
+    timing("Get signed url from TEA", 3700, 300),
+    timing("Get SuperChunk data - 1", 5500, 3000),
+    timing("Get SuperChunk data - 2", 6000, 4500),
+    {"hyrax-type": "timing", "hyrax-request-id": "req-1", "hyrax-elapsed-us": 5,
+     "hyrax-timer-name": "ELAPSED_TIME"},
+]
+
+
+class TestServiceChainSpans(unittest.TestCase):
+
+    def test_profile_span(self):
+        span = profile_span(bes[2])
+        self.assertEqual((span.name, span.details, span.start, span.elapsed),
+                         ("Get granule record from CMR", "C1-POCLOUD", 1500, 2000))
+        self.assertIsNone(profile_span(bes[0]))
+        self.assertIsNone(profile_span(bes[-1]))
+
+    def test_tree(self):
+        spans = request_spans(bes)
+        self.assertEqual((spans["start_us"], spans["elapsed_us"]), (1000, 10000))
+        root, = spans["tree"]
+        self.assertEqual(root["name"], "Handle DAP request")
+        self.assertEqual([child["name"] for child in root["children"]],
+                         ["Get granule record from CMR", "Get DMR++ from S3", "Get SuperChunk data",
+                          "Get SuperChunk data"])
+        self.assertEqual(root["children"][1]["children"][0]["name"], "Get signed url from TEA")
+        # The overlapping SuperChunk reads cover 5500-10500, so only 10000 - 2000 - 1400 - 5000 is self time
+        self.assertEqual(root["self_us"], 1600)
+        self.assertEqual(root["children"][1]["self_us"], 1100)
+
+    def test_critical_path(self):
+        spans = request_spans(bes)
+        path = spans["critical_path"]
+        self.assertEqual([(step["name"], step["critical_us"]) for step in path],
+                         [("Handle DAP request", 1600), ("Get granule record from CMR", 2000),
+                          ("Get DMR++ from S3", 1100), ("Get signed url from TEA", 300),
+                          ("Get SuperChunk data", 500), ("Get SuperChunk data", 4500)])
+        self.assertEqual(sum(step["critical_us"] for step in path), spans["elapsed_us"])
+        self.assertEqual(spans["stages"]["Get SuperChunk data"],
+                         {"count": 2, "elapsed_us": 7500, "self_us": 7500, "critical_us": 5000})
+
+    def test_stage_totals(self):
+        self.assertIsNone(request_spans(bes[:1]))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "combined.json")
+            with open(path, 'w') as f, JsonObjectWriter(f, indent=2) as writer:
+                writer.write("req-1", add_spans({"request_id": "req-1", "bes": bes}))
+                writer.write("req-2", {"request_id": "req-2", "bes": bes})
+                writer.write("req-3", {"request_id": "req-3", "bes": []})
+            with open(path) as f:
+                self.assertIn("spans", json.load(f)["req-1"])
+            totals = stage_totals(path)
+            self.assertEqual(totals["Get SuperChunk data"]["requests"], 2)
+            self.assertEqual(totals["Handle DAP request"]["critical_us"], 3200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import tempfile
+import os
+
+from json_stream import JsonObjectWriter
+from sqlite_store import connect, load_combined_log, record_rows
+
+
+def lifecycle(request_id: str, code, collection: str, bes: list) -> dict:
+    record = {"cloudwatch_timestamp": 1743066000000, "request_id": request_id, "user_id": "u1",
+              "user_ip": "10.0.0.1", "collectionId": collection, "job_ids": ["N/A"]}
+    if code is not None:
+        record.update({"http_response_code": code, "time_completed": "2025-03-27T09:00:01Z", "total_time": 250,
+                       "output_size": 100})
+    else:
+        record["ERROR"] = "Failed to locate matching record in response_log"
+    return {**record, "bes": bes}
+
+
+bes = [{"hyrax-type": "request", "hyrax-request-id": "A", "hyrax-time": 1743066000, "hyrax-pid": "12",
+        "hyrax-bes-action": "get.dap", "hyrax-url-path": "/x"},
+       {"hyrax-type": "timing", "hyrax-request-id": "A", "hyrax-time": 1743066001, "hyrax-elapsed-us": "900",
+        "hyrax-timer-name": "ELAPSED_TIME"}]
+
+records = [lifecycle("A", 200, "/hyrax/ngap/collections/C1-POCLOUD/granules/g.dap.nc4", bes),
+           lifecycle("B", 404, "/hyrax/CMR/x", []),
+           lifecycle("C", 401, "/hyrax/login", []),
+           lifecycle("D", None, "", [])]
+
+
+class TestSqliteStore(unittest.TestCase):
+
+    def test_record_rows(self):
+        request, response, bes_rows = record_rows(records[0], 1)
+        self.assertEqual(request[:8], ("A", 1743066000.0, "u1", "10.0.0.1",
+                                       "/hyrax/ngap/collections/C1-POCLOUD/granules/g.dap.nc4", "POCLOUD", "get.dap", 2))
+        self.assertEqual(response, ("A", 200, "2025-03-27T09:00:01Z", 250, 100))
+        self.assertEqual(bes_rows[1][:8], ("A", 1, 1743066001, "timing", None, None, "ELAPSED_TIME", 900))
+        self.assertIsNone(record_rows(records[3], 1)[1])
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "combined.json")
+            with open(path, 'w') as f, JsonObjectWriter(f, indent=2) as writer:
+                for record in records:
+                    writer.write(record["request_id"], record)
+            connection = connect(os.path.join(directory, "logs.sqlite"))
+            try:
+                self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+                self.assertEqual(load_combined_log(connection, path, batch_size=3), 4)
+                # Loading again replaces the requests instead of adding to them
+                load_combined_log(connection, path)
+                query = connection.execute
+                self.assertEqual(query("SELECT COUNT(*) FROM requests").fetchone()[0], 4)
+                self.assertEqual(query("SELECT COUNT(*) FROM bes").fetchone()[0], 2)
+                self.assertEqual(query("SELECT COUNT(*) FROM loads").fetchone()[0], 2)
+                self.assertEqual(dict(query("SELECT http_response_code, records FROM response_codes").fetchall()),
+                                 {None: 1, 200: 1, 401: 1, 404: 1})
+                self.assertEqual(query("SELECT request_id, service FROM requests_404").fetchall(), [("B", "cmr")])
+                self.assertEqual(query("SELECT COUNT(*) FROM unmatched_requests").fetchone()[0], 3)
+                self.assertEqual(query("SELECT * FROM user_ids_401").fetchall(), [("u1", 1, 1)])
+                self.assertEqual(query("SELECT records FROM provider_codes WHERE provider = 'POCLOUD'").fetchall(),
+                                 [(1,)])
+            finally:
+                connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
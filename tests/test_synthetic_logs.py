@@ -0,0 +1,69 @@
+import unittest
+import tempfile
+import os
+import re
+
+from benchmark import measure, prepare_benchmark, previous_run
+from json_stream import iter_json_records
+from log_processing import read_bes_log_records
+from synthetic_logs import generate_logs
+
+
+class TestSyntheticLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.result = generate_logs(self.directory.name, scale=0.05, seed=7, bes_format="both")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_logs(self):
+        counts = self.result["counts"]
+        files = self.result["files"]
+        self.assertEqual(counts["request_log"], 607)
+        requests = list(iter_json_records(files["request_log"]))
+        responses = list(iter_json_records(files["response_log"]))
+        bes = list(iter_json_records(files["bes_log"]))
+        self.assertEqual((len(requests), len(responses), len(bes)),
+                         (counts["request_log"], counts["response_log"], counts["bes_log"]))
+        self.assertTrue(all(re.match(r"https-openssl-apr-8443-exec-\d+_\d+_[0-9a-f-]{36}$", r["request_id"])
+                            for r in requests))
+        # Each log is in time order
+        for records, key in ((requests, "cloudwatch_timestamp"), (responses, "cloudwatch_timestamp"),
+                             (bes, "hyrax-time")):
+            times = [record[key] for record in records]
+            self.assertEqual(times, sorted(times))
+        # Some requests never reach the BES and a few get errors
+        with_bes = {record["hyrax-request-id"] for record in bes if record["hyrax-type"] == "request"}
+        self.assertLess(len(with_bes), len(requests))
+        self.assertTrue(any(record["http_response_code"] >= 500 for record in responses))
+        self.assertTrue(any(record["http_response_code"] == 404 for record in responses))
+        # The raw bes.log has the same records
+        self.assertEqual(list(read_bes_log_records(files["bes_raw_log"])), bes)
+
+    def test_same_seed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            generate_logs(directory, scale=0.05, seed=7)
+            for name in ("request_log.json", "bes_log.json"):
+                with open(os.path.join(directory, name)) as a, \
+                        open(os.path.join(self.directory.name, name)) as b:
+                    self.assertEqual(a.read(), b.read())
+
+    def test_benchmark(self):
+        result = measure("download-write", self.result)
+        self.assertEqual(result["records"], 607)
+        self.assertGreater(result["peak_rss_mb"], 0)
+        # The merge report needs is made beforehand, not in the measured run
+        with tempfile.TemporaryDirectory() as work_dir:
+            prepare_benchmark("report", self.result, work_dir)
+            self.assertTrue(os.path.exists(os.path.join(work_dir, "hyrax_combined_logs.json")))
+            self.assertEqual(measure("report", self.result, work_dir=work_dir)["records"], 607)
+        history = [{"scale": 1.0, "seed": 0, "results": {}}, {"scale": 0.05, "seed": 7, "results": {"x": 1}},
+                   {"scale": 0.05, "seed": 7, "tracemalloc": True, "results": {}}]
+        self.assertEqual(previous_run(history, 0.05, 7)["results"], {"x": 1})
+        self.assertIsNone(previous_run(history, 2.0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()